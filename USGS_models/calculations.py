@@ -1,99 +1,665 @@
-"""Library of susceptibility and coverage calculation functions"""
+"""
+Library of susceptibility and coverage calculation functions
+
+Every function takes an optional out buffer the result is written into (it must have the broadcast shape of the inputs).
+With numexpr installed and using more than one thread each function is evaluated as a single fused pass over its inputs
+(on one thread NumPy's vectorised exp / log are faster). Otherwise they are evaluated with in-place NumPy operations
+on one or two scratch buffers, giving the same values as the unfused expressions.
+The calculate_*_probability functions calculate a model's susceptibility and coverage together.
+
+Terms shared between models (see SHARED_TERMS) can be passed in precalculated, e.g. log_pgv instead of pgv,
+so a caller evaluating several models only calculates each once.
+"""
 
 import numpy as np
 
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+ZHU2015_SUSCEPTIBILITY = (
+    "24.10 + compound_topographic_index * 0.355 + log(vs30) * -4.784"
+)
+ZHU2015_COVERAGE = "0.81 / (exp(-(log(scaled_pga) * 2.067 + susceptibility)) + 1)"
+
+ZHU2016_SUSCEPTIBILITY = (
+    "8.801"
+    " + log(vs30) * -1.918"
+    " + precipitation * 0.0005408"
+    # np.minimum, including its NaN propagation
+    " + where((distance_to_coast < distance_to_rivers) | (distance_to_coast != distance_to_coast),"
+    " distance_to_coast, distance_to_rivers) * -0.2054"
+    " + water_table_depth * -0.0333"
+)
+ZHU2016_COVERAGE = (
+    "0.4915 / (1 + 42.40 * exp(-9.165 / (exp(-(log(pgv) * 0.334 + susceptibility)) + 1))) ** 2"
+)
+
+ZHU2016_COASTAL_SUSCEPTIBILITY = (
+    "12.435"
+    " + log(vs30) * -2.615"
+    " + precipitation * 0.0005556"
+    " + sqrt(distance_to_coast) * -0.0287"
+    " + distance_to_rivers * 0.0666"
+    " + sqrt(distance_to_coast) * distance_to_rivers * -0.0369"
+)
+ZHU2016_COASTAL_COVERAGE = (
+    "0.4208 / (1 + 62.59 * exp(-11.43 / (exp(-(susceptibility + log(pgv) * 0.301)) + 1))) ** 2"
+)
+
+JESSEE2017_SUSCEPTIBILITY = (
+    "-6.3"
+    " + arctan(slope) * 0.06 * 180 / {pi}"
+    " + rock * 1"
+    " + compound_topographic_index * 0.03"
+    " + landcover * 1.0"
+).format(pi=repr(np.pi))
+# p is used three times, so it is evaluated in its own pass rather than recalculated for each use
+JESSEE2017_P = (
+    "1 / (exp(-(log(pgv) * 1.65 + susceptibility + log(pgv) * arctan(slope) * 180 / {pi} * 0.01)) + 1)"
+).format(pi=repr(np.pi))
+JESSEE2017_COVERAGE = "exp(-7.592 + 5.237 * p - 3.042 * p ** 2 + 4.035 * p ** 3)"
+
+
+# Precalculated term keyword arguments, and the expression each replaces
+SHARED_TERMS = {
+    "log_pgv": "log(pgv)",
+    "log_scaled_pga": "log(scaled_pga)",
+    "log_vs30": "log(vs30)",
+    "sqrt_distance_to_coast": "sqrt(distance_to_coast)",
+    "arctan_slope": "arctan(slope)",
+}
+
+
+def _use_numexpr():
+    return numexpr is not None and numexpr.get_num_threads() > 1
+
+
+def _output(out, *arrays):
+    """The buffer to write a result into: out if given, otherwise a new array of the inputs' broadcast shape"""
+    if out is None:
+        arrays = [array for array in arrays if array is not None]
+        out = np.empty(
+            np.broadcast_shapes(*(np.shape(array) for array in arrays)),
+            dtype=np.result_type(
+                *(np.asarray(array).dtype for array in arrays), np.float32
+            ),
+        )
+    return out
+
+
+def _evaluate(expression, out, **arrays):
+    """
+    Evaluates the expression with numexpr in a single pass, writing it into out.
+    Shared terms given in arrays are used in place of the expressions they replace
+    """
+    arrays = {
+        name: np.asarray(array) for name, array in arrays.items() if array is not None
+    }
+    for name in arrays:
+        if name in SHARED_TERMS:
+            expression = expression.replace(SHARED_TERMS[name], name)
+    return numexpr.evaluate(
+        expression,
+        local_dict=arrays,
+        out=_output(out, *arrays.values()),
+        casting="same_kind",
+    )
+
+
+def _fuse(coverage, susceptibility):
+    """Substitutes a susceptibility expression into a coverage expression"""
+    return coverage.replace("susceptibility", "({})".format(susceptibility))
+
+
+def _term(function, values, precalculated, out=None):
+    """function(values), unless it was precalculated"""
+    if precalculated is not None:
+        return precalculated
+    return function(values, out=out)
+
 
-def calculate_zhu2015_susceptibility(compound_topographic_index, vs30):
-    return 24.10 + compound_topographic_index * 0.355 + np.log(vs30) * -4.784
+def _add_term(out, values, coefficient, temp):
+    """out += values * coefficient, using temp for the product"""
+    np.multiply(values, coefficient, out=temp)
+    out += temp
 
 
-def calculate_zhu2015_coverage(scaled_pga, susceptibility):
-    p = raw_probability_transform(np.log(scaled_pga) * 2.067 + susceptibility)
-    return 0.81 * p
+def calculate_zhu2015_susceptibility(
+    compound_topographic_index, vs30, out=None, log_vs30=None
+):
+    if _use_numexpr():
+        return _evaluate(
+            ZHU2015_SUSCEPTIBILITY,
+            out,
+            compound_topographic_index=compound_topographic_index,
+            vs30=vs30,
+            log_vs30=log_vs30,
+        )
+    out = _output(out, compound_topographic_index, vs30, log_vs30)
+    temp = np.empty_like(out)
+    np.multiply(compound_topographic_index, 0.355, out=out)
+    out += 24.10
+    _add_term(out, _term(np.log, vs30, log_vs30, temp), -4.784, temp)
+    return out
+
+
+def calculate_zhu2015_coverage(
+    scaled_pga, susceptibility, out=None, log_scaled_pga=None
+):
+    if _use_numexpr():
+        return _evaluate(
+            ZHU2015_COVERAGE,
+            out,
+            scaled_pga=scaled_pga,
+            susceptibility=susceptibility,
+            log_scaled_pga=log_scaled_pga,
+        )
+    out = _output(out, scaled_pga, susceptibility, log_scaled_pga)
+    np.multiply(_term(np.log, scaled_pga, log_scaled_pga, out), 2.067, out=out)
+    out += susceptibility
+    raw_probability_transform(out, out=out)
+    out *= 0.81
+    return out
+
+
+def calculate_zhu2015_probability(
+    scaled_pga, compound_topographic_index, vs30, out=None
+):
+    if _use_numexpr():
+        return _evaluate(
+            _fuse(ZHU2015_COVERAGE, ZHU2015_SUSCEPTIBILITY),
+            out,
+            scaled_pga=scaled_pga,
+            compound_topographic_index=compound_topographic_index,
+            vs30=vs30,
+        )
+    return calculate_zhu2015_coverage(
+        scaled_pga,
+        calculate_zhu2015_susceptibility(compound_topographic_index, vs30),
+        out,
+    )
 
 
 def calculate_zhu2016_susceptibility(
-    vs30, precipitation, distance_to_coast, distance_to_rivers, water_table_depth
+    vs30,
+    precipitation,
+    distance_to_coast,
+    distance_to_rivers,
+    water_table_depth,
+    out=None,
+    log_vs30=None,
 ):
-    return (
-        8.801
-        + np.log(vs30) * -1.918
-        + precipitation * 0.0005408
-        + np.minimum(distance_to_coast, distance_to_rivers) * -0.2054
-        + water_table_depth * -0.0333
+    if _use_numexpr():
+        return _evaluate(
+            ZHU2016_SUSCEPTIBILITY,
+            out,
+            vs30=vs30,
+            precipitation=precipitation,
+            distance_to_coast=distance_to_coast,
+            distance_to_rivers=distance_to_rivers,
+            water_table_depth=water_table_depth,
+            log_vs30=log_vs30,
+        )
+    out = _output(
+        out,
+        vs30,
+        precipitation,
+        distance_to_coast,
+        distance_to_rivers,
+        water_table_depth,
+        log_vs30,
     )
+    temp = np.empty_like(out)
+    np.multiply(_term(np.log, vs30, log_vs30, out), -1.918, out=out)
+    out += 8.801
+    _add_term(out, precipitation, 0.0005408, temp)
+    np.minimum(distance_to_coast, distance_to_rivers, out=temp)
+    _add_term(out, temp, -0.2054, temp)
+    _add_term(out, water_table_depth, -0.0333, temp)
+    return out
+
 
+def calculate_zhu2016_coverage(pgv, susceptibility, out=None, log_pgv=None):
+    if _use_numexpr():
+        return _evaluate(
+            ZHU2016_COVERAGE,
+            out,
+            pgv=pgv,
+            susceptibility=susceptibility,
+            log_pgv=log_pgv,
+        )
+    out = _output(out, pgv, susceptibility, log_pgv)
+    np.multiply(_term(np.log, pgv, log_pgv, out), 0.334, out=out)
+    out += susceptibility
+    raw_probability_transform(out, out=out)
+    out *= -9.165
+    np.exp(out, out=out)
+    out *= 42.40
+    out += 1
+    np.square(out, out=out)
+    np.divide(0.4915, out, out=out)
+    return out
 
-def calculate_zhu2016_coverage(pgv, susceptibility):
-    p = raw_probability_transform(np.log(pgv) * 0.334 + susceptibility)
-    return 0.4915 / (1 + 42.40 * np.exp(-9.165 * p)) ** 2
+
+def calculate_zhu2016_probability(
+    pgv,
+    vs30,
+    precipitation,
+    distance_to_coast,
+    distance_to_rivers,
+    water_table_depth,
+    out=None,
+):
+    if _use_numexpr():
+        return _evaluate(
+            _fuse(ZHU2016_COVERAGE, ZHU2016_SUSCEPTIBILITY),
+            out,
+            pgv=pgv,
+            vs30=vs30,
+            precipitation=precipitation,
+            distance_to_coast=distance_to_coast,
+            distance_to_rivers=distance_to_rivers,
+            water_table_depth=water_table_depth,
+        )
+    return calculate_zhu2016_coverage(
+        pgv,
+        calculate_zhu2016_susceptibility(
+            vs30,
+            precipitation,
+            distance_to_coast,
+            distance_to_rivers,
+            water_table_depth,
+        ),
+        out,
+    )
 
 
 def calculate_zhu2016_coastal_susceptability(
-    vs30, precipitation, distance_to_coast, distance_to_rivers
+    vs30,
+    precipitation,
+    distance_to_coast,
+    distance_to_rivers,
+    out=None,
+    log_vs30=None,
+    sqrt_distance_to_coast=None,
 ):
-    return (
-            12.435
-            + np.log(vs30) * -2.615
-            + precipitation * 0.0005556
-            + np.power(distance_to_coast, 0.5) * -0.0287
-            + distance_to_rivers * 0.0666
-            + np.power(distance_to_coast, 0.5) * distance_to_rivers * -0.0369
+    if _use_numexpr():
+        return _evaluate(
+            ZHU2016_COASTAL_SUSCEPTIBILITY,
+            out,
+            vs30=vs30,
+            precipitation=precipitation,
+            distance_to_coast=distance_to_coast,
+            distance_to_rivers=distance_to_rivers,
+            log_vs30=log_vs30,
+            sqrt_distance_to_coast=sqrt_distance_to_coast,
+        )
+    out = _output(
+        out,
+        vs30,
+        precipitation,
+        distance_to_coast,
+        distance_to_rivers,
+        log_vs30,
+        sqrt_distance_to_coast,
     )
+    temp = np.empty_like(out)
+    sqrt_distance_to_coast = _term(np.sqrt, distance_to_coast, sqrt_distance_to_coast)
+    np.multiply(_term(np.log, vs30, log_vs30, out), -2.615, out=out)
+    out += 12.435
+    _add_term(out, precipitation, 0.0005556, temp)
+    _add_term(out, sqrt_distance_to_coast, -0.0287, temp)
+    _add_term(out, distance_to_rivers, 0.0666, temp)
+    np.multiply(sqrt_distance_to_coast, distance_to_rivers, out=temp)
+    _add_term(out, temp, -0.0369, temp)
+    return out
+
+
+def calculate_zhu2016_coastal_coverage(pgv, susceptability, out=None, log_pgv=None):
+    if _use_numexpr():
+        return _evaluate(
+            ZHU2016_COASTAL_COVERAGE,
+            out,
+            pgv=pgv,
+            susceptibility=susceptability,
+            log_pgv=log_pgv,
+        )
+    out = _output(out, pgv, susceptability, log_pgv)
+    np.multiply(_term(np.log, pgv, log_pgv, out), 0.301, out=out)
+    out += susceptability
+    raw_probability_transform(out, out=out)
+    out *= -11.43
+    np.exp(out, out=out)
+    out *= 62.59
+    out += 1
+    np.square(out, out=out)
+    np.divide(0.4208, out, out=out)
+    return out
 
 
-def calculate_zhu2016_coastal_coverage(pgv, susceptability):
-    p = raw_probability_transform(susceptability + np.log(pgv) * 0.301)
-    return 0.4208 / (1 + 62.59 * np.exp(-11.43 * p)) ** 2
+def calculate_zhu2016_coastal_probability(
+    pgv, vs30, precipitation, distance_to_coast, distance_to_rivers, out=None
+):
+    if _use_numexpr():
+        return _evaluate(
+            _fuse(ZHU2016_COASTAL_COVERAGE, ZHU2016_COASTAL_SUSCEPTIBILITY),
+            out,
+            pgv=pgv,
+            vs30=vs30,
+            precipitation=precipitation,
+            distance_to_coast=distance_to_coast,
+            distance_to_rivers=distance_to_rivers,
+        )
+    return calculate_zhu2016_coastal_coverage(
+        pgv,
+        calculate_zhu2016_coastal_susceptability(
+            vs30, precipitation, distance_to_coast, distance_to_rivers
+        ),
+        out,
+    )
 
 
 def calculate_zhu2017_susceptibility(
-    vs30, precipitation, distance_to_coast, distance_to_rivers, water_table_depth
+    vs30,
+    precipitation,
+    distance_to_coast,
+    distance_to_rivers,
+    water_table_depth,
+    out=None,
+    log_vs30=None,
 ):
     return calculate_zhu2016_susceptibility(
-        vs30, precipitation, distance_to_coast, distance_to_rivers, water_table_depth
+        vs30,
+        precipitation,
+        distance_to_coast,
+        distance_to_rivers,
+        water_table_depth,
+        out,
+        log_vs30,
     )
 
 
-def calculate_zhu2017_coverage(scaled_pgv, susceptibility):
-    return calculate_zhu2016_coverage(scaled_pgv, susceptibility)
+def calculate_zhu2017_coverage(
+    scaled_pgv, susceptibility, out=None, log_scaled_pgv=None
+):
+    return calculate_zhu2016_coverage(scaled_pgv, susceptibility, out, log_scaled_pgv)
+
+
+def calculate_zhu2017_probability(
+    scaled_pgv,
+    vs30,
+    precipitation,
+    distance_to_coast,
+    distance_to_rivers,
+    water_table_depth,
+    out=None,
+):
+    return calculate_zhu2016_probability(
+        scaled_pgv,
+        vs30,
+        precipitation,
+        distance_to_coast,
+        distance_to_rivers,
+        water_table_depth,
+        out,
+    )
 
 
 def calculate_zhu2017_coastal_susceptibility(
-    vs30, precip, distance_to_coast, distance_to_rivers
+    vs30,
+    precip,
+    distance_to_coast,
+    distance_to_rivers,
+    out=None,
+    log_vs30=None,
+    sqrt_distance_to_coast=None,
 ):
     return calculate_zhu2016_coastal_susceptability(
-        vs30, precip, distance_to_coast, distance_to_rivers
+        vs30,
+        precip,
+        distance_to_coast,
+        distance_to_rivers,
+        out,
+        log_vs30,
+        sqrt_distance_to_coast,
     )
 
 
-def calculate_zhu2017_coastal_coverage(pgv, susceptability):
-    return calculate_zhu2016_coastal_coverage(pgv, susceptability)
+def calculate_zhu2017_coastal_coverage(pgv, susceptability, out=None, log_pgv=None):
+    return calculate_zhu2016_coastal_coverage(pgv, susceptability, out, log_pgv)
 
 
-def calculate_jessee2017_susceptibility(
-    slope, rock, compound_topographic_index, landcover
+def calculate_zhu2017_coastal_probability(
+    pgv, vs30, precip, distance_to_coast, distance_to_rivers, out=None
 ):
-    return (
-        -6.3
-        + np.arctan(slope) * 0.06 * 180 / np.pi
-        + rock * 1
-        + compound_topographic_index * 0.03
-        + landcover * 1.0
+    return calculate_zhu2016_coastal_probability(
+        pgv, vs30, precip, distance_to_coast, distance_to_rivers, out
     )
 
 
-def calculate_jessee2017_coverage(pgv, slope, susceptibility):
-    p = raw_probability_transform(
-        np.log(pgv) * 1.65
-        + susceptibility
-        + np.log(pgv) * np.arctan(slope) * 180 / np.pi * 0.01
+def calculate_jessee2017_susceptibility(
+    slope, rock, compound_topographic_index, landcover, out=None, arctan_slope=None
+):
+    if _use_numexpr():
+        return _evaluate(
+            JESSEE2017_SUSCEPTIBILITY,
+            out,
+            slope=slope,
+            rock=rock,
+            compound_topographic_index=compound_topographic_index,
+            landcover=landcover,
+            arctan_slope=arctan_slope,
+        )
+    out = _output(out, slope, rock, compound_topographic_index, landcover, arctan_slope)
+    temp = np.empty_like(out)
+    np.multiply(_term(np.arctan, slope, arctan_slope, out), 0.06, out=out)
+    out *= 180
+    out /= np.pi
+    out += -6.3
+    _add_term(out, rock, 1, temp)
+    _add_term(out, compound_topographic_index, 0.03, temp)
+    _add_term(out, landcover, 1.0, temp)
+    return out
+
+
+def calculate_jessee2017_coverage(
+    pgv, slope, susceptibility, out=None, log_pgv=None, arctan_slope=None
+):
+    if _use_numexpr():
+        p = _evaluate(
+            JESSEE2017_P,
+            out,
+            pgv=pgv,
+            slope=slope,
+            susceptibility=susceptibility,
+            log_pgv=log_pgv,
+            arctan_slope=arctan_slope,
+        )
+        return _evaluate(JESSEE2017_COVERAGE, p, p=p)
+    out = _output(out, pgv, slope, susceptibility, log_pgv, arctan_slope)
+    temp = np.empty_like(out)
+    log_pgv = _term(np.log, pgv, log_pgv, out)
+    np.multiply(log_pgv, _term(np.arctan, slope, arctan_slope), out=temp)
+    temp *= 180
+    temp /= np.pi
+    temp *= 0.01
+    np.multiply(log_pgv, 1.65, out=out)
+    out += susceptibility
+    out += temp
+    p = raw_probability_transform(out, out=out)
+
+    np.square(p, out=temp)
+    temp *= -3.042
+    polynomial = np.multiply(p, 5.237)
+    polynomial += -7.592
+    polynomial += temp
+    np.power(p, 3, out=temp)
+    temp *= 4.035
+    polynomial += temp
+    return np.exp(polynomial, out=out)
+
+
+def calculate_jessee2017_probability(
+    pgv, slope, rock, compound_topographic_index, landcover, out=None
+):
+    if _use_numexpr():
+        p = _evaluate(
+            _fuse(JESSEE2017_P, JESSEE2017_SUSCEPTIBILITY),
+            out,
+            pgv=pgv,
+            slope=slope,
+            rock=rock,
+            compound_topographic_index=compound_topographic_index,
+            landcover=landcover,
+        )
+        return _evaluate(JESSEE2017_COVERAGE, p, p=p)
+    return calculate_jessee2017_coverage(
+        pgv,
+        slope,
+        calculate_jessee2017_susceptibility(
+            slope, rock, compound_topographic_index, landcover
+        ),
+        out,
     )
-    return np.exp(-7.592 + 5.237 * p - 3.042 * p ** 2 + 4.035 * p ** 3)
 
 
-def raw_probability_transform(p):
+def raw_probability_transform(p, out=None):
     """
     The inverse of the equation -np.log(1/P-1).
     Verification of this is left as an exercise to the reader."""
-    return 1 / (np.exp(-p) + 1)
+    out = np.negative(p, out=out)
+    np.exp(out, out=out)
+    out += 1
+    return np.reciprocal(out, out=out)
+
+
+def inverse_raw_probability_transform(p, out=None):
+    """The equation -np.log(1/P-1), the inverse of raw_probability_transform"""
+    out = np.reciprocal(p, out=_output(out, p))
+    out -= 1
+    np.log(out, out=out)
+    return np.negative(out, out=out)
+
+
+# The inverse coverage functions give the ground motion at which a model's coverage reaches a target coverage,
+# for sites with the given susceptibility (so a threshold map is one pass over a susceptibility raster).
+# The coverage equations are all increasing in the ground motion, between their value at no ground motion
+# and at infinite ground motion; target coverages outside that range are never reached and give NaN
+
+
+def _unreachable(out, coverage, low, high):
+    """Sets out to NaN where coverage is not strictly between low and high"""
+    with np.errstate(invalid="ignore"):
+        reachable = np.greater(coverage, low) & np.less(coverage, high)
+        np.copyto(out, np.nan, where=~reachable)
+    return out
+
+
+def _ground_motion(out, raw_probability, susceptibility, log_coefficient):
+    """Solves log(ground_motion) * log_coefficient + susceptibility = raw_probability for the ground motion"""
+    out = inverse_raw_probability_transform(raw_probability, out=out)
+    out -= susceptibility
+    out /= log_coefficient
+    return np.exp(out, out=out)
+
+
+def calculate_zhu2015_inverse_coverage(coverage, susceptibility, out=None):
+    """The scaled PGA at which the zhu2015 coverage reaches coverage, which must be between 0 and 0.81"""
+    out = _output(out, coverage, susceptibility)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        np.divide(coverage, 0.81, out=out)
+        _ground_motion(out, out, susceptibility, 2.067)
+    return _unreachable(out, coverage, 0, 0.81)
+
+
+def _zhu2016_inverse_coverage(
+    coverage, susceptibility, out, scale, shape, rate, log_coefficient
+):
+    """
+    Inverts scale / (1 + shape * exp(rate * P)) ** 2, the coverage equation of zhu2016 and zhu2016_coastal,
+    for the raw probability P and then the ground motion
+    """
+    out = _output(out, coverage, susceptibility)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        np.divide(scale, coverage, out=out)
+        np.sqrt(out, out=out)
+        out -= 1
+        out /= shape
+        np.log(out, out=out)
+        out /= rate
+        _ground_motion(out, out, susceptibility, log_coefficient)
+    return _unreachable(
+        out,
+        coverage,
+        scale / (1 + shape) ** 2,
+        scale / (1 + shape * np.exp(rate)) ** 2,
+    )
+
+
+def calculate_zhu2016_inverse_coverage(coverage, susceptibility, out=None):
+    """The PGV at which the zhu2016 coverage reaches coverage, which must be between 2.61e-4 and 0.487"""
+    return _zhu2016_inverse_coverage(
+        coverage, susceptibility, out, 0.4915, 42.40, -9.165, 0.334
+    )
+
+
+def calculate_zhu2016_coastal_inverse_coverage(coverage, susceptability, out=None):
+    """The PGV at which the zhu2016_coastal coverage reaches coverage, which must be between 1.04e-4 and 0.420"""
+    return _zhu2016_inverse_coverage(
+        coverage, susceptability, out, 0.4208, 62.59, -11.43, 0.301
+    )
+
+
+def calculate_zhu2017_inverse_coverage(coverage, susceptibility, out=None):
+    """The scaled PGV at which the zhu2017 coverage reaches coverage"""
+    return calculate_zhu2016_inverse_coverage(coverage, susceptibility, out)
+
+
+def calculate_zhu2017_coastal_inverse_coverage(coverage, susceptability, out=None):
+    """The PGV at which the zhu2017_coastal coverage reaches coverage"""
+    return calculate_zhu2016_coastal_inverse_coverage(coverage, susceptability, out)
+
+
+# The jessee2017 coverage is exp of a cubic in P, 4.035 P^3 - 3.042 P^2 + 5.237 P - 7.592.
+# Its derivative has no real roots, so the cubic is increasing and has one real root for each coverage.
+# Dividing by 4.035 and substituting P = t + 3.042 / (3 * 4.035) gives t^3 + p t + q with p > 0,
+# whose real root is -2 sqrt(p / 3) sinh(arcsinh(3 q / (2 p) sqrt(3 / p)) / 3)
+JESSEE2017_CUBIC = (4.035, -3.042, 5.237, -7.592)
+
+
+def calculate_jessee2017_inverse_coverage(
+    coverage, slope, susceptibility, out=None, arctan_slope=None
+):
+    """
+    The PGV at which the jessee2017 coverage reaches coverage, which must be between exp(-7.592) and exp(-1.362).
+    arctan_slope is used instead of calculating it if given
+    """
+    _, b, c, d = (
+        coefficient / JESSEE2017_CUBIC[0] for coefficient in JESSEE2017_CUBIC
+    )
+    p = c - b ** 2 / 3
+    shift = -b / 3
+    q_constant = 2 * b ** 3 / 27 - b * c / 3 + d
+    out = _output(out, coverage, slope, susceptibility, arctan_slope)
+    temp = np.empty_like(out)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # q = q_constant - log(coverage) / 4.035
+        np.log(coverage, out=out)
+        out /= -JESSEE2017_CUBIC[0]
+        out += q_constant
+        out *= 3 / (2 * p) * np.sqrt(3 / p)
+        np.arcsinh(out, out=out)
+        out /= 3
+        np.sinh(out, out=out)
+        out *= -2 * np.sqrt(p / 3)
+        out += shift
+        np.multiply(_term(np.arctan, slope, arctan_slope, temp), 180, out=temp)
+        temp /= np.pi
+        temp *= 0.01
+        temp += 1.65
+        _ground_motion(out, out, susceptibility, temp)
+    return _unreachable(
+        out, coverage, np.exp(JESSEE2017_CUBIC[3]), np.exp(sum(JESSEE2017_CUBIC))
+    )
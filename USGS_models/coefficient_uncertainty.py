@@ -0,0 +1,196 @@
+"""
+Monte Carlo sampling of the zhu2016 and jessee2017 logistic regression coefficients, for epistemic uncertainty bands.
+
+A CoefficientSampler draws every sample of the coefficients up front from a seeded generator, so the same seed gives
+the same samples however the sites are chunked or split between processes. Each model's linear predictor is
+intercept + sum(coefficient * site term) + ground motion terms, so the susceptibility of every sample at a block of
+sites is one (samples x terms) @ (terms x sites) product over the sampled site parameters. The coverage is then
+evaluated for all samples at once and only its percentiles over the samples are kept, one block of sites at a time.
+"""
+
+import numpy as np
+
+from USGS_models import calculations
+
+# The coefficients of each model in the order they are drawn, with their published values.
+# The last one or two multiply the ground motion terms, the others the site terms
+NOMINAL_COEFFICIENTS = {
+    "zhu2016": {
+        "intercept": 8.801,
+        "log_vs30": -1.918,
+        "precipitation": 0.0005408,
+        "distance": -0.2054,
+        "water_table_depth": -0.0333,
+        "log_pgv": 0.334,
+    },
+    "jessee2017": {
+        "intercept": -6.3,
+        "slope_degrees": 0.06,
+        "rock": 1.0,
+        "compound_topographic_index": 0.03,
+        "landcover": 1.0,
+        "log_pgv": 1.65,
+        "log_pgv_slope_degrees": 0.01,
+    },
+}
+GROUND_MOTION_COEFFICIENTS = {
+    "zhu2016": ["log_pgv"],
+    "jessee2017": ["log_pgv", "log_pgv_slope_degrees"],
+}
+# Distributions of a coefficient around its nominal value, drawn with (generator, nominal, scale, samples)
+DISTRIBUTIONS = {
+    "normal": lambda rng, nominal, scale, n: rng.normal(nominal, scale, n),
+    "uniform": lambda rng, nominal, scale, n: rng.uniform(
+        nominal - scale, nominal + scale, n
+    ),
+}
+DEFAULT_PERCENTILES = (5, 50, 95)
+# The number of (sample, site) values evaluated at a time
+BLOCK_VALUES = 2 ** 22
+
+
+def site_terms(
+    model,
+    vs30=None,
+    precipitation=None,
+    distance_to_coast=None,
+    distance_to_rivers=None,
+    water_table_depth=None,
+    slope=None,
+    rock=None,
+    compound_topographic_index=None,
+    landcover=None,
+):
+    """
+    The (terms x sites) matrix a model's site coefficients multiply, starting with the intercept's row of ones.
+    zhu2016 needs the vs30, precipitation, distances and water table depth, jessee2017 the slope, rock,
+    compound topographic index and landcover
+    """
+    if model == "zhu2016":
+        terms = [
+            np.log(vs30),
+            precipitation,
+            np.minimum(distance_to_coast, distance_to_rivers),
+            water_table_depth,
+        ]
+    elif model == "jessee2017":
+        terms = [
+            np.degrees(np.arctan(slope)),
+            rock,
+            compound_topographic_index,
+            landcover,
+        ]
+    else:
+        raise ValueError(
+            "Coefficients can only be sampled for {}".format(
+                ", ".join(NOMINAL_COEFFICIENTS)
+            )
+        )
+    terms = [np.asarray(term, dtype=np.float64) for term in terms]
+    return np.vstack([np.ones_like(terms[0])] + terms)
+
+
+class CoefficientSampler:
+    """
+    Samples of a model's coefficients. distributions maps coefficient names (see NOMINAL_COEFFICIENTS)
+    to a (distribution, scale) pair, a DISTRIBUTIONS name and its standard deviation / half width;
+    the other coefficients are fixed at their nominal values
+    """
+
+    def __init__(self, model, distributions, samples, seed=0):
+        if model not in NOMINAL_COEFFICIENTS:
+            raise ValueError(
+                "Coefficients can only be sampled for {}".format(
+                    ", ".join(NOMINAL_COEFFICIENTS)
+                )
+            )
+        unknown = set(distributions) - set(NOMINAL_COEFFICIENTS[model])
+        if unknown:
+            raise ValueError(
+                "{} has no coefficients {}, only {}".format(
+                    model, sorted(unknown), list(NOMINAL_COEFFICIENTS[model])
+                )
+            )
+        self.model = model
+        self.distributions = dict(distributions)
+        self.samples = samples
+        self.seed = seed
+
+        rng = np.random.default_rng(seed)
+        coefficients = []
+        for name, nominal in NOMINAL_COEFFICIENTS[model].items():
+            if name in distributions:
+                distribution, scale = distributions[name]
+                if distribution not in DISTRIBUTIONS:
+                    raise ValueError(
+                        "Unknown distribution {} for {}, use one of {}".format(
+                            distribution, name, list(DISTRIBUTIONS)
+                        )
+                    )
+                coefficients.append(
+                    DISTRIBUTIONS[distribution](rng, nominal, scale, samples)
+                )
+            else:
+                coefficients.append(np.full(samples, nominal))
+        # (samples, coefficients), site coefficients first
+        self.coefficients = np.stack(coefficients, axis=1)
+        n_ground_motion = len(GROUND_MOTION_COEFFICIENTS[model])
+        self.site_coefficients = self.coefficients[:, :-n_ground_motion]
+        self.ground_motion_coefficients = self.coefficients[:, -n_ground_motion:]
+
+    def calculate_percentiles(
+        self, ground_motion, terms, percentiles=DEFAULT_PERCENTILES, out=None
+    ):
+        """
+        Calculates percentiles of the coverage over the coefficient samples for a (sites, realisations) block of
+        ground motions, with terms from site_terms. Returns (sites, realisations, percentiles) values,
+        written into out if given
+        """
+        ground_motion = np.asarray(ground_motion, dtype=np.float64)
+        n_sites, n_realisations = ground_motion.shape
+        if out is None:
+            out = np.empty((n_sites, n_realisations, len(percentiles)))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            log_ground_motion = np.log(ground_motion)
+            block_sites = max(1, BLOCK_VALUES // self.samples)
+            for start in range(0, n_sites, block_sites):
+                sites = slice(start, start + block_sites)
+                susceptibility = self.site_coefficients @ terms[:, sites]
+                linear_predictor = np.empty_like(susceptibility)
+                coverage = np.empty_like(susceptibility)
+                for realisation in range(n_realisations):
+                    self._linear_predictor(
+                        susceptibility,
+                        log_ground_motion[sites, realisation],
+                        terms[:, sites],
+                        linear_predictor,
+                    )
+                    self._coverage(linear_predictor, coverage)
+                    out[sites, realisation] = np.percentile(
+                        coverage, percentiles, axis=0
+                    ).T
+        return out
+
+    def _linear_predictor(self, susceptibility, log_ground_motion, terms, out):
+        """Adds the ground motion terms of every sample to the (samples, sites) susceptibility"""
+        np.multiply(
+            self.ground_motion_coefficients[:, 0:1], log_ground_motion, out=out
+        )
+        out += susceptibility
+        if self.model == "jessee2017":
+            # The slope in degrees is the first site term
+            out += self.ground_motion_coefficients[:, 1:2] * (
+                log_ground_motion * terms[1]
+            )
+        return out
+
+    def _coverage(self, linear_predictor, out):
+        """
+        The coverage from the linear predictor, written into out (which must not be linear_predictor).
+        It is the model's coverage with a ground motion of 1, as log(1) = 0 leaves the susceptibility
+        """
+        if self.model == "zhu2016":
+            return calculations.calculate_zhu2016_coverage(1.0, linear_predictor, out)
+        return calculations.calculate_jessee2017_coverage(
+            1.0, 0.0, linear_predictor, out
+        )
@@ -0,0 +1,244 @@
+"""
+Tabulated coverage equations, for evaluating the coverage of very many realisations.
+
+Every coverage equation is a function of a single linear predictor, the log odds the raw probability transform is
+applied to: susceptibility + coefficient * log(ground motion), where jessee2017's coefficient also depends on slope.
+So rather than a (susceptibility, log ground motion) grid each model's coverage is tabulated once, on a uniform grid
+of the linear predictor, and evaluated by linear interpolation: a gather and a multiply-add instead of the
+exp / reciprocal chain of the exact equations.
+
+A table is refined until its interpolation error, measured on a grid 8 times finer than the table, is at most
+max_error (an absolute error in coverage). Beyond +-LIMIT the raw probability is within 1e-17 of 0 or 1,
+so the coverage is taken as its limit there.
+
+Whether a table is faster depends on the model. With NumPy the table lookup is bound by its gathers: including the
+linear predictor it is about 1.3x faster than jessee2017's exact equation (an exp and a cubic after the transform),
+but about half the speed of the zhu models' equations, which are only a few vectorised exp calls.
+So only the TABULATED_MODELS are tabulated by calculate_gf, the others keep their exact equations.
+Run this module to benchmark every model's table against the exact path:
+
+    python -m USGS_models.coverage_tables
+"""
+
+import argparse
+import functools
+import timeit
+
+import numpy as np
+
+from USGS_models import calculations
+
+DEFAULT_MAX_ERROR = 1e-6
+LIMIT = 40.0
+# Tables are not refined past this many intervals (8 MB of values, with a 64 MB grid to measure the error on).
+# Every model's error falls below 1e-9 with it
+MAX_INTERVALS = 2 ** 20
+# The models whose table is faster than their exact equation
+TABULATED_MODELS = ("jessee2017",)
+# Every model's coverage is its equation with a ground motion of 1, as log(1) = 0 leaves the susceptibility
+# as the linear predictor
+COVERAGE_EQUATIONS = {
+    "zhu2015": lambda x: calculations.calculate_zhu2015_coverage(1.0, x),
+    "zhu2016": lambda x: calculations.calculate_zhu2016_coverage(1.0, x),
+    "zhu2016_coastal": lambda x: calculations.calculate_zhu2016_coastal_coverage(1.0, x),
+    "zhu2017": lambda x: calculations.calculate_zhu2017_coverage(1.0, x),
+    "zhu2017_coastal": lambda x: calculations.calculate_zhu2017_coastal_coverage(
+        1.0, x
+    ),
+    "jessee2017": lambda x: calculations.calculate_jessee2017_coverage(1.0, 0.0, x),
+}
+# The coefficient of log(ground motion) in each model's linear predictor, other than jessee2017's
+LOG_GROUND_MOTION_COEFFICIENTS = {
+    "zhu2015": 2.067,
+    "zhu2016": 0.334,
+    "zhu2016_coastal": 0.301,
+    "zhu2017": 0.334,
+    "zhu2017_coastal": 0.301,
+}
+
+
+class CoverageTable:
+    """
+    A coverage equation (a function of the linear predictor) tabulated on a uniform grid between low and high,
+    with the number of intervals doubled until the interpolation error is at most max_error.
+    error is the measured maximum absolute error. Raises a ValueError if max_error is not positive,
+    or is not reached within MAX_INTERVALS intervals
+    """
+
+    def __init__(self, coverage, max_error=DEFAULT_MAX_ERROR, low=-LIMIT, high=LIMIT):
+        if not max_error > 0:
+            raise ValueError(
+                "The coverage table error must be positive, not {}".format(max_error)
+            )
+        self.low = low
+        intervals = 64
+        while True:
+            self.step = (high - low) / intervals
+            self.values = coverage(np.linspace(low, high, intervals + 1))
+            self.slopes = np.diff(self.values)
+            fine = np.linspace(low, high, 8 * intervals + 1)
+            self.error = float(np.max(np.abs(self(fine) - coverage(fine))))
+            if self.error <= max_error:
+                break
+            if intervals >= MAX_INTERVALS:
+                raise ValueError(
+                    "The coverage can only be tabulated to an error of {:.2g} with {} intervals, not {:.2g}".format(
+                        self.error, intervals, max_error
+                    )
+                )
+            intervals *= 2
+
+    def __call__(self, linear_predictor, out=None):
+        """Interpolates the coverage for the linear predictor, writing it into out if given"""
+        out = np.subtract(linear_predictor, self.low, out=out)
+        out /= self.step
+        np.clip(out, 0, len(self.slopes), out=out)
+        # fmin / fmax replace NaN, so NaN inputs get a valid index and stay NaN through out
+        index = np.fmin(np.fmax(out, 0), len(self.slopes) - 1).astype(np.intp)
+        out -= index
+        out *= self.slopes[index]
+        out += self.values[index]
+        return out
+
+
+@functools.lru_cache(maxsize=None)
+def get_table(model, max_error=DEFAULT_MAX_ERROR):
+    """The CoverageTable of a model, built once per process for each max_error"""
+    return CoverageTable(COVERAGE_EQUATIONS[model], max_error)
+
+
+def calculate_linear_predictor(
+    model,
+    ground_motion,
+    susceptibility,
+    out=None,
+    log_ground_motion=None,
+    slope=None,
+    arctan_slope=None,
+):
+    """
+    Calculates a model's linear predictor, writing it into out if given.
+    jessee2017 also needs the slope (or arctan_slope); log_ground_motion and arctan_slope are used if given
+    """
+    out = calculations._output(out, ground_motion, susceptibility, log_ground_motion)
+    log_ground_motion = calculations._term(
+        np.log, ground_motion, log_ground_motion, out
+    )
+    if model == "jessee2017":
+        coefficient = np.degrees(calculations._term(np.arctan, slope, arctan_slope))
+        coefficient *= 0.01
+        coefficient += 1.65
+    else:
+        coefficient = LOG_GROUND_MOTION_COEFFICIENTS[model]
+    np.multiply(log_ground_motion, coefficient, out=out)
+    out += susceptibility
+    return out
+
+
+def calculate_tabulated_coverage(
+    model,
+    ground_motion,
+    susceptibility,
+    out=None,
+    max_error=DEFAULT_MAX_ERROR,
+    log_ground_motion=None,
+    slope=None,
+    arctan_slope=None,
+):
+    """
+    Calculates a model's coverage from its table, within max_error of the exact equation.
+    Takes the same inputs as calculate_linear_predictor
+    """
+    out = calculate_linear_predictor(
+        model,
+        ground_motion,
+        susceptibility,
+        out,
+        log_ground_motion,
+        slope,
+        arctan_slope,
+    )
+    return get_table(model, max_error)(out, out=out)
+
+
+def calculate_exact_coverage(
+    model, ground_motion, susceptibility, out=None, slope=None, log_ground_motion=None
+):
+    """Calculates a model's coverage with its equation in calculations"""
+    if model == "jessee2017":
+        return calculations.calculate_jessee2017_coverage(
+            ground_motion, slope, susceptibility, out, log_pgv=log_ground_motion
+        )
+    coverage = getattr(calculations, "calculate_{}_coverage".format(model))
+    return coverage(ground_motion, susceptibility, out, log_ground_motion)
+
+
+def benchmark(sites=100_000, realisations=100, max_error=DEFAULT_MAX_ERROR, seed=0):
+    """
+    Times each model's exact and tabulated coverage of (sites, realisations) ground motions,
+    with log(ground motion) precalculated as calculate_gf shares it between models.
+    Returns {model: (table size, measured table error, exact seconds, tabulated seconds, max error)}
+    """
+    rng = np.random.default_rng(seed)
+    susceptibility = rng.uniform(-5, 5, (sites, 1))
+    slope = rng.uniform(0, 1, (sites, 1))
+    log_ground_motion = rng.uniform(-3, 6, (sites, realisations))
+    ground_motion = np.exp(log_ground_motion)
+    exact = np.empty_like(ground_motion)
+    tabulated = np.empty_like(ground_motion)
+
+    results = {}
+    for model in COVERAGE_EQUATIONS:
+        table = get_table(model, max_error)
+
+        def run_exact():
+            calculate_exact_coverage(
+                model, ground_motion, susceptibility, exact, slope, log_ground_motion
+            )
+
+        def run_tabulated():
+            calculate_tabulated_coverage(
+                model,
+                ground_motion,
+                susceptibility,
+                tabulated,
+                max_error,
+                log_ground_motion,
+                slope,
+            )
+
+        exact_time = min(timeit.repeat(run_exact, number=1, repeat=3))
+        tabulated_time = min(timeit.repeat(run_tabulated, number=1, repeat=3))
+        results[model] = (
+            len(table.values),
+            table.error,
+            exact_time,
+            tabulated_time,
+            float(np.max(np.abs(tabulated - exact))),
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the tabulated coverage of every model against the exact equations"
+    )
+    parser.add_argument("--sites", type=int, default=100_000)
+    parser.add_argument("--realisations", type=int, default=100)
+    parser.add_argument("--max_error", type=float, default=DEFAULT_MAX_ERROR)
+    args = parser.parse_args()
+
+    for model, (size, table_error, exact_time, tabulated_time, error) in benchmark(
+        args.sites, args.realisations, args.max_error
+    ).items():
+        print(
+            "{}: {} nodes, exact {:.3f}s, tabulated {:.3f}s ({:.2f}x), max error {:.2g} (table {:.2g})".format(
+                model,
+                size,
+                exact_time,
+                tabulated_time,
+                exact_time / tabulated_time,
+                error,
+                table_error,
+            )
+        )
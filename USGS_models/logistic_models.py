@@ -0,0 +1,338 @@
+"""
+Logistic regression models read from USGS groundfailure model configs (config/*.ini, read with configobj).
+
+The [[terms]], [[coefficients]] and [[coverage]] sections are parsed once and compiled into a Plan,
+a list of NumPy operations over named input arrays, so evaluating a model does no string parsing or eval.
+The linear predictor b0 + b1 * t1 + ... + bN * tN is split into the terms that only depend on the site layers
+(the susceptibility) and those that also depend on the ground motion, which are added to the susceptibility
+before the logistic transform and the coverage equation.
+"""
+
+import ast
+import os
+
+import numpy as np
+
+# ShakeMap macros the terms may use for ground motion
+GROUND_MOTIONS = ("pgv", "pga")
+SUSCEPTIBILITY = "susceptibility"
+PROBABILITY = "P"
+
+FUNCTIONS = {
+    "log": np.log,
+    "log10": np.log10,
+    "exp": np.exp,
+    "sqrt": np.sqrt,
+    "power": np.power,
+    "minimum": np.minimum,
+    "maximum": np.maximum,
+    "abs": np.abs,
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan,
+    "arctan": np.arctan,
+}
+CONSTANTS = {"pi": np.pi, "e": np.e}
+BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.Pow: np.power,
+}
+UNARY_OPERATORS = {ast.USub: np.negative, ast.UAdd: np.positive}
+
+
+def _names(expression):
+    """The variable names an expression uses, excluding functions and constants"""
+    tree = ast.parse(expression, mode="eval")
+    functions = {
+        id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)
+    }
+    return {
+        node.id
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Name)
+        and id(node) not in functions
+        and node.id not in CONSTANTS
+        and node.id != "np"
+    }
+
+
+class Plan:
+    """
+    Expressions (source strings or ast nodes) compiled into a list of ufunc steps over named input arrays.
+    Each distinct subexpression is one step, so it is only evaluated once however often it appears,
+    and constant subexpressions are folded. Intermediate results are released after their last use,
+    and their buffers reused for later steps
+    """
+
+    def __init__(self, expressions, inputs):
+        self.inputs = list(inputs)
+        self._constants = {}
+        self._steps = []
+        self._slots = {}
+        self._input_slots = {name: self._new_slot(("input", name)) for name in inputs}
+        self.outputs = [
+            self._compile(
+                expression
+                if isinstance(expression, ast.AST)
+                else ast.parse(expression, mode="eval").body
+            )
+            for expression in expressions
+        ]
+
+        self.step_slots = {slot for slot, _, _ in self._steps}
+        last_use = {}
+        for step, (_, _, args) in enumerate(self._steps):
+            for arg in args:
+                last_use[arg] = step
+        self._release = [[] for _ in self._steps]
+        for slot, step in last_use.items():
+            if slot not in self.outputs and slot not in self._constants:
+                self._release[step].append(slot)
+
+    def _new_slot(self, key):
+        slot = self._slots[key] = len(self._slots)
+        return slot
+
+    def _constant(self, value):
+        key = ("constant", repr(value))
+        if key not in self._slots:
+            self._constants[self._new_slot(key)] = value
+        return self._slots[key]
+
+    def _compile(self, node):
+        """Adds the steps evaluating node, returning the slot its value is stored in"""
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return self._constant(node.value)
+        if isinstance(node, ast.Name):
+            if node.id in CONSTANTS:
+                return self._constant(CONSTANTS[node.id])
+            if node.id not in self._input_slots:
+                raise ValueError("Unknown name {}".format(node.id))
+            return self._input_slots[node.id]
+        if isinstance(node, ast.Attribute) and _is_numpy(node.value):
+            if node.attr not in CONSTANTS:
+                raise ValueError("Unsupported numpy constant np.{}".format(node.attr))
+            return self._constant(CONSTANTS[node.attr])
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            function = BINARY_OPERATORS[type(node.op)]
+            args = [node.left, node.right]
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            function = UNARY_OPERATORS[type(node.op)]
+            args = [node.operand]
+        elif isinstance(node, ast.Call) and not node.keywords:
+            function = FUNCTIONS.get(_function_name(node.func))
+            if function is None:
+                raise ValueError("Unsupported function {}".format(ast.dump(node.func)))
+            args = node.args
+        else:
+            raise ValueError("Unsupported expression {}".format(ast.dump(node)))
+
+        arg_slots = [self._compile(arg) for arg in args]
+        if all(slot in self._constants for slot in arg_slots):
+            # Folded to a Python float, so like the literals it does not promote float32 inputs to float64
+            return self._constant(
+                function(*(self._constants[slot] for slot in arg_slots)).item()
+            )
+        key = (function, tuple(arg_slots))
+        if key not in self._slots:
+            self._steps.append((self._new_slot(key), function, arg_slots))
+        return self._slots[key]
+
+    def __call__(self, out=None, **arrays):
+        """
+        Evaluates the expressions for the named input arrays, returning a list of their values.
+        With a single expression its final step can write into out
+        """
+        values = dict(self._constants)
+        for name, slot in self._input_slots.items():
+            values[slot] = arrays[name]
+        for (slot, function, args), release in zip(self._steps, self._release):
+            arg_values = [values[arg] for arg in args]
+            target = None
+            if out is not None and slot == self.outputs[-1]:
+                target = out
+            else:
+                # Write into an intermediate result that is not used again, rather than allocating
+                for arg in release:
+                    if arg in self.step_slots and _fits(values[arg], arg_values):
+                        target = values[arg]
+                        break
+            if target is None:
+                values[slot] = function(*arg_values)
+            else:
+                values[slot] = function(*arg_values, out=target)
+            for arg in release:
+                del values[arg]
+        return [values[slot] for slot in self.outputs]
+
+
+def _fits(buffer, arg_values):
+    """Whether buffer can hold the result of an element-wise operation on arg_values"""
+    return (
+        isinstance(buffer, np.ndarray)
+        and buffer.shape == np.broadcast_shapes(*(np.shape(value) for value in arg_values))
+        and buffer.dtype == np.result_type(*arg_values)
+    )
+
+
+def _is_numpy(node):
+    return isinstance(node, ast.Name) and node.id in ("np", "numpy")
+
+
+def _function_name(node):
+    """The name of a function called as name(...) or np.name(...)"""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute) and _is_numpy(node.value):
+        return node.attr
+    return None
+
+
+def _term_key(name):
+    """Orders the b1 ... bN terms numerically"""
+    return int(name[1:])
+
+
+class LogisticModel:
+    """
+    A logistic model from a USGS groundfailure config file, named after the file.
+    layers maps the config's layer names to their grid files, susceptibility_layers / coverage_layers are those used
+    by the site and ground motion terms. ground_motion is the ShakeMap macro the model uses (None if it has no
+    ground motion terms)
+    """
+
+    def __init__(self, config_file):
+        from configobj import ConfigObj
+
+        self.config_file = config_file
+        self.name = os.path.splitext(os.path.basename(config_file))[0]
+        config = ConfigObj(config_file)
+        if len(config.sections) != 1:
+            raise ValueError(
+                "{} should contain a single model section".format(config_file)
+            )
+        model = config[config.sections[0]]
+        self.layers = {
+            layer: model["layers"][layer]["file"]
+            for layer in model["layers"].sections
+        }
+        terms = {name: str(term) for name, term in model["terms"].items()}
+        coefficients = {
+            name: float(coefficient)
+            for name, coefficient in model["coefficients"].items()
+        }
+        coverage = model["coverage"]["eqn"]
+        self.source = {"terms": terms, "coefficients": coefficients, "coverage": coverage}
+
+        ground_motions = set()
+        site_terms = []
+        ground_motion_terms = []
+        for name in sorted(terms, key=_term_key):
+            term_names = _names(terms[name])
+            unknown = term_names - set(self.layers) - set(GROUND_MOTIONS)
+            if unknown:
+                raise ValueError(
+                    "{} term {} uses unknown names {}".format(
+                        config_file, name, sorted(unknown)
+                    )
+                )
+            term = "({}) * {!r}".format(terms[name], coefficients[name])
+            if term_names & set(GROUND_MOTIONS):
+                ground_motions.update(term_names & set(GROUND_MOTIONS))
+                ground_motion_terms.append((term, term_names))
+            else:
+                # The susceptibility takes the place of the first site term, keeping the terms in config order
+                if not site_terms:
+                    ground_motion_terms.append((SUSCEPTIBILITY, set()))
+                site_terms.append((term, term_names))
+        if len(ground_motions) > 1:
+            raise ValueError(
+                "{} uses more than one ground motion {}".format(
+                    config_file, sorted(ground_motions)
+                )
+            )
+        self.ground_motion = ground_motions.pop() if ground_motions else None
+
+        susceptibility = " + ".join(
+            [repr(coefficients["b0"])] + [term for term, _ in site_terms]
+        )
+        self.susceptibility_layers = {
+            layer: self.layers[layer]
+            for layer in self.layers
+            if any(layer in names for _, names in site_terms)
+        }
+        self._susceptibility_plan = Plan([susceptibility], self.susceptibility_layers)
+
+        if not site_terms:
+            ground_motion_terms.insert(0, (SUSCEPTIBILITY, set()))
+        linear_predictor = " + ".join(term for term, _ in ground_motion_terms)
+        probability = "1 / (exp(-({})) + 1)".format(linear_predictor)
+        self.coverage_layers = {
+            layer: self.layers[layer]
+            for layer in self.layers
+            if any(layer in names for _, names in ground_motion_terms)
+        }
+        coverage_inputs = [SUSCEPTIBILITY] + list(self.coverage_layers)
+        if self.ground_motion is not None:
+            coverage_inputs.append(self.ground_motion)
+        self._coverage_plan = Plan(
+            [
+                _Substitute(PROBABILITY, probability)
+                .visit(ast.parse(coverage, mode="eval"))
+                .body
+            ],
+            coverage_inputs,
+        )
+
+    def calculate_susceptibility(self, **layers):
+        """Calculates the susceptibility from the susceptibility_layers values"""
+        (susceptibility,) = self._susceptibility_plan(**layers)
+        return susceptibility
+
+    def calculate_coverage(self, ground_motion, susceptibility, out=None, **layers):
+        """
+        Calculates the coverage for the ground motions and susceptibility (and coverage_layers values),
+        writing it into out if given
+        """
+        arrays = dict(layers, **{SUSCEPTIBILITY: susceptibility})
+        if self.ground_motion is not None:
+            arrays[self.ground_motion] = ground_motion
+        if out is None:
+            out = np.empty(
+                np.broadcast_shapes(np.shape(ground_motion), np.shape(susceptibility)),
+                dtype=np.result_type(ground_motion, susceptibility),
+            )
+        if self._coverage_plan.outputs[0] in self._coverage_plan.step_slots:
+            self._coverage_plan(out, **arrays)
+        else:
+            # The coverage is an input or constant, so there is no final step to write it
+            (out[...],) = self._coverage_plan(**arrays)
+        return out
+
+
+class _Substitute(ast.NodeTransformer):
+    """Replaces a name with an expression"""
+
+    def __init__(self, name, expression):
+        self.name = name
+        self.expression = ast.parse(expression, mode="eval").body
+
+    def visit_Name(self, node):
+        if node.id == self.name:
+            return self.expression
+        return node
+
+
+def load_models(config_dir):
+    """Loads every model config in config_dir, returning a {name: LogisticModel} dict"""
+    return {
+        model.name: model
+        for model in (
+            LogisticModel(os.path.join(config_dir, config_file))
+            for config_file in sorted(os.listdir(config_dir))
+            if config_file.endswith(".ini")
+        )
+    }
@@ -0,0 +1,242 @@
+"""
+Error bounds for calculating the models in float32 (calculate_gf.py --float32) rather than float64.
+
+The site parameters and ground motions are rounded to float32 and every model is then calculated in float32,
+so the error is the rounding of the inputs carried through the model plus float32 rounding in the model itself.
+FLOAT32_ERROR_BOUNDS is the maximum absolute error against float64 allowed for each model's susceptibility and
+coverage, over the realistic input ranges in INPUT_RANGES. tests/test_precision.py checks them for these functions
+and through calculate_gf (python -m pytest tests), or run this module to check the functions:
+
+    python -m USGS_models.precision
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from USGS_models import calculations
+
+# (low, high) of each input, uniformly sampled
+INPUT_RANGES = {
+    "vs30": (100.0, 1500.0),
+    "precipitation": (0.0, 3000.0),
+    "distance_to_coast": (0.0, 100.0),
+    "distance_to_rivers": (0.0, 50.0),
+    "water_table_depth": (0.0, 100.0),
+    "slope": (0.0, 1.0),
+    "compound_topographic_index": (0.0, 20.0),
+    "rock": (-3.0, 3.0),
+    "landcover": (-3.0, 3.0),
+    "pgv": (0.1, 300.0),
+    "pga": (0.01, 2.0),
+}
+# The INPUT_RANGES input of each calculate_gf site data column, the params members and the config models' layers
+SITE_INPUTS = {
+    "DISTANCE_TO_COAST": "distance_to_coast",
+    "DISTANCE_TO_RIVERS": "distance_to_rivers",
+    "PRECIPITATION": "precipitation",
+    "VS30": "vs30",
+    "WATER_TABLE_DEPTH": "water_table_depth",
+    "SLOPE": "slope",
+    "ROCK": "rock",
+    "LANDCOVER": "landcover",
+    "CTI": "compound_topographic_index",
+    "nz_vs30_nz-specific-v17p3": "vs30",
+    "nz_vs30_topo-based": "vs30",
+    "nz_cti_fil.masked": "compound_topographic_index",
+}
+
+# Model: (susceptibility function, its inputs, coverage function, its ground motion, other coverage inputs)
+MODELS = {
+    "zhu2015": (
+        calculations.calculate_zhu2015_susceptibility,
+        ["compound_topographic_index", "vs30"],
+        calculations.calculate_zhu2015_coverage,
+        "pga",
+        [],
+    ),
+    "zhu2016": (
+        calculations.calculate_zhu2016_susceptibility,
+        [
+            "vs30",
+            "precipitation",
+            "distance_to_coast",
+            "distance_to_rivers",
+            "water_table_depth",
+        ],
+        calculations.calculate_zhu2016_coverage,
+        "pgv",
+        [],
+    ),
+    "zhu2016_coastal": (
+        calculations.calculate_zhu2016_coastal_susceptability,
+        ["vs30", "precipitation", "distance_to_coast", "distance_to_rivers"],
+        calculations.calculate_zhu2016_coastal_coverage,
+        "pgv",
+        [],
+    ),
+    "zhu2017": (
+        calculations.calculate_zhu2017_susceptibility,
+        [
+            "vs30",
+            "precipitation",
+            "distance_to_coast",
+            "distance_to_rivers",
+            "water_table_depth",
+        ],
+        calculations.calculate_zhu2017_coverage,
+        "pgv",
+        [],
+    ),
+    "zhu2017_coastal": (
+        calculations.calculate_zhu2017_coastal_susceptibility,
+        ["vs30", "precipitation", "distance_to_coast", "distance_to_rivers"],
+        calculations.calculate_zhu2017_coastal_coverage,
+        "pgv",
+        [],
+    ),
+    "jessee2017": (
+        calculations.calculate_jessee2017_susceptibility,
+        ["slope", "rock", "compound_topographic_index", "landcover"],
+        calculations.calculate_jessee2017_coverage,
+        "pgv",
+        ["slope"],
+    ),
+}
+
+# Model: (susceptibility, coverage) maximum absolute errors, about twice those measured with the NumPy path.
+# The susceptibilities are O(10) log odds, so a few float32 ulps of them is O(1e-6); the coverages are in [0, 1].
+# With numexpr the models are calculated in float64 and only rounded to float32 at the end, so the errors are smaller
+FLOAT32_ERROR_BOUNDS = {
+    "zhu2015": (1e-5, 2e-6),
+    "zhu2016": (1e-5, 1e-6),
+    "zhu2016_coastal": (1e-5, 2e-6),
+    "zhu2017": (1e-5, 1e-6),
+    "zhu2017_coastal": (1e-5, 2e-6),
+    "jessee2017": (5e-6, 1e-6),
+}
+
+
+def sample_inputs(n, seed=0):
+    """Samples n float64 values of every input in INPUT_RANGES"""
+    rng = np.random.default_rng(seed)
+    return {
+        name: rng.uniform(low, high, n) for name, (low, high) in INPUT_RANGES.items()
+    }
+
+
+def sample_input(rng, name, shape):
+    """Samples values of the INPUT_RANGES input name from the generator rng"""
+    low, high = INPUT_RANGES[name]
+    return rng.uniform(low, high, shape)
+
+
+def synthetic_site_data(columns, points, index=None, seed=0):
+    """A table of site data columns (see SITE_INPUTS) for points sites, in place of sampling calculate_gf's grids"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {column: sample_input(rng, SITE_INPUTS[column], points) for column in columns},
+        index=index if index is not None else range(points),
+    )
+
+
+def synthetic_input(points, realisations, seed=0):
+    """A calculate_gf input table with pgv, scaled pgv and scaled pga realisation columns"""
+    rng = np.random.default_rng(seed)
+    columns = {
+        "station": ["s{}".format(i) for i in range(points)],
+        "lon": rng.uniform(166, 179, points),
+        "lat": rng.uniform(-47, -34, points),
+    }
+    for realisation in range(realisations):
+        columns["pgv_{}".format(realisation)] = sample_input(rng, "pgv", points)
+        columns["pgv_scaled_{}".format(realisation)] = sample_input(
+            rng, "pgv", points
+        )
+        columns["pga_scaled_{}".format(realisation)] = sample_input(
+            rng, "pga", points
+        )
+    return pd.DataFrame(columns)
+
+
+def calculate_model(model, inputs, dtype):
+    """Calculates a model's susceptibility and coverage with the inputs (and all the calculations) in dtype"""
+    (
+        susceptibility_function,
+        site_inputs,
+        coverage_function,
+        ground_motion,
+        coverage_inputs,
+    ) = MODELS[model]
+    inputs = {name: np.asarray(values, dtype=dtype) for name, values in inputs.items()}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        susceptibility = susceptibility_function(
+            *(inputs[name] for name in site_inputs)
+        )
+        # The coverage functions take the ground motion first and the susceptibility last
+        coverage = coverage_function(
+            inputs[ground_motion],
+            *(inputs[name] for name in coverage_inputs),
+            susceptibility
+        )
+    return susceptibility, coverage
+
+
+def float32_errors(n=1_000_000, seed=0):
+    """The maximum absolute (susceptibility, coverage) errors of each model calculated in float32 rather than float64"""
+    inputs = sample_inputs(n, seed)
+    errors = {}
+    for model in MODELS:
+        expected = calculate_model(model, inputs, np.float64)
+        actual = calculate_model(model, inputs, np.float32)
+        for values in actual:
+            if values.dtype != np.float32:
+                raise ValueError(
+                    "{} was calculated in {}, not float32".format(model, values.dtype)
+                )
+        errors[model] = tuple(
+            float(np.nanmax(np.abs(a.astype(np.float64) - e)))
+            for a, e in zip(actual, expected)
+        )
+    return errors
+
+
+def check_float32_errors(n=1_000_000, seed=0):
+    """Raises a ValueError if any model's float32 error exceeds FLOAT32_ERROR_BOUNDS, returning the errors otherwise"""
+    errors = float32_errors(n, seed)
+    exceeded = {
+        model: (error, FLOAT32_ERROR_BOUNDS[model])
+        for model, error in errors.items()
+        if any(e > bound for e, bound in zip(error, FLOAT32_ERROR_BOUNDS[model]))
+    }
+    if exceeded:
+        raise ValueError(
+            "float32 errors (susceptibility, coverage) exceed their bounds: {}".format(
+                exceeded
+            )
+        )
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Checks the float32 error of every model against FLOAT32_ERROR_BOUNDS"
+    )
+    parser.add_argument(
+        "-n", type=int, default=1_000_000, help="Number of sampled input sets"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for model, (susceptibility_error, coverage_error) in check_float32_errors(
+        args.n, args.seed
+    ).items():
+        print(
+            "{}: susceptibility {:.3g}, coverage {:.3g} (bounds {:.0e}, {:.0e})".format(
+                model,
+                susceptibility_error,
+                coverage_error,
+                *FLOAT32_ERROR_BOUNDS[model]
+            )
+        )
@@ -0,0 +1,347 @@
+"""
+Benchmarks of the USGS_models.calculations functions and calculate_gf, on synthetic site parameters and ground motions
+(drawn from the input ranges of USGS_models.precision) at 10^3 to 10^7 points and 1 to 1000 realisations.
+
+The suite is written for asv (params, setup, time_* and peakmem_* methods), and can be run without it:
+
+    python -m benchmarks.benchmarks [--quick] [--filter name] [--save results.json] [--compare baseline.json]
+
+which times each benchmark with timeit (best of --repeat runs) and measures its peak traced memory with tracemalloc,
+flagging anything more than --tolerance times slower or larger than the --compare results.
+calculate_gf's site sampling is replaced by a stub returning synthetic site parameters, so no grids or GMT are needed.
+Combinations over MAX_VALUES (points x realisations) are skipped
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import timeit
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import calculate_gf
+from USGS_models import calculations, precision
+
+POINTS = [10 ** 3, 10 ** 5, 10 ** 7]
+REALISATIONS = [1, 10, 100, 1000]
+MODELS = list(precision.MODELS)
+# The ways the calculations functions can be evaluated (see USGS_models.calculations)
+PATHS = ["numpy", "numexpr"]
+# The most (points x realisations) values a benchmark uses, so the largest combinations fit in memory
+MAX_VALUES = 10 ** 8
+# calculate_gf reads and writes every value as text, so it is run on fewer
+MAX_END_TO_END_VALUES = 10 ** 7
+
+def _skip_if_too_large(points, realisations, max_values=MAX_VALUES):
+    # asv skips a benchmark whose setup raises NotImplementedError
+    if points * realisations > max_values:
+        raise NotImplementedError(
+            "{} points x {} realisations is over {} values".format(
+                points, realisations, max_values
+            )
+        )
+
+
+def stub_site_data(models_dir, lons, lats, gfe_type, index=None, **kwargs):
+    """Replaces calculate_gf.get_site_data, returning synthetic site parameters instead of sampling the grids"""
+    return precision.synthetic_site_data(
+        [param.name for param in calculate_gf.get_required_params(gfe_type)],
+        len(lons),
+        index,
+    )
+
+
+class Susceptibility:
+    """Each model's susceptibility function"""
+
+    params = (MODELS, POINTS)
+    param_names = ["model", "points"]
+
+    def setup(self, model, points):
+        rng = np.random.default_rng(0)
+        function, inputs, _, _, _ = precision.MODELS[model]
+        self.function = function
+        self.inputs = [precision.sample_input(rng, name, points) for name in inputs]
+        self.out = np.empty(points)
+
+    def time_susceptibility(self, model, points):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.function(*self.inputs, out=self.out)
+
+    def peakmem_susceptibility(self, model, points):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.function(*self.inputs)
+
+
+class Coverage:
+    """Each model's coverage function, for a (points, realisations) block of ground motions"""
+
+    params = (MODELS, POINTS, REALISATIONS)
+    param_names = ["model", "points", "realisations"]
+
+    def setup(self, model, points, realisations):
+        _skip_if_too_large(points, realisations)
+        rng = np.random.default_rng(0)
+        (
+            susceptibility_function,
+            site_inputs,
+            self.function,
+            ground_motion,
+            coverage_inputs,
+        ) = precision.MODELS[model]
+        inputs = {
+            name: precision.sample_input(rng, name, points) for name in site_inputs
+        }
+        with np.errstate(invalid="ignore", divide="ignore"):
+            susceptibility = susceptibility_function(
+                *(inputs[name] for name in site_inputs)
+            )
+        self.args = (
+            [precision.sample_input(rng, ground_motion, (points, realisations))]
+            + [
+                precision.sample_input(rng, name, points)[:, np.newaxis]
+                for name in coverage_inputs
+            ]
+            + [susceptibility[:, np.newaxis]]
+        )
+        self.out = np.empty((points, realisations))
+
+    def time_coverage(self, model, points, realisations):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.function(*self.args, out=self.out)
+
+    def peakmem_coverage(self, model, points, realisations):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.function(*self.args)
+
+
+class Probability:
+    """Each model's probability function on the in-place NumPy and fused numexpr paths, whatever the thread count"""
+
+    params = (MODELS, POINTS, PATHS)
+    param_names = ["model", "points", "path"]
+
+    def setup(self, model, points, path):
+        if path == "numexpr" and calculations.numexpr is None:
+            raise NotImplementedError("numexpr is not installed")
+        self.use_numexpr = calculations._use_numexpr
+        calculations._use_numexpr = lambda: path == "numexpr"
+        rng = np.random.default_rng(0)
+        _, site_inputs, _, ground_motion, _ = precision.MODELS[model]
+        self.function = getattr(calculations, "calculate_{}_probability".format(model))
+        self.args = [precision.sample_input(rng, ground_motion, points)] + [
+            precision.sample_input(rng, name, points) for name in site_inputs
+        ]
+        self.out = np.empty(points)
+
+    def teardown(self, *params):
+        calculations._use_numexpr = self.use_numexpr
+
+    def time_probability(self, model, points, path):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.function(*self.args, out=self.out)
+
+    def peakmem_probability(self, model, points, path):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.function(*self.args)
+
+
+class _StubbedSiteData:
+    """Replaces calculate_gf.get_site_data with stub_site_data during a benchmark"""
+
+    def setup_site_data(self):
+        self.get_site_data = calculate_gf.get_site_data
+        calculate_gf.get_site_data = stub_site_data
+
+    def teardown(self, *params):
+        calculate_gf.get_site_data = self.get_site_data
+
+
+class CalculateChunk(_StubbedSiteData):
+    """calculate_chunk for every model, from an input table in memory"""
+
+    params = (POINTS, REALISATIONS)
+    param_names = ["points", "realisations"]
+
+    def setup(self, points, realisations):
+        # The input has three ground motion columns per realisation
+        _skip_if_too_large(points, 3 * realisations)
+        self.setup_site_data()
+        self.df = precision.synthetic_input(points, realisations)
+        self.gfe_type = list(calculate_gf.gfe_types)
+
+    def time_calculate_chunk(self, points, realisations):
+        calculate_gf.calculate_chunk(
+            self.df.copy(), None, self.gfe_type, True, new_columns_only=True
+        )
+
+    def peakmem_calculate_chunk(self, points, realisations):
+        calculate_gf.calculate_chunk(
+            self.df.copy(), None, self.gfe_type, True, new_columns_only=True
+        )
+
+
+class CalculateGF(_StubbedSiteData):
+    """calculate_gf end to end for every model, reading and writing csv in chunks"""
+
+    params = (POINTS, REALISATIONS)
+    param_names = ["points", "realisations"]
+    chunksize = 100_000
+
+    def setup(self, points, realisations):
+        _skip_if_too_large(points, 3 * realisations, MAX_END_TO_END_VALUES)
+        self.setup_site_data()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.tmp_dir, "input.csv")
+        self.output_file = os.path.join(self.tmp_dir, "output.csv")
+        precision.synthetic_input(points, realisations).to_csv(
+            self.input_file, index=False
+        )
+        self.gfe_type = list(calculate_gf.gfe_types)
+
+    def teardown(self, *params):
+        super().teardown(*params)
+        shutil.rmtree(self.tmp_dir)
+
+    def time_calculate_gf(self, points, realisations):
+        calculate_gf.calculate_gf(
+            self.input_file,
+            self.output_file,
+            None,
+            self.gfe_type,
+            True,
+            chunksize=self.chunksize,
+        )
+
+    def peakmem_calculate_gf(self, points, realisations):
+        self.time_calculate_gf(points, realisations)
+
+
+BENCHMARKS = [Susceptibility, Coverage, Probability, CalculateChunk, CalculateGF]
+
+
+def run_benchmark(benchmark, method, params, repeat=3):
+    """
+    Runs a benchmark method for a combination of params, returning the best time in seconds of repeat runs
+    (time_* methods) or the peak traced memory in bytes (peakmem_* methods), or None if it is skipped
+    """
+    instance = benchmark()
+    try:
+        instance.setup(*params)
+    except NotImplementedError:
+        return None
+    try:
+        function = getattr(instance, method)
+        if method.startswith("time_"):
+            return min(
+                timeit.repeat(lambda: function(*params), number=1, repeat=repeat)
+            )
+        tracemalloc.start()
+        try:
+            function(*params)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    finally:
+        if hasattr(instance, "teardown"):
+            instance.teardown(*params)
+
+
+def run_benchmarks(
+    benchmarks=BENCHMARKS,
+    name_filter=None,
+    max_points=None,
+    max_realisations=None,
+    repeat=3,
+):
+    """Runs every benchmark method and combination of params, returning a {name: result} dict"""
+    results = {}
+    for benchmark in benchmarks:
+        methods = [
+            method
+            for method in dir(benchmark)
+            if method.startswith("time_") or method.startswith("peakmem_")
+        ]
+        for params in itertools.product(*benchmark.params):
+            named = dict(zip(benchmark.param_names, params))
+            if max_points is not None and named.get("points", 0) > max_points:
+                continue
+            if (
+                max_realisations is not None
+                and named.get("realisations", 0) > max_realisations
+            ):
+                continue
+            for method in methods:
+                name = "{}.{}({})".format(
+                    benchmark.__name__,
+                    method,
+                    ", ".join("{}={}".format(key, value) for key, value in named.items()),
+                )
+                if name_filter is not None and name_filter not in name:
+                    continue
+                result = run_benchmark(benchmark, method, params, repeat)
+                if result is not None:
+                    results[name] = result
+                    print(
+                        "{}: {}".format(
+                            name,
+                            "{:.4g}s".format(result)
+                            if method.startswith("time_")
+                            else "{:.4g}MB".format(result / 2 ** 20),
+                        ),
+                        flush=True,
+                    )
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """The benchmarks in results more than tolerance times slower or larger than in baseline"""
+    return {
+        name: (baseline[name], result)
+        for name, result in results.items()
+        if name in baseline and result > tolerance * baseline[name]
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs the benchmarks without asv, timing them with timeit and measuring peak memory with tracemalloc"
+    )
+    parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="Only run up to 10^5 points and a single realisation",
+    )
+    parser.add_argument("--filter", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs")
+    parser.add_argument("--save", help="JSON file to save the results to")
+    parser.add_argument("--compare", help="JSON file of baseline results to compare to")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.2,
+        help="Ratio to the baseline over which a result is a regression",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        name_filter=args.filter,
+        max_points=10 ** 5 if args.quick else None,
+        max_realisations=1 if args.quick else None,
+        repeat=args.repeat,
+    )
+    if args.save is not None:
+        with open(args.save, "w") as results_fp:
+            json.dump(results, results_fp, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as baseline_fp:
+            regressions = compare(results, json.load(baseline_fp), args.tolerance)
+        for name, (baseline, result) in regressions.items():
+            print("Regression {}: {:.4g} -> {:.4g}".format(name, baseline, result))
+        if regressions:
+            raise SystemExit(1)
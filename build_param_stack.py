@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+Builds the parameter stack used by calculate_gf --param_stack.
+Every params grid is resampled onto the nodes of a single base grid (VS30 by default) and stored as one
+memory-mappable float32 array, so it is only decompressed once and can be shared by concurrent jobs.
+The layers of the model configs given with --config that are not params grids are added to the stack after them.
+"""
+
+import argparse
+import os
+
+import gf_grids
+from calculate_gf import DEFAULT_CONFIG_DIR, ConfigModel, get_gfe_type, params
+
+
+def get_grid_files(models_dir, configs=()):
+    """
+    Returns the {param name: grid path} of every parameter, then of the layers of the ConfigModels in configs,
+    in stack band order
+    """
+    grid_files = {param.name: os.path.join(models_dir, param.value) for param in params}
+    for config in configs:
+        for layer in config.columns + tuple(config.coverage_params.values()):
+            grid_files.setdefault(layer.name, os.path.join(models_dir, layer.value))
+    return grid_files
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("stack_dir", help="Folder to write the stack to")
+    parser.add_argument(
+        "--models_dir",
+        "-m",
+        help="Folder containing the models",
+        default="/nesi/project/nesi00213/groundfailure/models",
+    )
+    parser.add_argument(
+        "--base",
+        "-b",
+        help="Parameter whose grid nodes all the others are resampled onto",
+        choices=[param.name for param in params],
+        default=params.VS30.name,
+    )
+    parser.add_argument(
+        "--config",
+        nargs="+",
+        default=[],
+        help="Names of model configs in --config_dir whose layers are added to the stack, "
+        "so they can be calculated from it",
+    )
+    parser.add_argument(
+        "--config_dir",
+        help="Folder of USGS groundfailure model configs (*.ini)",
+        default=DEFAULT_CONFIG_DIR,
+    )
+    parser.add_argument(
+        "--block_rows",
+        help="Number of base grid rows resampled at a time",
+        type=int,
+        default=512,
+    )
+    args = parser.parse_args()
+    try:
+        configs = [get_gfe_type(name, args.config_dir) for name in args.config]
+    except ValueError as e:
+        parser.error(str(e))
+    if not all(isinstance(config, ConfigModel) for config in configs):
+        parser.error("--config takes the names of model configs, not gfe types")
+
+    grid_files = get_grid_files(args.models_dir, configs)
+    gf_grids.build_stack(
+        grid_files, args.stack_dir, grid_files[args.base], args.block_rows
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,27 +2,47 @@
 
 """
 Calculates Ground Failure (liquefaction & landslide) susceptibility & probability at points specified by the input files.
-Depends on GMT binaries being in the path
+The model grids are read directly with netCDF4, GMT is not required.
+Besides the gfe_types, the logistic models in USGS groundfailure configs (config/*.ini) can be calculated by name
 """
 
 import argparse
-import tempfile
+import collections
+import contextlib
+import functools
+import hashlib
+import inspect
+import itertools
+import json
+import multiprocessing
 import os
-import subprocess
+import shutil
+import threading
 from enum import Enum
 
+import numpy as np
 import pandas as pd
 
-from USGS_models import calculations
+import gf_grids
+import gf_output
+import gf_statistics
+from USGS_models import (
+    calculations,
+    coefficient_uncertainty,
+    coverage_tables,
+    logistic_models,
+)
 
 LON = "lon"
 LAT = "lat"
+ROW_ID = "row_id"
 JESSEE_2017_SUSCEPTIBILITY = "jessee2017_susceptibility"
 ZHU_2017_COASTAL_SUSCEPTIBILITY = "zhu2017_coastal_susceptibility"
 ZHU_2017_SUSCEPTIBILITY = "zhu2017_susceptibility"
 ZHU_2016_COASTAL_SUSCEPTIBILITY = "zhu2016_coastal_susceptibility"
 ZHU_2016_SUSCEPTIBILITY = "zhu2016_susceptibility"
 ZHU_2015_SUSCEPIBILITY = "zhu2015_susceptibility"
+DEFAULT_CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config")
 
 
 class params(Enum):
@@ -89,9 +109,136 @@ class gfe_types(Enum):
         return obj
 
 
-def get_model_path(model_dir, model):
-    """Returns path to a model file as an input argument to GMT functions"""
-    return "-G" + str(os.path.join(model_dir, model))
+SUSCEPTIBILITY_COLUMNS = {
+    gfe_types.zhu2015: ZHU_2015_SUSCEPIBILITY,
+    gfe_types.zhu2016: ZHU_2016_SUSCEPTIBILITY,
+    gfe_types.zhu2016_coastal: ZHU_2016_COASTAL_SUSCEPTIBILITY,
+    gfe_types.zhu2017: ZHU_2017_SUSCEPTIBILITY,
+    gfe_types.zhu2017_coastal: ZHU_2017_COASTAL_SUSCEPTIBILITY,
+    gfe_types.jessee2017: JESSEE_2017_SUSCEPTIBILITY,
+}
+
+
+# Models with the same equations as another model, so their susceptibility is the same
+# and their coverage is the same for the same ground motions
+EQUIVALENT_MODELS = {
+    gfe_types.zhu2017: gfe_types.zhu2016,
+    gfe_types.zhu2017_coastal: gfe_types.zhu2016_coastal,
+}
+
+
+# In the order they are written to the output file
+PROBABILITY_COLUMNS = {
+    gfe_types.jessee2017: "jessee2017_probability_{}",
+    gfe_types.zhu2015: "zhu2015_coastal_probability_{}",
+    gfe_types.zhu2016: "zhu2016_probability_{}",
+    gfe_types.zhu2016_coastal: "zhu2016_coastal_probability_{}",
+    gfe_types.zhu2017: "zhu2017_probability_{}",
+    gfe_types.zhu2017_coastal: "zhu2017_coastal_probability_{}",
+}
+
+# The ground motion at which a model's coverage reaches a target coverage, by model name and target coverage
+THRESHOLD_COLUMN = "{}_threshold_{}"
+# A percentile of the coverage over sampled coefficients, by probability column and percentile
+PERCENTILE_COLUMN = "{}_p{:g}"
+
+
+# A model grid that is not one of params, named after its file
+ModelLayer = collections.namedtuple("ModelLayer", ["name", "value"])
+
+
+def get_layer_param(layer_file):
+    """The params member for a model grid file, or a ModelLayer if it is not one of them"""
+    for param in params:
+        if param.value == layer_file:
+            return param
+    return ModelLayer(os.path.splitext(layer_file)[0], layer_file)
+
+
+class ConfigModel:
+    """
+    A logistic model compiled from a USGS groundfailure config (see USGS_models.logistic_models), named after the file.
+    Has the name, str_value and columns of a gfe_types member so it can be calculated alongside them
+    """
+
+    def __init__(self, config_file):
+        self.model = logistic_models.LogisticModel(config_file)
+        self.name = self.str_value = self.model.name
+        self.susceptibility_column = "{}_susceptibility".format(self.name)
+        self.probability_column = "{}_probability_{{}}".format(self.name)
+        self.susceptibility_params = {
+            layer: get_layer_param(layer_file)
+            for layer, layer_file in self.model.susceptibility_layers.items()
+        }
+        self.coverage_params = {
+            layer: get_layer_param(layer_file)
+            for layer, layer_file in self.model.coverage_layers.items()
+        }
+        self.columns = tuple(self.susceptibility_params.values())
+
+    def __eq__(self, other):
+        return isinstance(other, ConfigModel) and other.name == self.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __repr__(self):
+        return "ConfigModel({})".format(self.name)
+
+    def calculate_susceptibility(self, site_params):
+        return self.model.calculate_susceptibility(
+            **{
+                layer: np.asarray(site_params[param.name])
+                for layer, param in self.susceptibility_params.items()
+            }
+        )
+
+    def calculate_coverage(self, ground_motion, susceptibility, site_data, out=None):
+        return self.model.calculate_coverage(
+            ground_motion,
+            susceptibility,
+            out,
+            **{
+                layer: site_data[param.name].values[:, np.newaxis]
+                for layer, param in self.coverage_params.items()
+            }
+        )
+
+
+def get_gfe_type(name, config_dir=DEFAULT_CONFIG_DIR):
+    """Finds a gfe type by name, either a gfe_types member or a ConfigModel for the config of that name in config_dir"""
+    if name in gfe_types.__members__:
+        return gfe_types[name]
+    config_file = os.path.join(config_dir, "{}.ini".format(name))
+    if not os.path.isfile(config_file):
+        raise ValueError(
+            "Unknown groundfailure type {}, it is not one of {} or a config in {}".format(
+                name, [gfe.str_value for gfe in gfe_types], config_dir
+            )
+        )
+    return ConfigModel(config_file)
+
+
+def get_susceptibility_column(gfe):
+    if isinstance(gfe, ConfigModel):
+        return gfe.susceptibility_column
+    return SUSCEPTIBILITY_COLUMNS[gfe]
+
+
+def get_probability_columns(gfe_type):
+    """
+    The (gfe, probability column format) of each model in gfe_type in the order they are written out:
+    gfe_types in the order of PROBABILITY_COLUMNS, then config models in the order requested
+    """
+    probability_columns = [
+        (gfe, column) for gfe, column in PROBABILITY_COLUMNS.items() if gfe in gfe_type
+    ]
+    probability_columns.extend(
+        (gfe, gfe.probability_column)
+        for gfe in gfe_type
+        if isinstance(gfe, ConfigModel)
+    )
+    return probability_columns
 
 
 def get_required_params(gfe_type):
@@ -101,12 +248,23 @@ def get_required_params(gfe_type):
     return sorted(list(params), key=lambda x: x.name)
 
 
-def get_models(model_dir, gfe_type):
-    """Determines the models needed for the specific GroundFailure type"""
-    models = []
-    for model_type in get_required_params(gfe_type):
-        models.append(get_model_path(model_dir, model_type.value))
-    return models
+def get_coverage_params(gfe_type):
+    """Determines the params needed on top of the susceptibility to calculate coverage"""
+    coverage_params = set()
+    if gfe_types.jessee2017 in gfe_type:
+        coverage_params.add(params.SLOPE)
+    for gfe in gfe_type:
+        if isinstance(gfe, ConfigModel):
+            coverage_params.update(gfe.coverage_params.values())
+    return sorted(coverage_params, key=lambda x: x.name)
+
+
+def get_models(model_dir, required_params):
+    """Determines the model grid files needed for the required params"""
+    return {
+        model_type.name: os.path.join(model_dir, model_type.value)
+        for model_type in required_params
+    }
 
 
 def get_cols(df):
@@ -124,190 +282,965 @@ def get_cols(df):
     return lat_col, lon_col
 
 
-def interpolate_input_grid(model_dirs, xy_file, inputs_file, gfe_type):
-    """Uses grdtrack to sample the groundfailure input grids and write their values to `inputs_file`"""
-    models = get_models(model_dirs, gfe_type)
-    with open(inputs_file, "w") as inputs_fp:
-        columns = "	".join(param.name for param in get_required_params(gfe_type))
-        columns = "{}	{}	".format(LON, LAT) + columns + "\n"
-        inputs_fp.write(columns)
-        inputs_fp.flush()
-        cmd = ["grdtrack", xy_file, "-nl"]
-        cmd.extend(models)
-        print(" ".join(cmd))
-        subprocess.call(cmd, stdout=inputs_fp)
+def interpolate_input_grid(
+    model_dirs, lons, lats, required_params, param_stack=None, index=None
+):
+    """
+    Bilinearly samples the required parameter grids at the given points, returning a DataFrame of their values
+    in the order of the points, indexed by the row ids in index (0..n-1 by default).
+    Samples the bands of the prebuilt parameter stack instead of the individual grids if one is given
+    """
+    source_data = pd.DataFrame(index=index if index is not None else range(len(lons)))
+    if param_stack is None:
+        sampled = gf_grids.sample_grids(
+            get_models(model_dirs, required_params), lons, lats
+        )
+    else:
+        sampled = gf_grids.sample_stack(
+            param_stack, [param.name for param in required_params], lons, lats
+        )
+    for param in required_params:
+        source_data[param.name] = sampled[param.name]
+    return source_data
 
 
-def calculate_gf(
-    input_file, output_file, models_dir, gfe_type, store_susceptibility=False
+def get_shared_terms(site_params):
+    """
+    Calculates the site terms that appear in more than one model's equations (see calculations.SHARED_TERMS),
+    for the parameters in site_params
+    """
+    terms = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if params.VS30.name in site_params:
+            terms["log_vs30"] = np.log(np.asarray(site_params[params.VS30.name]))
+        if params.DISTANCE_TO_COAST.name in site_params:
+            terms["sqrt_distance_to_coast"] = np.sqrt(
+                np.asarray(site_params[params.DISTANCE_TO_COAST.name])
+            )
+        if params.SLOPE.name in site_params:
+            terms["arctan_slope"] = np.arctan(
+                np.asarray(site_params[params.SLOPE.name])
+            )
+    return terms
+
+
+def calculate_susceptibility(gfe, site_params, shared_terms=None):
+    """
+    Calculates the susceptibility of a model from the site parameters, a mapping of param name to values.
+    shared_terms are precalculated terms from get_shared_terms
+    """
+    shared_terms = shared_terms or {}
+    if isinstance(gfe, ConfigModel):
+        return gfe.calculate_susceptibility(site_params)
+    if gfe is gfe_types.zhu2015:
+        return calculations.calculate_zhu2015_susceptibility(
+            site_params[params.CTI.name],
+            site_params[params.VS30.name],
+            log_vs30=shared_terms.get("log_vs30"),
+        )
+    if gfe is gfe_types.zhu2016:
+        return calculations.calculate_zhu2016_susceptibility(
+            site_params[params.VS30.name],
+            site_params[params.PRECIPITATION.name],
+            site_params[params.DISTANCE_TO_COAST.name],
+            site_params[params.DISTANCE_TO_RIVERS.name],
+            site_params[params.WATER_TABLE_DEPTH.name],
+            log_vs30=shared_terms.get("log_vs30"),
+        )
+    if gfe is gfe_types.zhu2016_coastal:
+        return calculations.calculate_zhu2016_coastal_susceptability(
+            site_params[params.VS30.name],
+            site_params[params.PRECIPITATION.name],
+            site_params[params.DISTANCE_TO_COAST.name],
+            site_params[params.DISTANCE_TO_RIVERS.name],
+            log_vs30=shared_terms.get("log_vs30"),
+            sqrt_distance_to_coast=shared_terms.get("sqrt_distance_to_coast"),
+        )
+    if gfe is gfe_types.zhu2017:
+        return calculations.calculate_zhu2017_susceptibility(
+            site_params[params.VS30.name],
+            site_params[params.PRECIPITATION.name],
+            site_params[params.DISTANCE_TO_COAST.name],
+            site_params[params.DISTANCE_TO_RIVERS.name],
+            site_params[params.WATER_TABLE_DEPTH.name],
+            log_vs30=shared_terms.get("log_vs30"),
+        )
+    if gfe is gfe_types.zhu2017_coastal:
+        return calculations.calculate_zhu2017_coastal_susceptibility(
+            site_params[params.VS30.name],
+            site_params[params.PRECIPITATION.name],
+            site_params[params.DISTANCE_TO_COAST.name],
+            site_params[params.DISTANCE_TO_RIVERS.name],
+            log_vs30=shared_terms.get("log_vs30"),
+            sqrt_distance_to_coast=shared_terms.get("sqrt_distance_to_coast"),
+        )
+    if gfe is gfe_types.jessee2017:
+        return calculations.calculate_jessee2017_susceptibility(
+            site_params[params.SLOPE.name],
+            site_params[params.ROCK.name],
+            site_params[params.CTI.name],
+            site_params[params.LANDCOVER.name],
+            arctan_slope=shared_terms.get("arctan_slope"),
+        )
+    raise ValueError("Unknown groundfailure type {}".format(gfe))
+
+
+def calculate_coverage(
+    gfe,
+    ground_motion,
+    site_data,
+    out=None,
+    log_ground_motion=None,
+    shared_terms=None,
+    coverage_table_error=None,
 ):
-    """Calculates groundfailure at specified locations and stores it in output_file"""
-    with open(input_file, encoding="utf8", errors="backslashreplace") as in_fd:
-        df = pd.read_csv(in_fd)
-    df.columns = [
-        x.lower() if x.lower() not in [LON, "long"] else LON for x in list(df.columns)
-    ]
+    """
+    Calculates the coverage of a model for a (n_points, n_realisations) block of ground motions,
+    broadcasting the site's susceptibility (and slope) across the realisations. The result is written into out if given.
+    log_ground_motion and shared_terms (from get_shared_terms) are used instead of recalculating them if given.
+    With a coverage_table_error the coverage of the coverage_tables.TABULATED_MODELS is interpolated from the model's
+    coverage table, within that error
+    """
+    susceptibility = site_data[get_susceptibility_column(gfe)].values[:, np.newaxis]
+    shared_terms = shared_terms or {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if isinstance(gfe, ConfigModel):
+            return gfe.calculate_coverage(ground_motion, susceptibility, site_data, out)
+        if (
+            coverage_table_error is not None
+            and gfe.str_value in coverage_tables.TABULATED_MODELS
+        ):
+            arctan_slope = shared_terms.get("arctan_slope")
+            return coverage_tables.calculate_tabulated_coverage(
+                gfe.str_value,
+                ground_motion,
+                susceptibility,
+                out,
+                coverage_table_error,
+                log_ground_motion,
+                site_data[params.SLOPE.name].values[:, np.newaxis]
+                if gfe is gfe_types.jessee2017
+                else None,
+                None if arctan_slope is None else arctan_slope[:, np.newaxis],
+            )
+        if gfe is gfe_types.zhu2015:
+            return calculations.calculate_zhu2015_coverage(
+                ground_motion, susceptibility, out, log_scaled_pga=log_ground_motion
+            )
+        if gfe is gfe_types.zhu2016:
+            return calculations.calculate_zhu2016_coverage(
+                ground_motion, susceptibility, out, log_pgv=log_ground_motion
+            )
+        if gfe is gfe_types.zhu2016_coastal:
+            return calculations.calculate_zhu2016_coastal_coverage(
+                ground_motion, susceptibility, out, log_pgv=log_ground_motion
+            )
+        if gfe is gfe_types.zhu2017:
+            return calculations.calculate_zhu2017_coverage(
+                ground_motion, susceptibility, out, log_scaled_pgv=log_ground_motion
+            )
+        if gfe is gfe_types.zhu2017_coastal:
+            return calculations.calculate_zhu2017_coastal_coverage(
+                ground_motion, susceptibility, out, log_pgv=log_ground_motion
+            )
+        if gfe is gfe_types.jessee2017:
+            arctan_slope = shared_terms.get("arctan_slope")
+            return calculations.calculate_jessee2017_coverage(
+                ground_motion,
+                site_data[params.SLOPE.name].values[:, np.newaxis],
+                susceptibility,
+                out,
+                log_pgv=log_ground_motion,
+                arctan_slope=None
+                if arctan_slope is None
+                else arctan_slope[:, np.newaxis],
+            )
+    raise ValueError("Unknown groundfailure type {}".format(gfe))
+
+
+def get_site_terms(gfe, site_data):
+    """The site terms of a model whose coefficients can be sampled (see USGS_models.coefficient_uncertainty)"""
+    if gfe is gfe_types.zhu2016:
+        return coefficient_uncertainty.site_terms(
+            gfe.str_value,
+            vs30=site_data[params.VS30.name].values,
+            precipitation=site_data[params.PRECIPITATION.name].values,
+            distance_to_coast=site_data[params.DISTANCE_TO_COAST.name].values,
+            distance_to_rivers=site_data[params.DISTANCE_TO_RIVERS.name].values,
+            water_table_depth=site_data[params.WATER_TABLE_DEPTH.name].values,
+        )
+    if gfe is gfe_types.jessee2017:
+        return coefficient_uncertainty.site_terms(
+            gfe.str_value,
+            slope=site_data[params.SLOPE.name].values,
+            rock=site_data[params.ROCK.name].values,
+            compound_topographic_index=site_data[params.CTI.name].values,
+            landcover=site_data[params.LANDCOVER.name].values,
+        )
+    raise ValueError("Coefficients can not be sampled for {}".format(gfe))
+
+
+def calculate_coverage_statistics(
+    gfe,
+    ground_motion_columns,
+    df,
+    site_data,
+    statistics,
+    out=None,
+    shared_terms=None,
+    coverage_table_error=None,
+):
+    """
+    Calculates the gf_statistics StatisticsOptions of a model's coverage over the realisations in ground_motion_columns
+    of df, statistics.batch_size realisations at a time. Returns (points, statistics) values, written into out if given
+    """
+    dtype = site_data[get_susceptibility_column(gfe)].dtype
+    accumulator = gf_statistics.RealisationStatistics(len(df), statistics)
+    batch = np.empty(
+        (len(df), min(statistics.batch_size, len(ground_motion_columns))),
+        dtype=dtype,
+        order="F",
+    )
+    for start in range(0, len(ground_motion_columns), statistics.batch_size):
+        columns = ground_motion_columns[start : start + statistics.batch_size]
+        coverage = batch[:, : len(columns)]
+        calculate_coverage(
+            gfe,
+            df[columns].to_numpy(dtype=dtype),
+            site_data,
+            coverage,
+            shared_terms=shared_terms,
+            coverage_table_error=coverage_table_error,
+        )
+        accumulator.update(coverage)
+    if out is None:
+        return accumulator.values()
+    out[...] = accumulator.values()
+    return out
+
+
+def calculate_threshold(gfe, coverage, site_data, out=None, shared_terms=None):
+    """
+    Calculates the ground motion (the one the model's coverage uses) at which each site's coverage reaches coverage,
+    NaN where the model never reaches it. The result is written into out if given
+    """
+    susceptibility = site_data[get_susceptibility_column(gfe)].values
+    shared_terms = shared_terms or {}
+    if gfe is gfe_types.zhu2015:
+        return calculations.calculate_zhu2015_inverse_coverage(
+            coverage, susceptibility, out
+        )
+    if gfe is gfe_types.zhu2016:
+        return calculations.calculate_zhu2016_inverse_coverage(
+            coverage, susceptibility, out
+        )
+    if gfe is gfe_types.zhu2016_coastal:
+        return calculations.calculate_zhu2016_coastal_inverse_coverage(
+            coverage, susceptibility, out
+        )
+    if gfe is gfe_types.zhu2017:
+        return calculations.calculate_zhu2017_inverse_coverage(
+            coverage, susceptibility, out
+        )
+    if gfe is gfe_types.zhu2017_coastal:
+        return calculations.calculate_zhu2017_coastal_inverse_coverage(
+            coverage, susceptibility, out
+        )
+    if gfe is gfe_types.jessee2017:
+        return calculations.calculate_jessee2017_inverse_coverage(
+            coverage,
+            site_data[params.SLOPE.name].values,
+            susceptibility,
+            out,
+            arctan_slope=shared_terms.get("arctan_slope"),
+        )
+    raise ValueError("Threshold ground motions are not available for {}".format(gfe))
+
+
+def get_susceptibility_hash(param_stack, gfe):
+    """
+    Hashes everything a cached susceptibility grid depends on:
+    the parameter stack and its source grids, and the model coefficients in calculations.py (or the model's config)
+    """
+    key = {
+        "gfe_type": gfe.str_value,
+        "stack": gf_grids.stack_version(param_stack),
+        "calculations": gfe.model.source
+        if isinstance(gfe, ConfigModel)
+        else inspect.getsource(calculations),
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def build_susceptibility_grid(param_stack, stack_dir, gfe, block_rows=512):
+    """Calculates the susceptibility of a model at every node of the parameter stack, storing it as a stack in stack_dir"""
+    metadata, stack = gf_grids.load_stack(param_stack)
+    x, y = gf_grids.stack_coords(metadata)
+    band_index = {band: index for index, band in enumerate(metadata["bands"])}
+    missing = [param.name for param in gfe.columns if param.name not in band_index]
+    if missing:
+        raise ValueError(
+            "Stack {} does not contain the bands {}".format(param_stack, missing)
+        )
+
+    def susceptibility_block(row_start, block_y):
+        rows = slice(row_start, row_start + len(block_y))
+        site_params = {
+            param.name: stack[band_index[param.name], rows].astype(np.float64)
+            for param in gfe.columns
+        }
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return [calculate_susceptibility(gfe, site_params)]
+
+    gf_grids.write_stack(
+        stack_dir,
+        [get_susceptibility_column(gfe)],
+        x,
+        y,
+        susceptibility_block,
+        block_rows,
+        param_stack=os.path.abspath(param_stack),
+    )
+
+
+def check_param_stack(param_stack, gfe_type):
+    """Raises a ValueError if the parameter stack is missing bands the models in gfe_type need"""
+    metadata, _ = gf_grids.load_stack(param_stack)
+    layers = set(get_required_params(gfe_type)) | set(get_coverage_params(gfe_type))
+    missing = sorted(
+        layer.name for layer in layers if layer.name not in metadata["bands"]
+    )
+    if missing:
+        configs = [gfe.str_value for gfe in gfe_type if isinstance(gfe, ConfigModel)]
+        raise ValueError(
+            "Stack {} does not contain the bands {}{}".format(
+                param_stack,
+                missing,
+                ", rebuild it with build_param_stack.py --config {}".format(
+                    " ".join(configs)
+                )
+                if configs
+                else "",
+            )
+        )
+
+
+def build_raster(
+    param_stack,
+    ground_motion_grid,
+    stack_dir,
+    gfe_type,
+    store_susceptibility=False,
+    tile_shape=(512, 512),
+    workers=1,
+    max_in_flight=None,
+):
+    """
+    Calculates the models at every node of the parameter stack, for the ground motions of a GMT grid sampled at
+    the nodes, storing the probabilities (and susceptibilities) as a stack in stack_dir.
+    The nodes are calculated a tile at a time in worker threads, with at most max_in_flight tiles in memory
+    (see gf_grids.evaluate_tiles), so the stack can be larger than memory
+    """
+    metadata, stack = gf_grids.load_stack(param_stack)
+    x, y = gf_grids.stack_coords(metadata)
+    band_index = {band: index for index, band in enumerate(metadata["bands"])}
+    required = get_required_params(gfe_type)
+    missing = [param.name for param in required if param.name not in band_index]
+    if missing:
+        raise ValueError(
+            "Stack {} does not contain the bands {}".format(param_stack, missing)
+        )
+    ground_motion_name = os.path.splitext(os.path.basename(ground_motion_grid))[0]
+    bands = []
+    for gfe, probability_column in get_probability_columns(gfe_type):
+        if store_susceptibility:
+            bands.append(get_susceptibility_column(gfe))
+        bands.append(probability_column.format(ground_motion_name))
+    # netCDF4 is not thread safe
+    grid_lock = threading.Lock()
+
+    def evaluate_tile(rows, cols):
+        lons, lats = np.meshgrid(x[cols], y[rows])
+        with grid_lock:
+            ground_motion = gf_grids.sample_grid(
+                ground_motion_grid, lons.ravel(), lats.ravel()
+            )
+        site_data = pd.DataFrame(
+            {
+                param.name: stack[band_index[param.name], rows, cols]
+                .astype(np.float64)
+                .ravel()
+                for param in required
+            }
+        )
+        shared_terms = get_shared_terms(site_data)
+        values = []
+        for gfe, _ in get_probability_columns(gfe_type):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                site_data[get_susceptibility_column(gfe)] = calculate_susceptibility(
+                    gfe, site_data, shared_terms
+                )
+            if store_susceptibility:
+                values.append(site_data[get_susceptibility_column(gfe)].values)
+            values.append(
+                calculate_coverage(
+                    gfe,
+                    ground_motion[:, np.newaxis],
+                    site_data,
+                    shared_terms=shared_terms,
+                )[:, 0]
+            )
+        return np.stack(values).reshape(len(bands), lons.shape[0], lons.shape[1])
+
+    return gf_grids.write_tiled_stack(
+        stack_dir,
+        bands,
+        x,
+        y,
+        evaluate_tile,
+        tile_shape,
+        workers,
+        max_in_flight,
+        param_stack=os.path.abspath(param_stack),
+        ground_motion_grid=gf_grids.grid_version(ground_motion_grid),
+    )
+
+
+def get_susceptibility_grid(cache_dir, param_stack, gfe):
+    """
+    Finds the cached susceptibility grid of a model, (re)building it from the parameter stack when missing
+    or when its inputs or coefficients have changed. Grids are built under a temporary name and renamed into place,
+    so concurrent runs never see a partial grid
+    """
+    stack_dir = os.path.join(
+        cache_dir, "{}_{}".format(gfe.str_value, get_susceptibility_hash(param_stack, gfe))
+    )
+    if not os.path.exists(os.path.join(stack_dir, gf_grids.STACK_METADATA_FILE)):
+        print("Building {} susceptibility grid in {}".format(gfe.str_value, stack_dir))
+        tmp_dir = "{}.tmp{}".format(stack_dir, os.getpid())
+        build_susceptibility_grid(param_stack, tmp_dir, gfe)
+        try:
+            os.rename(tmp_dir, stack_dir)
+        except OSError:
+            # Another run finished building it first
+            shutil.rmtree(tmp_dir)
+    return stack_dir
+
+
+def sample_susceptibility_cache(cache_dir, param_stack, gfe_type, lons, lats):
+    """Samples the cached susceptibility grid of each model at the given points"""
+    sampled = {}
+    for gfe in gfe_type:
+        stack_dir = get_susceptibility_grid(cache_dir, param_stack, gfe)
+        sampled.update(
+            gf_grids.sample_stack(
+                stack_dir, [get_susceptibility_column(gfe)], lons, lats
+            )
+        )
+    return sampled
+
+
+def get_sampled_params(gfe_type, susceptibility_cache=None, site_term_models=()):
+    """
+    Determines the params to sample, only those needed for coverage when susceptibility comes from the cache.
+    The site terms of site_term_models (the models whose coefficients are sampled) are sampled either way
+    """
+    if susceptibility_cache is not None:
+        return sorted(
+            set(get_coverage_params(gfe_type))
+            | set(get_required_params(site_term_models)),
+            key=lambda x: x.name,
+        )
+    return get_required_params(gfe_type)
+
+
+def get_site_cache_file(
+    site_cache,
+    models_dir,
+    lons,
+    lats,
+    gfe_type,
+    param_stack,
+    susceptibility_cache,
+    site_term_models=(),
+):
+    """
+    Finds the file in site_cache for the sampled site data of this point set.
+    The name is a hash of the points, the sampled columns and the versions of the grids they come from
+    """
+    required_params = get_sampled_params(
+        gfe_type, susceptibility_cache, site_term_models
+    )
+    if param_stack is None:
+        grids = {
+            name: gf_grids.grid_version(path)
+            for name, path in get_models(models_dir, required_params).items()
+        }
+    else:
+        grids = gf_grids.stack_version(param_stack)
+    susceptibility = {}
+    if susceptibility_cache is not None:
+        susceptibility = {
+            gfe.str_value: get_susceptibility_hash(param_stack, gfe) for gfe in gfe_type
+        }
+    key = {
+        "params": [param.name for param in required_params],
+        "grids": grids,
+        "susceptibility": susceptibility,
+    }
+
+    hasher = hashlib.sha1()
+    hasher.update(np.ascontiguousarray(lons, dtype=np.float64).tobytes())
+    hasher.update(np.ascontiguousarray(lats, dtype=np.float64).tobytes())
+    hasher.update(json.dumps(key, sort_keys=True).encode())
+    return os.path.join(site_cache, hasher.hexdigest() + ".npz")
 
+
+def get_site_data(
+    models_dir,
+    lons,
+    lats,
+    gfe_type,
+    param_stack=None,
+    susceptibility_cache=None,
+    site_cache=None,
+    index=None,
+    site_term_models=(),
+):
+    """
+    Samples the site parameters (and cached susceptibility) needed by the models at the given points.
+    The returned DataFrame is in the order of the points and indexed by the row ids in index.
+    With a site_cache the sampled table is stored on disk, and read back instead of sampling when the
+    same points are run against the same grids again.
+    The site terms of site_term_models are sampled even when the susceptibility comes from the cache
+    """
+    cache_file = None
+    if site_cache is not None:
+        cache_file = get_site_cache_file(
+            site_cache,
+            models_dir,
+            lons,
+            lats,
+            gfe_type,
+            param_stack,
+            susceptibility_cache,
+            site_term_models,
+        )
+        if os.path.exists(cache_file):
+            source_data = pd.DataFrame(
+                index=index if index is not None else range(len(lons))
+            )
+            with np.load(cache_file) as cached:
+                for column in cached.files:
+                    source_data[column] = cached[column]
+            return source_data
+
+    source_data = interpolate_input_grid(
+        models_dir,
+        lons,
+        lats,
+        get_sampled_params(gfe_type, susceptibility_cache, site_term_models),
+        param_stack=param_stack,
+        index=index,
+    )
+    if susceptibility_cache is not None:
+        cached_susceptibility = sample_susceptibility_cache(
+            susceptibility_cache, param_stack, gfe_type, lons, lats
+        )
+        for column, values in cached_susceptibility.items():
+            source_data[column] = values
+
+    if cache_file is not None:
+        os.makedirs(site_cache, exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "wb") as cache_fp:
+            np.savez(
+                cache_fp,
+                **{
+                    column: source_data[column].values
+                    for column in source_data.columns
+                }
+            )
+        os.replace(tmp_file, cache_file)
+    return source_data
+
+
+def normalise_columns(columns):
+    """Lower cases the column names, renaming long to lon"""
+    return [x.lower() if x.lower() not in [LON, "long"] else LON for x in list(columns)]
+
+
+def get_realisations(columns):
+    """Finds the pgv, scaled pgv and scaled pga realisation columns"""
     pgv_realisations = list(
         filter(
             lambda x: x if ("pgv_" in x and "pgv_scaled_" not in x) else None,
-            df.columns,
+            columns,
         )
     )
     pgv_scaled_realisations = list(
-        filter(lambda x: x if "pgv_scaled_" in x else None, df.columns)
+        filter(lambda x: x if "pgv_scaled_" in x else None, columns)
     )
     pga_scaled_realisations = list(
-        filter(lambda x: x if "pga_scaled_" in x else None, df.columns)
+        filter(lambda x: x if "pga_scaled_" in x else None, columns)
     )
+    return pgv_realisations, pgv_scaled_realisations, pga_scaled_realisations
 
-    with tempfile.TemporaryDirectory() as tmp_folder:
-        xy_file = os.path.join(tmp_folder, "points.xy")
-        inputs_file = os.path.join(tmp_folder, "values.csv")
 
-        lat_col, lon_col = get_cols(df)
-        df.to_csv(
-            xy_file, columns=[lon_col, lat_col], header=None, index=False, sep=","
-        )
+def get_model_realisations(columns, gfe_type=()):
+    """
+    Finds the realisation columns each model is calculated for, including any config models in gfe_type.
+    Config models use the PGV realisations for pgv and the PGA_scaled realisations (the only PGA columns) for pga
+    """
+    (
+        pgv_realisations,
+        pgv_scaled_realisations,
+        pga_scaled_realisations,
+    ) = get_realisations(columns)
+    realisations = {
+        gfe_types.jessee2017: pgv_realisations,
+        gfe_types.zhu2015: pga_scaled_realisations,
+        gfe_types.zhu2016: pgv_realisations,
+        gfe_types.zhu2016_coastal: pgv_realisations,
+        gfe_types.zhu2017: pgv_scaled_realisations,
+        gfe_types.zhu2017_coastal: pgv_realisations,
+    }
+    ground_motion_realisations = {
+        "pgv": pgv_realisations,
+        "pga": pga_scaled_realisations,
+        None: [],
+    }
+    for gfe in gfe_type:
+        if isinstance(gfe, ConfigModel):
+            realisations[gfe] = ground_motion_realisations[gfe.model.ground_motion]
+    return realisations
 
-        interpolate_input_grid(models_dir, xy_file, inputs_file, gfe_type=gfe_type)
-        source_data = pd.read_csv(inputs_file, delim_whitespace=True)
 
-        trimmed_columns = [LAT, LON]
-        columns = list(df.columns.values)
-        if gfe_types.jessee2017 in gfe_type:
-            source_data[
-                JESSEE_2017_SUSCEPTIBILITY
-            ] = calculations.calculate_jessee2017_susceptibility(
-                source_data[params.SLOPE.name],
-                source_data[params.ROCK.name],
-                source_data[params.CTI.name],
-                source_data[params.LANDCOVER.name],
-            )
-            trimmed_columns.append(JESSEE_2017_SUSCEPTIBILITY)
-            if store_susceptibility:
-                columns.append(JESSEE_2017_SUSCEPTIBILITY)
-
-            for rel in pgv_realisations:
-                header = "jessee2017_probability_{}".format(rel)
-                source_data[header] = calculations.calculate_jessee2017_coverage(
-                    df[rel],
-                    source_data[params.SLOPE.name],
-                    source_data[JESSEE_2017_SUSCEPTIBILITY],
-                )
-                trimmed_columns.append(header)
-                columns.append(header)
-
-        if gfe_types.zhu2015 in gfe_type:
-            source_data[
-                ZHU_2015_SUSCEPIBILITY
-            ] = calculations.calculate_zhu2015_susceptibility(
-                source_data[params.CTI.name], source_data[params.VS30.name]
-            )
-            trimmed_columns.append(ZHU_2015_SUSCEPIBILITY)
-            if store_susceptibility:
-                columns.append(ZHU_2015_SUSCEPIBILITY)
-            for rel in pga_scaled_realisations:
-                header = "zhu2015_coastal_probability_{}".format(rel)
-                source_data[header] = calculations.calculate_zhu2015_coverage(
-                    df[rel], source_data[ZHU_2015_SUSCEPIBILITY]
+def get_input_dtypes(header, gfe_type=None, float32=False):
+    """
+    Reads the lat, lon and realisation columns as floats and every other column as text, so they are written out
+    exactly as they were read. Fixing the types up front also means every chunk of a streamed file is parsed the same way.
+    If gfe_type is given only lat, lon and the realisations those models use are read (as float32 if requested)
+    """
+    columns = normalise_columns(header.columns)
+    lat_col, lon_col = get_cols(pd.DataFrame(columns=columns))
+    numeric_columns = {lat_col, lon_col}
+    for gfe, realisations in get_model_realisations(columns, gfe_type or ()).items():
+        if gfe_type is None or gfe in gfe_type:
+            numeric_columns.update(realisations)
+
+    float_type = np.float32 if float32 else np.float64
+    dtypes = {}
+    for name, column in zip(header.columns, columns):
+        if column in (lat_col, lon_col):
+            dtypes[name] = np.float64
+        elif column in numeric_columns:
+            dtypes[name] = float_type
+        elif gfe_type is None:
+            dtypes[name] = str
+    return dtypes
+
+
+def read_input(input_file, chunksize=None, gfe_type=None, float32=False):
+    """
+    Reads the input file, in chunks of chunksize rows if given. Invalid bytes are decoded to backslash escapes
+    by the C parser. With gfe_type only the columns those models need are parsed (see get_input_dtypes).
+    The pyarrow engine is not used as it rounds some floats differently, and cannot stream in chunks
+    """
+    read_kwargs = dict(encoding="utf8", encoding_errors="backslashreplace")
+    dtypes = get_input_dtypes(
+        pd.read_csv(input_file, nrows=0, **read_kwargs), gfe_type, float32
+    )
+    chunks = pd.read_csv(
+        input_file,
+        usecols=list(dtypes),
+        dtype=dtypes,
+        chunksize=chunksize,
+        **read_kwargs
+    )
+    if chunksize is None:
+        return [chunks]
+    return chunks
+
+
+def calculate_chunk(
+    df,
+    models_dir,
+    gfe_type,
+    store_susceptibility=False,
+    param_stack=None,
+    susceptibility_cache=None,
+    site_cache=None,
+    new_columns_only=False,
+    float32=False,
+    threshold_coverages=(),
+    coverage_table_error=None,
+    coefficient_samplers=None,
+    coefficient_percentiles=coefficient_uncertainty.DEFAULT_PERCENTILES,
+    statistics=None,
+    keep_realisations=False,
+):
+    """
+    Calculates groundfailure for the rows of df, returning them with the susceptibility / probability columns appended.
+    With statistics (a gf_statistics.StatisticsOptions) each model's probability columns are replaced by statistics
+    over its realisations, accumulated in batches of realisations, and the input realisation columns are left out
+    unless keep_realisations is set.
+    For each of threshold_coverages a column of the ground motion at which each model's coverage reaches it is added.
+    For models in coefficient_samplers ({gfe: CoefficientSampler}) the coefficient_percentiles of each probability
+    over the sampled coefficients are added after the probabilities.
+    With new_columns_only only the calculated columns are returned, keyed by the input row id.
+    With float32 the models are calculated in float32 from the sampled site parameters on, and the calculated columns
+    are float32; the input columns are left as they were read. See USGS_models.precision for the error this introduces.
+    With a coverage_table_error the coverage of the models in coverage_tables.TABULATED_MODELS is interpolated from
+    tables (see USGS_models.coverage_tables)
+    """
+    dtype = np.float32 if float32 else np.float64
+    coefficient_samplers = coefficient_samplers or {}
+    df.columns = normalise_columns(df.columns)
+    realisations = get_model_realisations(df.columns, gfe_type)
+
+    lat_col, lon_col = get_cols(df)
+    source_data = get_site_data(
+        models_dir,
+        df[lon_col].values,
+        df[lat_col].values,
+        gfe_type,
+        param_stack=param_stack,
+        susceptibility_cache=susceptibility_cache,
+        site_cache=site_cache,
+        index=df.index,
+        site_term_models=list(coefficient_samplers),
+    ).astype(dtype)
+    # Terms and results shared between the models are only calculated once
+    shared_terms = get_shared_terms(source_data)
+    for gfe in gfe_type:
+        column = get_susceptibility_column(gfe)
+        if column in source_data:
+            continue
+        equivalent = [
+            get_susceptibility_column(other)
+            for other in gfe_type
+            if EQUIVALENT_MODELS.get(other, other) is EQUIVALENT_MODELS.get(gfe, gfe)
+            and get_susceptibility_column(other) in source_data
+        ]
+        if equivalent:
+            source_data[column] = source_data[equivalent[0]]
+        else:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                source_data[column] = calculate_susceptibility(
+                    gfe, source_data, shared_terms
                 )
-                trimmed_columns.append(header)
-                columns.append(header)
-
-        if gfe_types.zhu2016 in gfe_type:
-            source_data[
-                ZHU_2016_SUSCEPTIBILITY
-            ] = calculations.calculate_zhu2016_susceptibility(
-                source_data[params.VS30.name],
-                source_data[params.PRECIPITATION.name],
-                source_data[params.DISTANCE_TO_COAST.name],
-                source_data[params.DISTANCE_TO_RIVERS.name],
-                source_data[params.WATER_TABLE_DEPTH.name],
-            )
-            trimmed_columns.append(ZHU_2016_SUSCEPTIBILITY)
-            if store_susceptibility:
-                columns.append(ZHU_2016_SUSCEPTIBILITY)
 
-            for rel in pgv_realisations:
-                header = "zhu2016_probability_{}".format(rel)
-                source_data[header] = calculations.calculate_zhu2016_coverage(
-                    df[rel], source_data[ZHU_2016_SUSCEPTIBILITY]
+    # Each model's columns are calculated straight into their slice of one column-major block
+    headers = []
+    for gfe, probability_column in get_probability_columns(gfe_type):
+        if store_susceptibility:
+            headers.append(get_susceptibility_column(gfe))
+        headers.extend(
+            THRESHOLD_COLUMN.format(gfe.str_value, coverage)
+            for coverage in threshold_coverages
+        )
+        if statistics is not None:
+            if realisations[gfe]:
+                headers.extend(
+                    probability_column.format(name)
+                    for name in gf_statistics.statistic_names(statistics)
                 )
-                trimmed_columns.append(header)
-                columns.append(header)
-
-        if gfe_types.zhu2016_coastal in gfe_type:
-            header = ZHU_2016_COASTAL_SUSCEPTIBILITY
-            source_data[header] = calculations.calculate_zhu2016_coastal_susceptability(
-                source_data[params.VS30.name],
-                source_data[params.PRECIPITATION.name],
-                source_data[params.DISTANCE_TO_COAST.name],
-                source_data[params.DISTANCE_TO_RIVERS.name],
+            continue
+        headers.extend(probability_column.format(rel) for rel in realisations[gfe])
+        if gfe in coefficient_samplers:
+            headers.extend(
+                PERCENTILE_COLUMN.format(probability_column.format(rel), percentile)
+                for rel in realisations[gfe]
+                for percentile in coefficient_percentiles
             )
-            trimmed_columns.append(header)
-            if store_susceptibility:
-                columns.append(header)
-            for rel in pgv_realisations:
-                header = "zhu2016_coastal_probability_{}".format(rel)
-                source_data[header] = calculations.calculate_zhu2016_coastal_coverage(
-                    df[rel], source_data[ZHU_2016_COASTAL_SUSCEPTIBILITY]
+    block = np.empty((len(df), len(headers)), dtype=dtype, order="F")
+
+    # The log of a set of ground motions is only kept when more than one distinct model uses them
+    coverage_models = {
+        (EQUIVALENT_MODELS.get(gfe, gfe), tuple(realisations[gfe]))
+        for gfe in gfe_type
+        if realisations[gfe]
+    }
+    ground_motion_users = collections.Counter(
+        ground_motions for _, ground_motions in coverage_models
+    )
+    log_ground_motions = {}
+    coverage_slices = {}
+
+    start = 0
+    for gfe, probability_column in get_probability_columns(gfe_type):
+        if store_susceptibility:
+            block[:, start] = source_data[get_susceptibility_column(gfe)].values
+            start += 1
+        for coverage in threshold_coverages:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                calculate_threshold(
+                    gfe, coverage, source_data, block[:, start], shared_terms
                 )
-                trimmed_columns.append(header)
-                columns.append(header)
-
-        if gfe_types.zhu2017 in gfe_type:
-            source_data[
-                ZHU_2017_SUSCEPTIBILITY
-            ] = calculations.calculate_zhu2017_susceptibility(
-                source_data[params.VS30.name],
-                source_data[params.PRECIPITATION.name],
-                source_data[params.DISTANCE_TO_COAST.name],
-                source_data[params.DISTANCE_TO_RIVERS.name],
-                source_data[params.WATER_TABLE_DEPTH.name],
+            start += 1
+        if not realisations[gfe]:
+            continue
+        if statistics is None:
+            stop = start + len(realisations[gfe])
+        else:
+            stop = start + len(gf_statistics.statistic_names(statistics))
+        ground_motions = tuple(realisations[gfe])
+        key = (EQUIVALENT_MODELS.get(gfe, gfe), ground_motions)
+        if key in coverage_slices:
+            block[:, start:stop] = block[:, coverage_slices[key]]
+        elif statistics is not None:
+            calculate_coverage_statistics(
+                gfe,
+                realisations[gfe],
+                df,
+                source_data,
+                statistics,
+                block[:, start:stop],
+                shared_terms,
+                coverage_table_error,
             )
-            trimmed_columns.append(ZHU_2017_SUSCEPTIBILITY)
-            if store_susceptibility:
-                columns.append(ZHU_2017_SUSCEPTIBILITY)
-            for rel in pgv_scaled_realisations:
-                header = "zhu2017_probability_{}".format(rel)
-                source_data[header] = calculations.calculate_zhu2017_coverage(
-                    df[rel], source_data[ZHU_2017_SUSCEPTIBILITY]
-                )
-                trimmed_columns.append(header)
-                columns.append(header)
-
-        if gfe_types.zhu2017_coastal in gfe_type:
-            header = ZHU_2017_COASTAL_SUSCEPTIBILITY
-            source_data[header] = calculations.calculate_zhu2017_coastal_susceptibility(
-                source_data[params.VS30.name],
-                source_data[params.PRECIPITATION.name],
-                source_data[params.DISTANCE_TO_COAST.name],
-                source_data[params.DISTANCE_TO_RIVERS.name],
+            coverage_slices[key] = slice(start, stop)
+        else:
+            ground_motion = df[realisations[gfe]].to_numpy(dtype=dtype)
+            if (
+                ground_motion_users[ground_motions] > 1
+                and ground_motions not in log_ground_motions
+            ):
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    log_ground_motions[ground_motions] = np.log(ground_motion)
+            calculate_coverage(
+                gfe,
+                ground_motion,
+                source_data,
+                block[:, start:stop],
+                log_ground_motions.get(ground_motions),
+                shared_terms,
+                coverage_table_error,
             )
-            trimmed_columns.append(header)
-            if store_susceptibility:
-                columns.append(header)
-            for rel in pgv_realisations:
-                header = "zhu2017_coastal_probability_{}".format(rel)
-                source_data[header] = calculations.calculate_zhu2017_coastal_coverage(
-                    df[rel], source_data[ZHU_2017_COASTAL_SUSCEPTIBILITY]
-                )
-                trimmed_columns.append(header)
-                columns.append(header)
+            coverage_slices[key] = slice(start, stop)
+        start = stop
+        if gfe in coefficient_samplers:
+            # (points, realisations, percentiles), in the order of the headers
+            percentiles = coefficient_samplers[gfe].calculate_percentiles(
+                df[realisations[gfe]].to_numpy(dtype=np.float64),
+                get_site_terms(gfe, source_data),
+                coefficient_percentiles,
+            ).reshape(len(df), -1)
+            block[:, start : start + percentiles.shape[1]] = percentiles
+            start += percentiles.shape[1]
+
+    # source_data shares the input's row ids, so results line up with their input rows without a join
+    results = pd.DataFrame(block, columns=headers, index=df.index, copy=False)
+    if new_columns_only:
+        results.insert(0, ROW_ID, df.index.values)
+        return results
+
+    if statistics is not None and not keep_realisations:
+        df = df.drop(columns=list(itertools.chain(*get_realisations(df.columns))))
+    # The input columns are written out as they were read, only the calculated columns are float32 with float32
+    return pd.concat([df, results], axis=1)
 
-        #round the latitudes / longitudes to remove float error in the merge
-        df[lat_col] = df[lat_col].round(9)
-        df[lon_col] = df[lon_col].round(9)
-        source_data[LAT] = source_data[LAT].round(9)
-        source_data[LON] = source_data[LON].round(9)
 
-        source_data_trimmed = source_data[trimmed_columns]
-        df = df.merge(
-            source_data_trimmed, left_on=[lat_col, lon_col], right_on=[LAT, LON], how='left'
+def calculate_gf(
+    input_file,
+    output_file,
+    models_dir,
+    gfe_type,
+    store_susceptibility=False,
+    param_stack=None,
+    susceptibility_cache=None,
+    site_cache=None,
+    chunksize=None,
+    workers=1,
+    output_format=gf_output.CSV,
+    compress=False,
+    new_columns_only=False,
+    float32=False,
+    threshold_coverages=(),
+    coverage_table_error=None,
+    coefficient_samplers=None,
+    coefficient_percentiles=coefficient_uncertainty.DEFAULT_PERCENTILES,
+    statistics=None,
+    keep_realisations=False,
+):
+    """
+    Calculates groundfailure at specified locations and stores it in output_file.
+    With a chunksize the input is streamed through in chunks of that many rows, keeping memory use bounded;
+    the output is identical to processing the whole file at once.
+    With more than one worker the chunks (or, without a chunksize, equal parts of the input) are calculated
+    in that many processes and written in input order.
+    The output is written in output_format (see gf_output), optionally compressed
+    """
+    chunk_kwargs = dict(
+        models_dir=models_dir,
+        gfe_type=gfe_type,
+        store_susceptibility=store_susceptibility,
+        param_stack=param_stack,
+        susceptibility_cache=susceptibility_cache,
+        site_cache=site_cache,
+        new_columns_only=new_columns_only,
+        float32=float32,
+        threshold_coverages=threshold_coverages,
+        coverage_table_error=coverage_table_error,
+        coefficient_samplers=coefficient_samplers,
+        coefficient_percentiles=coefficient_percentiles,
+        statistics=statistics,
+        keep_realisations=keep_realisations,
+    )
+    if workers > 1:
+        process_chunk = functools.partial(
+            calculate_output_chunk, output_format=output_format, **chunk_kwargs
         )
-    #df.drop_duplicates(subset=[LAT, LON], inplace=True)
-    df.to_csv(output_file, columns=columns, index=False, sep=",")
+    else:
+        process_chunk = functools.partial(calculate_chunk, **chunk_kwargs)
+    if susceptibility_cache is not None:
+        # Built up front so the workers do not all try to build them at once
+        for gfe in gfe_type:
+            get_susceptibility_grid(susceptibility_cache, param_stack, gfe)
+
+    # Columns that are not written out do not need to be read
+    chunks = read_input(
+        input_file,
+        chunksize,
+        gfe_type if new_columns_only else None,
+        float32 and new_columns_only,
+    )
+    if chunksize is None and workers > 1:
+        chunks = [
+            chunks[0].iloc[rows]
+            for rows in np.array_split(np.arange(len(chunks[0])), workers)
+        ]
+
+    with contextlib.ExitStack() as stack:
+        if workers > 1:
+            pool = stack.enter_context(multiprocessing.Pool(workers))
+            results = imap_bounded(pool, process_chunk, chunks, 2 * workers)
+        else:
+            results = map(process_chunk, chunks)
+
+        with gf_output.ChunkWriter(output_file, output_format, compress) as writer:
+            for chunk in results:
+                writer.write(chunk)
+
+
+def calculate_output_chunk(df, output_format, **kwargs):
+    """Calculates a chunk and prepares it for writing, so CSV formatting is spread across the worker processes too"""
+    return gf_output.format_chunk(calculate_chunk(df, **kwargs), output_format)
+
+
+def imap_bounded(pool, func, iterable, max_in_flight):
+    """
+    Like pool.imap, yielding results in input order, but only takes max_in_flight items from iterable at a time.
+    pool.imap reads the whole iterable up front, which would load every chunk of a streamed file at once
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
 
 
 def main():
@@ -321,9 +1254,11 @@ def main():
     parser.add_argument(
         "--gfe_type",
         "-g",
-        choices=[x.str_value for x in gfe_types],
         required=True,
         nargs="+",
+        help="Models to calculate: any of {}, or the name of a model config in --config_dir".format(
+            ", ".join(x.str_value for x in gfe_types)
+        ),
     )
     parser.add_argument(
         "--susceptibility",
@@ -337,14 +1272,233 @@ def main():
         help="Folder containing the models",
         default="/nesi/project/nesi00213/groundfailure/models",
     )
+    parser.add_argument(
+        "--config_dir",
+        help="Folder of USGS groundfailure model configs (*.ini) that can be requested with --gfe_type",
+        default=DEFAULT_CONFIG_DIR,
+    )
+    parser.add_argument(
+        "--param_stack",
+        "-p",
+        help="Folder containing a parameter stack built by build_param_stack.py. "
+        "Sampled instead of the grids in models_dir. Config models need their layers in the stack, see its --config",
+    )
+    parser.add_argument(
+        "--susceptibility_cache",
+        "-c",
+        help="Folder of cached susceptibility grids, built from the parameter stack when missing or out of date. "
+        "Susceptibility is sampled from these grids instead of being calculated at every point. Requires --param_stack",
+    )
+    parser.add_argument(
+        "--site_cache",
+        help="Folder to cache the sampled site parameters in. "
+        "Repeat runs over the same points and grids read them back instead of sampling",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        help="Number of rows to process at a time. Streams the input through in bounded memory; "
+        "best used with --param_stack so each chunk does not have to reread the grids",
+    )
+    parser.add_argument(
+        "--workers",
+        "-n",
+        type=int,
+        default=1,
+        help="Number of processes to calculate with. "
+        "Use with --param_stack so the processes share one memory-mapped copy of the parameters",
+    )
+    parser.add_argument(
+        "--output_format",
+        "-f",
+        choices=gf_output.OUTPUT_FORMATS,
+        default=gf_output.CSV,
+        help="Format of the output file",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Compress the output (gzip for csv, zstd for parquet, gzip datasets for hdf5)",
+    )
+    parser.add_argument(
+        "--new_columns_only",
+        action="store_true",
+        help="Only write the susceptibility / probability columns, keyed by the input row id",
+    )
+    parser.add_argument(
+        "--float32",
+        action="store_true",
+        help="Calculate in float32, writing the calculated columns as float32 (the input columns are written as read). "
+        "About half the memory traffic, with the errors bounded in USGS_models/precision.py",
+    )
+    parser.add_argument(
+        "--threshold_coverage",
+        type=float,
+        nargs="+",
+        default=[],
+        help="Coverages to add the threshold ground motion columns of, the ground motion (as used by each model) "
+        "at which the model's coverage reaches that coverage. NaN where the model never reaches it",
+    )
+    parser.add_argument(
+        "--coverage_table_error",
+        type=float,
+        help="Interpolate coverage from a table of the model's coverage equation, accurate to this (positive) "
+        "absolute error. Only jessee2017 is tabulated, as the zhu models' equations are faster than a table "
+        "(see python -m USGS_models.coverage_tables)",
+    )
+    parser.add_argument(
+        "--coefficient_distributions",
+        help="JSON file of coefficient distributions to sample, "
+        'e.g. {"zhu2016": {"log_pgv": ["normal", 0.05]}}. Adds percentiles over the samples of each probability of '
+        "those models (zhu2016, jessee2017). See USGS_models/coefficient_uncertainty.py for the coefficient names",
+    )
+    parser.add_argument(
+        "--coefficient_samples",
+        type=int,
+        default=1000,
+        help="Number of coefficient samples to draw",
+    )
+    parser.add_argument(
+        "--coefficient_percentiles",
+        type=float,
+        nargs="+",
+        default=list(coefficient_uncertainty.DEFAULT_PERCENTILES),
+        help="Percentiles of the probabilities over the coefficient samples to write",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the coefficient samples, the same seed gives the same output",
+    )
+    parser.add_argument(
+        "--statistics",
+        action="store_true",
+        help="Write statistics of each model's probability over its realisations (mean, std, percentiles and "
+        "exceedance probabilities) instead of every realisation's probability. "
+        "The input realisation columns are left out too, unless --keep_realisations is given",
+    )
+    parser.add_argument(
+        "--keep_realisations",
+        action="store_true",
+        help="With --statistics, still write the input realisation columns (other than with --new_columns_only)",
+    )
+    parser.add_argument(
+        "--statistic_percentiles",
+        type=float,
+        nargs="+",
+        default=list(gf_statistics.DEFAULT_PERCENTILES),
+        help="Percentiles over the realisations to write with --statistics",
+    )
+    parser.add_argument(
+        "--exceedance",
+        type=float,
+        nargs="+",
+        default=[],
+        help="Probabilities x to write P(probability > x) over the realisations of with --statistics",
+    )
+    parser.add_argument(
+        "--histogram_bins",
+        type=int,
+        default=gf_statistics.DEFAULT_BINS,
+        help="Number of log spaced bins between {:g} and 1 the percentiles are estimated from. "
+        "Their relative error is at most 10 ** (6 / bins)".format(
+            gf_statistics.DEFAULT_MIN_VALUE
+        ),
+    )
+    parser.add_argument(
+        "--realisation_batch_size",
+        type=int,
+        default=gf_statistics.DEFAULT_BATCH_SIZE,
+        help="Number of realisations to calculate at a time with --statistics",
+    )
     args = parser.parse_args()
+    if args.susceptibility_cache is not None and args.param_stack is None:
+        parser.error("--susceptibility_cache requires --param_stack")
+    try:
+        gfe_type = [get_gfe_type(x, args.config_dir) for x in args.gfe_type]
+    except ValueError as e:
+        parser.error(str(e))
+    if args.param_stack is not None:
+        try:
+            check_param_stack(args.param_stack, gfe_type)
+        except ValueError as e:
+            parser.error(str(e))
+    for option in ("threshold_coverage", "coverage_table_error"):
+        if getattr(args, option) and any(
+            isinstance(gfe, ConfigModel) for gfe in gfe_type
+        ):
+            parser.error(
+                "--{} is only available for {}".format(
+                    option, ", ".join(x.str_value for x in gfe_types)
+                )
+            )
+    if args.coverage_table_error is not None:
+        if not args.coverage_table_error > 0:
+            parser.error("--coverage_table_error must be positive")
+        # Building the tables here reports an unreachable error before any work is done
+        try:
+            for gfe in gfe_type:
+                if gfe.str_value in coverage_tables.TABULATED_MODELS:
+                    coverage_tables.get_table(
+                        gfe.str_value, args.coverage_table_error
+                    )
+        except ValueError as e:
+            parser.error("--coverage_table_error: {}".format(e))
+
+    coefficient_samplers = {}
+    if args.coefficient_distributions is not None:
+        with open(args.coefficient_distributions) as distributions_fp:
+            distributions = json.load(distributions_fp)
+        try:
+            for name, model_distributions in distributions.items():
+                gfe = get_gfe_type(name, args.config_dir)
+                if gfe not in gfe_type:
+                    raise ValueError(
+                        "{} has coefficient distributions but is not a requested --gfe_type".format(
+                            name
+                        )
+                    )
+                coefficient_samplers[gfe] = coefficient_uncertainty.CoefficientSampler(
+                    name, model_distributions, args.coefficient_samples, args.seed
+                )
+        except ValueError as e:
+            parser.error(str(e))
+    if args.statistics and coefficient_samplers:
+        parser.error("--statistics can not be combined with --coefficient_distributions")
+    if args.keep_realisations and not args.statistics:
+        parser.error("--keep_realisations only applies with --statistics")
+    statistics = None
+    if args.statistics:
+        statistics = gf_statistics.StatisticsOptions(
+            tuple(args.statistic_percentiles),
+            tuple(args.exceedance),
+            args.histogram_bins,
+            gf_statistics.DEFAULT_MIN_VALUE,
+            args.realisation_batch_size,
+        )
 
     calculate_gf(
         args.input_file,
         args.output_file,
         args.models_dir,
-        [gfe_types[x] for x in args.gfe_type],
+        gfe_type,
         args.susceptibility,
+        args.param_stack,
+        args.susceptibility_cache,
+        args.site_cache,
+        args.chunksize,
+        args.workers,
+        args.output_format,
+        args.compress,
+        args.new_columns_only,
+        args.float32,
+        args.threshold_coverage,
+        args.coverage_table_error,
+        coefficient_samplers,
+        args.coefficient_percentiles,
+        statistics,
+        args.keep_realisations,
     )
 
 
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+Calculates Ground Failure probability at every node of a parameter stack (see build_param_stack.py),
+for a ground motion grid (e.g. PGV) sampled at the nodes, and stores the result as a stack.
+The nodes are calculated a tile at a time and written out as each tile finishes, so rasters larger than memory
+can be calculated.
+"""
+
+import argparse
+
+from calculate_gf import (
+    DEFAULT_CONFIG_DIR,
+    build_raster,
+    check_param_stack,
+    get_gfe_type,
+    gfe_types,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "param_stack", help="Folder containing a parameter stack built by build_param_stack.py"
+    )
+    parser.add_argument(
+        "ground_motion_grid",
+        help="GMT grid of the ground motion the models use (PGV, or scaled PGA for zhu2015)",
+    )
+    parser.add_argument("output_dir", help="Folder to write the result stack to")
+    parser.add_argument(
+        "--gfe_type",
+        "-g",
+        required=True,
+        nargs="+",
+        help="Models to calculate: any of {}, or the name of a model config in --config_dir "
+        "whose layers were added to the stack with build_param_stack.py --config".format(
+            ", ".join(x.str_value for x in gfe_types)
+        ),
+    )
+    parser.add_argument(
+        "--config_dir",
+        help="Folder of USGS groundfailure model configs (*.ini) that can be requested with --gfe_type",
+        default=DEFAULT_CONFIG_DIR,
+    )
+    parser.add_argument(
+        "--susceptibility",
+        "-s",
+        help="Flag indicating to store susceptibility",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--tile_size",
+        type=int,
+        nargs=2,
+        default=[512, 512],
+        metavar=("ROWS", "COLS"),
+        help="Number of grid rows and columns calculated at a time",
+    )
+    parser.add_argument(
+        "--workers",
+        "-n",
+        type=int,
+        default=1,
+        help="Number of threads to calculate tiles with",
+    )
+    parser.add_argument(
+        "--max_in_flight",
+        type=int,
+        help="Most tiles held in memory at once, being calculated or waiting to be written. Defaults to 2 * workers",
+    )
+    args = parser.parse_args()
+    try:
+        gfe_type = [get_gfe_type(x, args.config_dir) for x in args.gfe_type]
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        check_param_stack(args.param_stack, gfe_type)
+    except ValueError as e:
+        parser.error(str(e))
+
+    build_raster(
+        args.param_stack,
+        args.ground_motion_grid,
+        args.output_dir,
+        gfe_type,
+        args.susceptibility,
+        tuple(args.tile_size),
+        args.workers,
+        args.max_in_flight,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,10 @@ a format that can be plotted from plot_stations.py
 
 Usage gen_gf_surface.py "file.h5"
 
-writes "file.xyz" containing the data to be plotted
+writes "file.xyz" containing the data to be plotted, with --format binary the same points in a binary file
+("file.xyzb", see gf_xyz), or with --format netcdf / geotiff a raster ("file.nc" / "file.tif")
+of float32 cells that keeps the grid structure. Cells the xyz file would leave out are NaN in a raster, and its header
+lines (title, label, CPT spec, range, model label) are stored as attributes
 
 @date 5 Jul 2017
 @author Jason Motha
@@ -15,108 +18,278 @@ writes "file.xyz" containing the data to be plotted
 import sys
 import os
 import h5py
-import math
 import argparse
+import multiprocessing
+import shlex
+import time
+import numpy as np
 
-## Parse Arguements
+import gf_xyz
 
-parser = argparse.ArgumentParser(description='Convert a USGS H5 file to xyz for plotting with "plot_stations.py"')
+# Cells read and formatted at a time (in whole rows), bounding the memory of the values and their text
+# (about 40 bytes a cell)
+BLOCK_CELLS = 1000000
 
-parser.add_argument('filename', help='Filename of h5 file to convert')
-parser.add_argument('-type', '--gftype', default='liq', choices=['liq', 'ls'], type=str)
-parser.add_argument('-m', '--model',  default=2, choices=[1,2], type=int,
-                    help='Selects which model has been used: 1- coastal 2- general (default) (determines text on figures)')
-parser.add_argument('-l', '--limit', default=float('-inf'), type=float,
-                    help='Specifies a threshold value - useful for removing unnecessary fill removes values below this point')
-parser.add_argument('-s', '--susceptibility', default=False, action="store_true", help='Changes the plot labels to indicate susceptibility ')
-parser.add_argument('-t', '--title', help='Title for the top of the graph. Defaults to a trimmed run_name')
-parser.add_argument('-o', '--output', default=None, help='sets the name of the output file') 
-parser.add_argument('--keep-nans', action='store_true', help="Keeps the NaN values in the output file")
 
-args = parser.parse_args()
+class XyzWriter(object):
+    """Writes the header lines then a "lat lon value" line per kept cell"""
+
+    def __init__(self, fout_name, header, lat, lon):
+        self.fout = open(fout_name, 'wb')
+        self.fout.write(('\n'.join(header) + '\n').encode('ascii'))
+        # Every cell of a column / row has the same lat / lon, so they are formatted once
+        self.lat_fields = gf_xyz.format_fields(gf_xyz.format_coordinates(lat))
+        self.lon_fields = gf_xyz.format_fields(gf_xyz.format_coordinates(lon[::-1]))
+
+    def write(self, start, block, keep):
+        """Writes the kept cells of a block of rows of values, starting at row start"""
+        rows, columns = np.nonzero(keep)
+        # Boolean indexing takes the cells in the same (row major) order as nonzero, but is faster
+        self.fout.write(gf_xyz.format_lines(self.lat_fields[columns], self.lon_fields[start + rows], block[keep]))
+
+    def close(self):
+        self.fout.close()
+
 
-fname = args.filename
-threshold = args.limit
-susceptibility = args.susceptibility
-model = args.model
-plot_title = args.title
-fout_name = args.output
-keep_nans = args.keep_nans
+class BinaryXyzWriter(object):
+    """Writes the same cells as XyzWriter to a binary xyz file (see gf_xyz), leaving out NaN values if elide_nans"""
 
-is_liq = is_ls = False
-if args.gftype == "liq":
-    is_liq = True
-elif args.gftype == "ls":
-    is_ls = True
-else:
-    exit("-type unset")
+    def __init__(self, fout_name, header, lat, lon, elide_nans=False):
+        self.writer = gf_xyz.BinaryXyzWriter(fout_name, header, elide_nans)
+        self.lat = gf_xyz.to_micro(lat)
+        self.lon = gf_xyz.to_micro(lon[::-1])
 
-## Read H5 file to be converted
+    def write(self, start, block, keep):
+        """Writes the kept cells of a block of rows of values, starting at row start"""
+        rows, columns = np.nonzero(keep)
+        self.writer.write_micro(self.lat[columns], self.lon[start + rows], block[keep])
 
-f = h5py.File(fname, 'r')
+    def close(self):
+        self.writer.close()
 
-lat = list(f['x'])
-lon = list(f['y'])
-values = list(f['model'])
 
+class NetcdfWriter(object):
+    """Writes a COARDS NetCDF grid (readable by GMT) of z(y, x) with y ascending, the header lines as attributes"""
 
-basename = fname.split('.')[0]
+    def __init__(self, fout_name, header, lat, lon):
+        from netCDF4 import Dataset
 
-## Write output file
+        self.ds = Dataset(fout_name, 'w')
+        self.ds.createDimension('x', len(lat))
+        self.ds.createDimension('y', len(lon))
+        self.ds.createVariable('x', 'f8', ('x',))[:] = lat
+        self.ds.createVariable('y', 'f8', ('y',))[:] = lon
+        self.z = self.ds.createVariable('z', 'f4', ('y', 'x'), fill_value=np.float32(np.nan))
+        self.ds.setncatts(dict(zip(gf_xyz.HEADER_NAMES, header)))
+        self.ds.header = '\n'.join(header)
 
-if fout_name is None:
-    fout_name = basename + '.xyz'
-with open(fout_name, 'w') as fout:
+    def write(self, start, block, keep):
+        """Writes a block of rows of values starting at row start, which runs from the last y down"""
+        ny = self.z.shape[0]
+        self.z[ny - start - len(block):ny - start] = np.where(keep, block, np.nan)[::-1].astype(np.float32)
 
-    if plot_title is not None:
-        plot_title += '\n'
+    def close(self):
+        self.ds.close()
+
+
+class GeotiffWriter(object):
+    """Writes a float32 GeoTIFF (with rasterio) north up, the header lines as tags. lat / lon must be evenly spaced"""
+
+    def __init__(self, fout_name, header, lat, lon):
+        import rasterio
+        from rasterio.transform import from_origin
+
+        dx = float(lat[-1] - lat[0]) / max(len(lat) - 1, 1)
+        dy = float(lon[-1] - lon[0]) / max(len(lon) - 1, 1)
+        # From the corner of the first cell, which is at the last lon
+        self.ds = rasterio.open(fout_name, 'w', driver='GTiff', width=len(lat), height=len(lon), count=1,
+                                dtype='float32', crs='EPSG:4326', nodata=float('nan'),
+                                transform=from_origin(float(lat[0]) - dx / 2, float(lon[-1]) + dy / 2, dx, dy),
+                                compress='deflate', tiled=True)
+        self.ds.update_tags(header='\n'.join(header), **dict(zip(gf_xyz.HEADER_NAMES, header)))
+
+    def write(self, start, block, keep):
+        """Writes a block of rows of values starting at row start"""
+        from rasterio.windows import Window
+
+        self.ds.write(np.where(keep, block, np.nan).astype(np.float32), 1,
+                      window=Window(0, start, block.shape[1], len(block)))
+
+    def close(self):
+        self.ds.close()
+
+
+WRITERS = {'xyz': (XyzWriter, '.xyz'), 'binary': (BinaryXyzWriter, gf_xyz.BINARY_EXTENSION), 'netcdf': (NetcdfWriter, '.nc'), 'geotiff': (GeotiffWriter, '.tif')}
+
+
+def convert(fname, fout_name=None, gftype='liq', model=2, threshold=float('-inf'), susceptibility=False,
+            plot_title=None, keep_nans=False, output_format='xyz', elide_nans=False):
+    """Converts a h5 file, returning the name of the output file (see the command line options)"""
+    is_liq = is_ls = False
+    if gftype == "liq":
+        is_liq = True
+    elif gftype == "ls":
+        is_ls = True
     else:
-        plot_title = basename[0:20] + '\n'
-    fout.write(plot_title)
+        exit("-type unset")
+
+    basename = fname.split('.')[0]
+
+    writer_class, extension = WRITERS[output_format]
+    if fout_name is None:
+        fout_name = basename + extension
+
+    if plot_title is None:
+        plot_title = basename[0:20]
 
     if is_liq:
-        fout.write('Liquefaction ')
-        if susceptibility:
-            fout.write("Susceptibility \n<REPO>/liquefaction_susceptibility_nolabel.cpt:topo-grey1,fixed,categorical,t-30 1k:g-nearneighbor,landmask\n\n")            
+        label = 'Liquefaction '
     else:
-        fout.write('Landslide ')
-        if susceptibility:
-            fout.write("Susceptbility \n<REPO>/landslide_susceptibility_nolabel.cpt:topo-grey1,t-30,fixed,categorical 1k:g-nearneighbor,landmask\n-10 0 0.25 2\n")
-    if not susceptibility:
-        fout.write("Probability \n<REPO>/hot-orange:topo-grey1,invert,t-30 1k:g-nearneighbor,landmask\n")
+        label = 'Landslide '
+    if susceptibility and is_liq:
+        label += "Susceptibility "
+        cpt = "<REPO>/liquefaction_susceptibility_nolabel.cpt:topo-grey1,fixed,categorical,t-30 1k:g-nearneighbor,landmask"
+        value_range = ""
+    elif susceptibility:
+        label += "Susceptbility "
+        cpt = "<REPO>/landslide_susceptibility_nolabel.cpt:topo-grey1,t-30,fixed,categorical 1k:g-nearneighbor,landmask"
+        value_range = "-10 0 0.25 2"
+    else:
+        label += "Probability "
+        cpt = "<REPO>/hot-orange:topo-grey1,invert,t-30 1k:g-nearneighbor,landmask"
         if is_liq:
-            fout.write("0 0.5 0.05 0.1\n")
+            value_range = "0 0.5 0.05 0.1"
         else:
-            fout.write("0 0.25 0.02 0.05\n")
-
-    fout.write("1 white\n")
+            value_range = "0 0.25 0.02 0.05"
 
     if model == 1 and is_liq:
-        fout.write("Coastal Model\n")
+        model_label = "Coastal Model"
     elif is_liq:
-        fout.write("General Model\n")
+        model_label = "General Model"
     else:
-        fout.write("\n")
+        model_label = ""
 
-    len_lon = len(lon)
-    vmax = -float('inf')
-    vmin = float('inf')
+    header = [plot_title, label, cpt, value_range, "1 white", model_label]
 
     if threshold > float('-inf'):
         print "Filtering values below %f" % threshold
-        
-
-    for i in xrange(len_lon):
-        for j in xrange(len(lat)):
-            val = values[i][j]
-            if keep_nans or (not math.isnan(val) and not math.isinf(val)):
-                if val > threshold or keep_nans:
-                    if not is_ls or not susceptibility or val < 0 or keep_nans:
-                        fout.write("%f %f %f\n" % (lat[j], lon[len_lon - i - 1], val))
-                        vmax = max(vmax, val)
-                        vmin = min(vmin, val)
+
+    with h5py.File(fname, 'r') as f:
+        lat = f['x'][...]
+        lon = f['y'][...]
+        values = f['model']
+
+        if elide_nans:
+            writer = writer_class(fout_name, header, lat, lon, elide_nans=True)
+        else:
+            writer = writer_class(fout_name, header, lat, lon)
+        vmax = -float('inf')
+        vmin = float('inf')
+        # Cells are written row by row of values, with the rows in reverse order of lon.
+        # The values are read a block of rows at a time, so memory is bounded and output starts straight away
+        block_rows = max(1, BLOCK_CELLS // max(1, values.shape[1]))
+        for start in xrange(0, values.shape[0], block_rows):
+            block = values[start:start + block_rows]
+            if keep_nans:
+                keep = np.ones(block.shape, dtype=bool)
+            else:
+                keep = np.isfinite(block) & (block > threshold)
+                if is_ls and susceptibility:
+                    keep &= block < 0
+            writer.write(start, block, keep)
+
+            kept = block[keep]
+            kept = kept[~np.isnan(kept)]
+            if kept.size:
+                vmax = max(vmax, kept.max())
+                vmin = min(vmin, kept.min())
+        writer.close()
 
     print "max value: %f \t min value: %f" % (vmax, vmin)
+    return fout_name
+
+
+def convert_args(args):
+    """Converts a h5 file with parsed command line arguments"""
+    if args.elide_nans and args.format != 'binary':
+        parser.error('--elide-nans is only available with --format binary')
+    return convert(args.filename, args.output, args.gftype, args.model, args.limit, args.susceptibility, args.title,
+                   args.keep_nans, args.format, args.elide_nans)
 
 
-                        
+def run_job(job):
+    """
+    Converts a batch job, a line of command line arguments. Returns the output file, the time taken in seconds and
+    the error (None if it succeeded)
+    """
+    start = time.time()
+    try:
+        args = parser.parse_args(shlex.split(job))
+        if args.batch is not None:
+            raise ValueError('Batch jobs cannot run batches')
+        return convert_args(args), time.time() - start, None
+    except (Exception, SystemExit) as e:
+        return None, time.time() - start, repr(e)
+
+
+def run_batch(jobs, workers=None):
+    """
+    Converts batch jobs with a pool of worker processes (a process per CPU by default), so Python and h5py are only
+    imported once. Prints each job's timing as it finishes, returning the number of failed jobs
+    """
+    start = time.time()
+    pool = multiprocessing.Pool(workers)
+    failed = 0
+    try:
+        for i, (job, (fout_name, seconds, error)) in enumerate(zip(jobs, pool.imap(run_job, jobs))):
+            if error is None:
+                print "job %d/%d: %s took %.2fs" % (i + 1, len(jobs), fout_name, seconds)
+            else:
+                failed += 1
+                print "job %d/%d failed after %.2fs: %s (%s)" % (i + 1, len(jobs), seconds, job, error)
+            sys.stdout.flush()
+    finally:
+        pool.close()
+        pool.join()
+    print "%d jobs (%d failed) took %.2fs" % (len(jobs), failed, time.time() - start)
+    return failed
+
+
+def read_jobs(batch_file):
+    """The jobs of a batch file, one line of command line arguments each; blank lines and # comments are skipped"""
+    return [line.strip() for line in batch_file if line.strip() and not line.strip().startswith('#')]
+
+
+## Parse Arguements
+
+parser = argparse.ArgumentParser(description='Convert a USGS H5 file to xyz for plotting with "plot_stations.py"')
+
+parser.add_argument('filename', nargs='?', help='Filename of h5 file to convert')
+parser.add_argument('-type', '--gftype', default='liq', choices=['liq', 'ls'], type=str)
+parser.add_argument('-m', '--model',  default=2, choices=[1,2], type=int,
+                    help='Selects which model has been used: 1- coastal 2- general (default) (determines text on figures)')
+parser.add_argument('-l', '--limit', default=float('-inf'), type=float,
+                    help='Specifies a threshold value - useful for removing unnecessary fill removes values below this point')
+parser.add_argument('-s', '--susceptibility', default=False, action="store_true", help='Changes the plot labels to indicate susceptibility ')
+parser.add_argument('-t', '--title', help='Title for the top of the graph. Defaults to a trimmed run_name')
+parser.add_argument('-o', '--output', default=None, help='sets the name of the output file') 
+parser.add_argument('--keep-nans', action='store_true', help="Keeps the NaN values in the output file")
+parser.add_argument('--elide-nans', '--elide_nans', action='store_true',
+                    help="Leaves the NaN values out of a --format binary file, so with --keep-nans every cell but the NaN ones is written")
+parser.add_argument('-f', '--format', default='xyz', choices=sorted(WRITERS),
+                    help='Output format, binary is a compact memory-mappable xyz file (see gf_xyz), netcdf (requires netCDF4) and geotiff (requires rasterio) are rasters of the grid')
+parser.add_argument('--batch', type=argparse.FileType('r'),
+                    help='Converts every job in this file (- for stdin) instead of filename, each a line of the '
+                         'arguments above, with a pool of worker processes')
+parser.add_argument('-n', '--workers', type=int, default=None,
+                    help='Number of worker processes for --batch (default: the number of CPUs)')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.batch is not None:
+        if run_batch(read_jobs(args.batch), args.workers):
+            sys.exit(1)
+    elif args.filename is None:
+        parser.error('filename or --batch is required')
+    else:
+        convert_args(args)
@@ -9,6 +9,8 @@ import glob
 import os
 import argparse
 from contextlib import contextmanager
+import pipes
+import shutil
 import subprocess
 
 plot_stations_path = 'plot_stations.py'
@@ -18,6 +20,8 @@ sim_workflow_dir = "/home/nesi00213/groundfailure" #only used if files cannot be
 model_list = ('general', 'coastal')
 map_type_list = ('probability', 'susceptibility')
 vs30_model_list = ('nz-specific-vs30', 'topo-based-vs30')
+# Where gfail writes its h5 files under the output path
+h5_patterns = ('*.hdf5', '*/*.hdf5')
 
 
 @contextmanager
@@ -95,6 +99,38 @@ def find_h5(path):
 	h5file = h5file[0]
 	return h5file
 	
+def h5_times(path):
+    """The modification times of the h5 files under path, to find those a gfail run writes"""
+    return dict((h5file, os.path.getmtime(h5file)) for pattern in h5_patterns for h5file in glob.glob(os.path.join(path, pattern)))
+
+
+def keep_new_h5(path, before, keep_path):
+    """
+    Copies the h5 file a gfail run wrote under path to keep_path, so later runs cannot overwrite it before it is
+    converted. before is h5_times(path) from before the run; the newest file added or modified since is taken
+    """
+    new_h5 = [h5file for h5file, mtime in h5_times(path).items() if before.get(h5file) != mtime]
+    if not check_file_exists(new_h5, 'new h5 file'):
+        exit(1)
+    h5file = max(new_h5, key=os.path.getmtime)
+    shutil.copy2(h5file, keep_path)
+    print "%s kept as %s" % (h5file, keep_path)
+    return keep_path
+
+
+def convert_h5(gen_gf_surface_location, jobs):
+    """
+    Converts h5 files with a single gen_gf_surface.py --batch call, so Python and h5py are only started once.
+    Each job is a list of gen_gf_surface.py arguments. Exits if any conversion failed
+    """
+    batch = ''.join(' '.join(pipes.quote(arg) for arg in job) + '\n' for job in jobs)
+    print 'Running conversion of %d h5 files' % len(jobs)
+    process = subprocess.Popen([gen_gf_surface_location, '--batch', '-'], stdin=subprocess.PIPE)
+    process.communicate(batch)
+    if process.returncode != 0:
+        print "gen_gf_surface failed (exit status %d)" % process.returncode
+        exit(1)
+
 def get_srf_path(base_dir, realisation=None):
     srf_file = []
     if realisation is None:
@@ -0,0 +1,330 @@
+"""
+Reads the GMT (NetCDF) groundfailure model grids and samples them at arbitrary points.
+Replaces running grdtrack -nl over a text file of points.
+
+Grids can also be resampled once onto a common base grid and stored as a single memory-mappable
+float32 stack of shape (n_bands, ny, nx), so sampling every band for a point is a single gather.
+Stacks can be written tile by tile from worker threads (write_tiled_stack), for rasters larger than memory.
+"""
+
+import collections
+import concurrent.futures
+import json
+import os
+
+import numpy as np
+from netCDF4 import Dataset
+
+# grdtrack only interpolates when the non-NaN nodes carry at least this much of the weight (-n+t0.5)
+NAN_WEIGHT_THRESHOLD = 0.5
+
+STACK_ARRAY_FILE = "stack.npy"
+STACK_METADATA_FILE = "stack.json"
+
+
+def read_grid_coords(grid_file):
+    """Reads the x and y node coordinates (both ascending) of a GMT grid"""
+    with Dataset(grid_file) as ds:
+        z_var = next(var for var in ds.variables.values() if var.ndim == 2)
+        y_name, x_name = z_var.dimensions
+        x = np.asarray(ds.variables[x_name][:], dtype=np.float64)
+        y = np.asarray(ds.variables[y_name][:], dtype=np.float64)
+    return x, np.sort(y)
+
+
+def _bilinear_nodes(x0, dx, nx, y0, dy, ny, lons, lats):
+    """
+    Finds the four surrounding nodes of each point on the regular grid described by its first node, spacing and size.
+    Returns the mask of points inside the grid and a list of (rows, cols, weights) for the four corners
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    fx = (lons - x0) / dx if nx > 1 else np.zeros_like(lons)
+    fy = (lats - y0) / dy if ny > 1 else np.zeros_like(lats)
+    with np.errstate(invalid="ignore"):
+        inside = (fx >= 0) & (fx <= nx - 1) & (fy >= 0) & (fy <= ny - 1)
+    fx = np.where(inside, fx, 0)
+    fy = np.where(inside, fy, 0)
+
+    col = np.clip(np.floor(fx).astype(np.intp), 0, max(nx - 2, 0))
+    row = np.clip(np.floor(fy).astype(np.intp), 0, max(ny - 2, 0))
+    wx = fx - col
+    wy = fy - row
+    col_1 = np.minimum(col + 1, nx - 1)
+    row_1 = np.minimum(row + 1, ny - 1)
+    corners = [
+        (row, col, (1 - wx) * (1 - wy)),
+        (row, col_1, wx * (1 - wy)),
+        (row_1, col, (1 - wx) * wy),
+        (row_1, col_1, wx * wy),
+    ]
+    return inside, corners
+
+
+def _bilinear_combine(node_values, corners, inside):
+    """
+    Weights the node values (one array per corner, points along the last axis) into the interpolated values.
+    NaN nodes are dropped and the remaining weights renormalised, as grdtrack -nl does
+    """
+    total = np.zeros(node_values[0].shape, dtype=np.float64)
+    weight = np.zeros(node_values[0].shape, dtype=np.float64)
+    for node, (_, _, w) in zip(node_values, corners):
+        valid = ~np.isnan(node)
+        total += w * np.where(valid, node, 0)
+        weight += np.where(valid, w, 0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        values = total / weight
+    values[..., ~inside] = np.nan
+    values[weight < NAN_WEIGHT_THRESHOLD] = np.nan
+    return values
+
+
+def _spacing(coords):
+    return (coords[-1] - coords[0]) / (len(coords) - 1) if len(coords) > 1 else 1.0
+
+
+def sample_grid(grid_file, lons, lats):
+    """
+    Bilinearly samples a GMT grid at the given points, reading only the window of nodes the points need.
+    Nodes are located on the whole grid, so a point's value does not depend on the other points sampled with it.
+    NaN nodes are dropped and the remaining weights renormalised, as grdtrack -nl does.
+    Points outside the grid are NaN
+    """
+    with Dataset(grid_file) as ds:
+        z_var = next(var for var in ds.variables.values() if var.ndim == 2)
+        y_name, x_name = z_var.dimensions
+        x = np.asarray(ds.variables[x_name][:], dtype=np.float64)
+        y = np.asarray(ds.variables[y_name][:], dtype=np.float64)
+        y_flipped = len(y) > 1 and y[0] > y[-1]
+        if y_flipped:
+            y = y[::-1]
+
+        inside, corners = _bilinear_nodes(
+            x[0], _spacing(x), len(x), y[0], _spacing(y), len(y), lons, lats
+        )
+        if not inside.any():
+            return np.full(inside.shape, np.nan)
+        row_start = corners[0][0][inside].min()
+        row_stop = corners[3][0][inside].max() + 1
+        col_start = corners[0][1][inside].min()
+        col_stop = corners[3][1][inside].max() + 1
+
+        if y_flipped:
+            rows = slice(len(y) - row_stop, len(y) - row_start)
+        else:
+            rows = slice(row_start, row_stop)
+        z = z_var[rows, col_start:col_stop]
+        z = np.ma.filled(np.ma.asarray(z).astype(np.float64), np.nan)
+        if y_flipped:
+            z = z[::-1]
+
+    node_values = [
+        z[
+            np.clip(rows - row_start, 0, z.shape[0] - 1),
+            np.clip(cols - col_start, 0, z.shape[1] - 1),
+        ]
+        for rows, cols, _ in corners
+    ]
+    return _bilinear_combine(node_values, corners, inside)
+
+
+def sample_grids(grid_files, lons, lats):
+    """
+    Samples each grid in the {name: path} mapping at the given points.
+    Returns a {name: values} dict with one value per point, in the order of the points
+    """
+    return {
+        name: sample_grid(grid_file, lons, lats)
+        for name, grid_file in grid_files.items()
+    }
+
+
+def grid_version(grid_file):
+    """Identifies the version of a grid file by its name, size and modification time"""
+    stat = os.stat(grid_file)
+    return {
+        "file": os.path.basename(grid_file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def _create_stack(stack_dir, bands, x, y):
+    """Creates the (n_bands, ny, nx) float32 array file of a stack, returning it memory-mapped"""
+    os.makedirs(stack_dir, exist_ok=True)
+    return np.lib.format.open_memmap(
+        os.path.join(stack_dir, STACK_ARRAY_FILE),
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(bands), len(y), len(x)),
+    )
+
+
+def write_stack(stack_dir, bands, x, y, fill_block, block_rows=512, **extra_metadata):
+    """
+    Writes a float32 stack of shape (n_bands, ny, nx) on the grid with nodes x, y to stack_dir,
+    alongside a JSON file with the band names and georeferencing (plus any extra_metadata).
+    fill_block(row_start, block_y) returns the (n_bands, len(block_y), nx) values for the block of rows,
+    so memory use stays bounded
+    """
+    stack = _create_stack(stack_dir, bands, x, y)
+    for row_start in range(0, len(y), block_rows):
+        block_y = y[row_start : row_start + block_rows]
+        stack[:, row_start : row_start + len(block_y)] = fill_block(row_start, block_y)
+    stack.flush()
+    del stack
+    return _write_stack_metadata(stack_dir, bands, x, y, **extra_metadata)
+
+
+def _write_stack_metadata(stack_dir, bands, x, y, **extra_metadata):
+    metadata = {
+        "bands": list(bands),
+        "x0": float(x[0]),
+        "dx": float(_spacing(x)),
+        "nx": len(x),
+        "y0": float(y[0]),
+        "dy": float(_spacing(y)),
+        "ny": len(y),
+    }
+    metadata.update(extra_metadata)
+    # Written last so that an interrupted build is never mistaken for a complete stack
+    with open(os.path.join(stack_dir, STACK_METADATA_FILE), "w") as metadata_fp:
+        json.dump(metadata, metadata_fp, indent=2)
+    return metadata
+
+
+def tiles(ny, nx, tile_shape=(512, 512)):
+    """The (rows, cols) slices of the tiles covering a (ny, nx) grid, in row-major order"""
+    tile_rows, tile_cols = tile_shape
+    return [
+        (slice(row, min(row + tile_rows, ny)), slice(col, min(col + tile_cols, nx)))
+        for row in range(0, ny, tile_rows)
+        for col in range(0, nx, tile_cols)
+    ]
+
+
+def evaluate_tiles(
+    evaluate_tile, out, tile_shape=(512, 512), workers=1, max_in_flight=None
+):
+    """
+    Calls evaluate_tile(rows, cols) for every tile of the last two axes of out in worker threads,
+    writing each (..., tile rows, tile cols) result into out as soon as it finishes.
+    At most max_in_flight tiles (default 2 * workers) are being evaluated or waiting to be written,
+    so only that many tiles are in memory whatever the size of out.
+    NumPy, and reading memory-mapped arrays, release the GIL, so the threads run concurrently
+    """
+    max_in_flight = max_in_flight or 2 * workers
+    pending = collections.deque(tiles(out.shape[-2], out.shape[-1], tile_shape))
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        running = {}
+        while pending or running:
+            while pending and len(running) < max_in_flight:
+                rows, cols = pending.popleft()
+                running[executor.submit(evaluate_tile, rows, cols)] = (rows, cols)
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                rows, cols = running.pop(future)
+                out[..., rows, cols] = future.result()
+    return out
+
+
+def write_tiled_stack(
+    stack_dir,
+    bands,
+    x,
+    y,
+    evaluate_tile,
+    tile_shape=(512, 512),
+    workers=1,
+    max_in_flight=None,
+    **extra_metadata
+):
+    """
+    Writes a float32 stack like write_stack, evaluating it tile by tile with evaluate_tiles.
+    evaluate_tile(rows, cols) returns the (n_bands, tile rows, tile cols) values of a tile of the x, y grid
+    """
+    stack = _create_stack(stack_dir, bands, x, y)
+    evaluate_tiles(evaluate_tile, stack, tile_shape, workers, max_in_flight)
+    stack.flush()
+    del stack
+    return _write_stack_metadata(stack_dir, bands, x, y, **extra_metadata)
+
+
+def stack_coords(metadata):
+    """Returns the x and y node coordinates of a stack from its metadata"""
+    x = metadata["x0"] + metadata["dx"] * np.arange(metadata["nx"])
+    y = metadata["y0"] + metadata["dy"] * np.arange(metadata["ny"])
+    return x, y
+
+
+def build_stack(grid_files, stack_dir, base_grid, block_rows=512):
+    """
+    Resamples every grid in the ordered {name: path} mapping onto the nodes of base_grid
+    and stores them in stack_dir as a single float32 array of shape (n_bands, ny, nx)
+    """
+    x, y = read_grid_coords(base_grid)
+
+    def resample_block(row_start, block_y):
+        lons, lats = np.meshgrid(x, block_y)
+        return [
+            sample_grid(grid_file, lons.ravel(), lats.ravel()).reshape(lons.shape)
+            for grid_file in grid_files.values()
+        ]
+
+    return write_stack(
+        stack_dir,
+        list(grid_files),
+        x,
+        y,
+        resample_block,
+        block_rows,
+        sources={name: grid_version(path) for name, path in grid_files.items()},
+    )
+
+
+def load_stack(stack_dir):
+    """Memory-maps a stack built by build_stack, returning its metadata and the (n_bands, ny, nx) array"""
+    with open(os.path.join(stack_dir, STACK_METADATA_FILE)) as metadata_fp:
+        metadata = json.load(metadata_fp)
+    stack = np.load(os.path.join(stack_dir, STACK_ARRAY_FILE), mmap_mode="r")
+    return metadata, stack
+
+
+def stack_version(stack_dir):
+    """Identifies the version of a stack by its georeferencing, bands, sources and array file"""
+    with open(os.path.join(stack_dir, STACK_METADATA_FILE)) as metadata_fp:
+        version = json.load(metadata_fp)
+    version["array"] = grid_version(os.path.join(stack_dir, STACK_ARRAY_FILE))
+    return version
+
+
+def sample_stack(stack_dir, bands, lons, lats):
+    """
+    Bilinearly samples the named bands of a stack at the given points with one gather per corner node.
+    Returns a {name: values} dict with one value per point, in the order of the points
+    """
+    metadata, stack = load_stack(stack_dir)
+    missing = [band for band in bands if band not in metadata["bands"]]
+    if missing:
+        raise ValueError(
+            "Stack {} does not contain the bands {}".format(stack_dir, missing)
+        )
+    band_index = np.array(
+        [metadata["bands"].index(band) for band in bands], dtype=np.intp
+    )[:, None]
+
+    inside, corners = _bilinear_nodes(
+        metadata["x0"],
+        metadata["dx"],
+        metadata["nx"],
+        metadata["y0"],
+        metadata["dy"],
+        metadata["ny"],
+        lons,
+        lats,
+    )
+    node_values = [stack[band_index, rows, cols] for rows, cols, _ in corners]
+    return dict(zip(bands, _bilinear_combine(node_values, corners, inside)))
@@ -0,0 +1,146 @@
+"""
+Writes the tables calculate_gf produces, one chunk at a time.
+csv is plain text (gzipped with compress). parquet (requires pyarrow), hdf5 (one dataset per column, requires h5py)
+and npz (one array per column, held in memory until closed) are columnar binary formats
+"""
+
+import gzip
+
+import numpy as np
+
+CSV = "csv"
+PARQUET = "parquet"
+HDF5 = "hdf5"
+NPZ = "npz"
+OUTPUT_FORMATS = (CSV, PARQUET, HDF5, NPZ)
+
+
+def format_chunk(df, output_format):
+    """
+    Prepares a chunk for ChunkWriter.write. CSV chunks are formatted to text here,
+    so when this runs in worker processes the formatting is spread across them too
+    """
+    if output_format == CSV:
+        return df.iloc[:0].to_csv(index=False, sep=","), df.to_csv(
+            index=False, sep=",", header=False
+        )
+    return df
+
+
+def _text_values(series):
+    """Text columns as a fixed width unicode array, missing values as empty strings"""
+    return series.fillna("").astype(str).to_numpy(dtype=str)
+
+
+class ChunkWriter:
+    """Appends chunks of a table to output_file in the given format. Use as a context manager"""
+
+    def __init__(self, output_file, output_format=CSV, compress=False):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("Unknown output format {}".format(output_format))
+        self.output_file = output_file
+        self.output_format = output_format
+        self.compress = compress
+        self.columns = None
+        self._fd = None
+        self._hdf5_started = False
+        self._parquet_writer = None
+        self._npz_arrays = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, chunk):
+        """Writes a DataFrame, or a chunk prepared by format_chunk"""
+        if self.output_format == CSV:
+            self._write_csv(chunk)
+            return
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+        if self.output_format == PARQUET:
+            self._write_parquet(chunk)
+        elif self.output_format == HDF5:
+            self._write_hdf5(chunk)
+        else:
+            self._write_npz(chunk)
+
+    def close(self):
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        if self._npz_arrays is not None:
+            arrays = {
+                column: np.concatenate(chunks)
+                for column, chunks in self._npz_arrays.items()
+            }
+            save = np.savez_compressed if self.compress else np.savez
+            with open(self.output_file, "wb") as out_fd:
+                save(out_fd, **arrays)
+            self._npz_arrays = None
+
+    def _write_csv(self, chunk):
+        first = self._fd is None
+        if first:
+            if self.compress:
+                self._fd = gzip.open(self.output_file, "wt", newline="")
+            else:
+                self._fd = open(self.output_file, "w", newline="")
+        if isinstance(chunk, tuple):
+            header, rows = chunk
+            if first:
+                self._fd.write(header)
+            self._fd.write(rows)
+        else:
+            chunk.to_csv(self._fd, index=False, sep=",", header=first)
+
+    def _write_parquet(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(
+                self.output_file,
+                table.schema,
+                compression="zstd" if self.compress else "none",
+            )
+        self._parquet_writer.write_table(table.cast(self._parquet_writer.schema))
+
+    def _write_hdf5(self, df):
+        import h5py
+
+        with h5py.File(self.output_file, "a" if self._hdf5_started else "w") as h5:
+            h5.attrs["columns"] = self.columns
+            for column in self.columns:
+                if df[column].dtype.kind in "iuf":
+                    values = df[column].to_numpy()
+                else:
+                    values = _text_values(df[column]).astype(h5py.string_dtype())
+                if column not in h5:
+                    h5.create_dataset(
+                        column,
+                        data=values,
+                        maxshape=(None,),
+                        chunks=True,
+                        compression="gzip" if self.compress else None,
+                    )
+                else:
+                    dataset = h5[column]
+                    dataset.resize(dataset.shape[0] + len(values), axis=0)
+                    dataset[-len(values) :] = values
+        self._hdf5_started = True
+
+    def _write_npz(self, df):
+        if self._npz_arrays is None:
+            self._npz_arrays = {column: [] for column in self.columns}
+        for column in self.columns:
+            if df[column].dtype.kind in "iuf":
+                self._npz_arrays[column].append(df[column].to_numpy())
+            else:
+                self._npz_arrays[column].append(_text_values(df[column]))
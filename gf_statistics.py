@@ -0,0 +1,149 @@
+"""
+Statistics of the probabilities over the realisations, accumulated one batch of realisations at a time,
+so the (points x realisations) probabilities are never all held at once.
+
+The mean and standard deviation (over the realisations, ddof=0) are accumulated with Welford's algorithm,
+combining each batch's mean and sum of squared deviations (Chan et al.). Exceedance probabilities P(p > x)
+are counted. Percentiles come from a histogram sketch per point: bin 0 holds [0, min_value) and the other bins split
+[min_value, 1] evenly in log10. A percentile q is the value at which the empirical CDF reaches q
+(numpy's inverted_cdf method), interpolated within its bin, so its relative error is at most the bin ratio,
+10 ** (log10(1 / min_value) / bins); with the defaults 7%. Values below min_value only resolve to that bin.
+The histograms take (bins + 1) * 4 bytes per point. NaN probabilities are left out of every statistic.
+"""
+
+import collections
+
+import numpy as np
+
+DEFAULT_PERCENTILES = (5, 50, 95)
+DEFAULT_BINS = 200
+DEFAULT_MIN_VALUE = 1e-6
+DEFAULT_BATCH_SIZE = 16
+
+# What to calculate, so it can be passed to the worker processes
+StatisticsOptions = collections.namedtuple(
+    "StatisticsOptions",
+    ["percentiles", "exceedances", "bins", "min_value", "batch_size"],
+)
+StatisticsOptions.__new__.__defaults__ = (
+    DEFAULT_PERCENTILES,
+    (),
+    DEFAULT_BINS,
+    DEFAULT_MIN_VALUE,
+    DEFAULT_BATCH_SIZE,
+)
+
+
+def statistic_names(options):
+    """The names of the statistics in the order RealisationStatistics.values returns them"""
+    return (
+        ["mean", "std"]
+        + ["p{:g}".format(percentile) for percentile in options.percentiles]
+        + ["exceedance_{:g}".format(exceedance) for exceedance in options.exceedances]
+    )
+
+
+class RealisationStatistics:
+    """Accumulates the statistics of StatisticsOptions for n_points, from (n_points, batch) blocks of values"""
+
+    def __init__(self, n_points, options=StatisticsOptions()):
+        self.options = options
+        self.count = np.zeros(n_points, dtype=np.int64)
+        self.mean = np.zeros(n_points)
+        self.m2 = np.zeros(n_points)
+        self.exceedance_counts = np.zeros(
+            (n_points, len(options.exceedances)), dtype=np.int64
+        )
+        self.log_min_value = np.log10(options.min_value)
+        self.bin_width = -self.log_min_value / options.bins
+        self.histogram = (
+            np.zeros((n_points, options.bins + 1), dtype=np.uint32)
+            if options.percentiles
+            else None
+        )
+
+    def update(self, values):
+        """Adds a (n_points, batch) block of values"""
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            batch_mean = np.nansum(values, axis=1) / count
+            batch_m2 = np.nansum(np.square(values - batch_mean[:, np.newaxis]), axis=1)
+            total = self.count + count
+            delta = batch_mean - self.mean
+            updated = count > 0
+            self.mean = np.where(updated, self.mean + delta * count / total, self.mean)
+            self.m2 = np.where(
+                updated,
+                self.m2 + batch_m2 + np.square(delta) * self.count * count / total,
+                self.m2,
+            )
+        self.count = total
+
+        for i, exceedance in enumerate(self.options.exceedances):
+            self.exceedance_counts[:, i] += (values > exceedance).sum(axis=1)
+
+        if self.histogram is not None:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                bins = np.log10(values)
+            bins -= self.log_min_value
+            bins /= self.bin_width
+            bins = np.clip(np.nan_to_num(bins, nan=-1), -1, self.options.bins - 1)
+            bins = np.floor(bins).astype(np.intp) + 1
+            # Each point appears once per realisation, so the increments have no duplicate indices
+            for realisation in range(values.shape[1]):
+                (points,) = np.nonzero(valid[:, realisation])
+                self.histogram[points, bins[points, realisation]] += 1
+
+    def percentiles(self):
+        """Estimates the (n_points, percentiles) percentiles from the histograms"""
+        cumulative = np.cumsum(self.histogram, axis=1, dtype=np.int64)
+        # Bin edges, with bin 0 spanning [0, min_value)
+        edges = np.concatenate(
+            [
+                [0.0],
+                10.0
+                ** (
+                    self.log_min_value
+                    + self.bin_width * np.arange(self.options.bins + 1)
+                ),
+            ]
+        )
+        result = np.full((len(self.count), len(self.options.percentiles)), np.nan)
+        rows = np.arange(len(self.count))
+        for i, percentile in enumerate(self.options.percentiles):
+            target = percentile / 100 * self.count
+            bins = np.minimum(
+                (cumulative < target[:, np.newaxis]).sum(axis=1),
+                self.options.bins,
+            )
+            below = np.where(bins > 0, cumulative[rows, bins - 1], 0)
+            in_bin = self.histogram[rows, bins]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                fraction = np.clip((target - below) / in_bin, 0, 1)
+            fraction = np.nan_to_num(fraction)
+            lower = edges[bins]
+            upper = edges[bins + 1]
+            # Linear in the first bin, geometric in the log spaced ones
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values = np.where(
+                    bins == 0,
+                    upper * fraction,
+                    lower * (upper / lower) ** fraction,
+                )
+            result[:, i] = np.where(self.count > 0, values, np.nan)
+        return result
+
+    def values(self):
+        """The (n_points, statistics) statistics, in the order of statistic_names"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            has_values = self.count > 0
+            mean = np.where(has_values, self.mean, np.nan)
+            std = np.where(has_values, np.sqrt(self.m2 / self.count), np.nan)
+            exceedance = self.exceedance_counts / self.count[:, np.newaxis]
+        columns = [mean[:, np.newaxis], std[:, np.newaxis]]
+        if self.histogram is not None:
+            columns.append(self.percentiles())
+        columns.append(exceedance)
+        return np.hstack(columns)
@@ -0,0 +1,178 @@
+"""
+Reading and writing the xyz files gen_gf_surface.py writes, shared by the plotting and CCDF scripts.
+
+A text xyz file has HEADER_LINES header lines (title, label, CPT spec, range, legend, model label)
+then a "x y value" line per point, every number formatted with "%f".
+A binary xyz file (BINARY_EXTENSION) holds the same points as MAGIC, the little endian uint32 length of a JSON header,
+the JSON header padded to a multiple of 16 bytes, then one 12 byte RECORD_DTYPE record per point, so it can be memory
+mapped. The JSON header has the header lines by name, the record fields, the coordinate scale and whether NaN
+values were left out.
+x and y are stored as int32 millionths, which is exactly their "%f" text in a text file (that the CCDF scripts key on,
+other than "-0.000000", which becomes "0.000000"), and the values as float32.
+read_xyz reads either kind, and read_points reads one into the point lists the CCDF scripts use.
+"""
+
+import json
+import struct
+import warnings
+
+import numpy as np
+
+HEADER_LINES = 6
+# The name of each header line, also used for raster attributes
+HEADER_NAMES = ('title', 'label', 'cpt', 'range', 'legend', 'model_label')
+
+BINARY_EXTENSION = '.xyzb'
+MAGIC = b'GFXYZB\x00\x01'
+RECORD_DTYPE = np.dtype([('x', '<i4'), ('y', '<i4'), ('value', '<f4')])
+COORDINATE_SCALE = 1e6
+# Records are written at most this many at a time, bounding the memory of their text
+BLOCK_POINTS = 1000000
+
+
+def format_values(values):
+    """The "%f" text of each value, as a bytes array"""
+    return np.char.mod(b'%f', np.asarray(values, dtype=np.float64))
+
+
+def format_fields(strings):
+    """strings each followed by a space, as a bytes array of the x or y fields that start format_lines' lines"""
+    return np.char.add(np.array(strings, dtype=object).astype('S'), b' ')
+
+
+def format_lines(x_fields, y_fields, values):
+    """The "x y value" lines of points, from the x and y field of each point (format_fields) and their values"""
+    lines = np.char.add(np.char.add(x_fields, y_fields), np.char.add(format_values(values), b'\n'))
+    return b''.join(lines.tolist())
+
+
+def format_coordinates(values):
+    """The "%f" text of each value, as a text xyz file has it"""
+    return ["%f" % x for x in np.asarray(values, dtype=np.float64).tolist()]
+
+
+def write_text_xyz(fname, header, x, y, values):
+    """Writes a text xyz file"""
+    with open(fname, 'wb') as fout:
+        fout.write(('\n'.join(header) + '\n').encode('ascii'))
+        for start in range(0, len(values), BLOCK_POINTS):
+            block = slice(start, start + BLOCK_POINTS)
+            fout.write(format_lines(format_fields(format_values(x[block])), format_fields(format_values(y[block])),
+                                    values[block]))
+
+
+class BinaryXyzWriter(object):
+    """Writes a binary xyz file a block of points at a time, leaving out NaN values if elide_nans"""
+
+    def __init__(self, fname, header, elide_nans=False):
+        self.elide_nans = elide_nans
+        metadata = json.dumps({
+            'header': dict(zip(HEADER_NAMES, header)),
+            'fields': [[name, RECORD_DTYPE.fields[name][0].str] for name in RECORD_DTYPE.names],
+            'coordinate_scale': COORDINATE_SCALE,
+            'elide_nans': elide_nans,
+        }).encode('utf-8')
+        # The records start on a multiple of 16 bytes
+        length = len(metadata) + (-(len(MAGIC) + 4 + len(metadata)) % 16)
+        self.fout = open(fname, 'wb')
+        self.fout.write(MAGIC + struct.pack('<I', length) + metadata.ljust(length))
+
+    def write(self, x, y, values):
+        self.write_micro(to_micro(x), to_micro(y), values)
+
+    def write_micro(self, x, y, values):
+        """Writes points whose coordinates are already millionths (see to_micro)"""
+        records = np.empty(len(values), dtype=RECORD_DTYPE)
+        records['x'] = x
+        records['y'] = y
+        records['value'] = values
+        if self.elide_nans:
+            records = records[~np.isnan(records['value'])]
+        self.fout.write(records.tobytes())
+
+    def close(self):
+        self.fout.close()
+
+
+def to_micro(values):
+    """Converts coordinates to int32 millionths, exactly as "%f" rounds them"""
+    values = np.asarray(values, dtype=np.float64)
+    if not np.all(np.abs(values) < 2 ** 31 / COORDINATE_SCALE):
+        raise ValueError('Coordinates must be finite and within +-%g' % (2 ** 31 / COORDINATE_SCALE))
+    return np.char.replace(format_values(values), b'.', b'').astype(np.int64)
+
+
+def write_binary_xyz(fname, header, x, y, values, elide_nans=False):
+    """Writes a binary xyz file"""
+    writer = BinaryXyzWriter(fname, header, elide_nans)
+    writer.write(x, y, values)
+    writer.close()
+
+
+def is_binary(fname):
+    """Whether fname is a binary xyz file"""
+    with open(fname, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _read_binary_metadata(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError('%s is not a binary xyz file' % f.name)
+    (length,) = struct.unpack('<I', f.read(4))
+    return json.loads(f.read(length).decode('utf-8')), len(MAGIC) + 4 + length
+
+
+def read_header(fname):
+    """Reads the HEADER_LINES header lines of a text or binary xyz file"""
+    with open(fname, 'rb') as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            f.seek(0)
+            metadata, _ = _read_binary_metadata(f)
+            return [metadata['header'][name] for name in HEADER_NAMES]
+        f.seek(0)
+        return [f.readline().decode('ascii').rstrip('\n') for _ in range(HEADER_LINES)]
+
+
+def read_xyz(fname, mmap=True):
+    """
+    Reads a text or binary xyz file, returning its header lines and the x, y and value arrays of its points.
+    A binary file's values are a view of a memory map of it unless mmap is False
+    """
+    with open(fname, 'rb') as f:
+        binary = f.read(len(MAGIC)) == MAGIC
+        f.seek(0)
+        if binary:
+            metadata, offset = _read_binary_metadata(f)
+            dtype = np.dtype([(str(name), str(field)) for name, field in metadata['fields']])
+            f.seek(0, 2)
+            count = (f.tell() - offset) // dtype.itemsize
+            if not mmap or count == 0:
+                f.seek(offset)
+                records = np.fromfile(f, dtype=dtype, count=count)
+    if binary:
+        if mmap and count:
+            records = np.memmap(fname, dtype=dtype, mode='r', offset=offset, shape=(count,))
+        header = [metadata['header'][name] for name in HEADER_NAMES]
+        scale = metadata['coordinate_scale']
+        return header, records['x'] / scale, records['y'] / scale, records['value']
+
+    header = read_header(fname)
+    with warnings.catch_warnings():
+        # loadtxt warns when there are no points
+        warnings.simplefilter('ignore')
+        points = np.loadtxt(fname, skiprows=HEADER_LINES, ndmin=2).reshape(-1, 3)
+    return header, points[:, 0], points[:, 1], points[:, 2]
+
+
+def read_points(fname, zero_prob):
+    """
+    Reads a text or binary xyz file, returning a list of the ("%f" lat, "%f" lon) text of every point
+    and a list of the (value, lat, lon) of the points whose value is at least zero_prob
+    """
+    _, lon, lat, values = read_xyz(fname)
+    lon = format_coordinates(lon)
+    lat = format_coordinates(lat)
+    values = np.asarray(values, dtype=float)
+    with np.errstate(invalid='ignore'):
+        (above,) = np.nonzero(values >= zero_prob)
+    return list(zip(lat, lon)), [(p, lat[i], lon[i]) for i, p in zip(above.tolist(), values[above].tolist())]
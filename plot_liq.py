@@ -24,6 +24,7 @@ import itertools
 import numpy as np
 
 import gf_common
+import gf_xyz
 
 def create_xyz_name(out_dir, run_name, model, map_type, vs30_model):
     return os.path.join(out_dir, "%s_zhu_2016_%s_%s_%s.xyz" % (run_name, model, map_type, vs30_model))
@@ -44,6 +45,7 @@ print "using %s for gen_gf_surface" % (gen_gf_surface_location,)
 
 plot_configs = list(itertools.product(gf_common.model_list, gf_common.map_type_list, gf_common.vs30_model_list))
 
+jobs = []
 for config in plot_configs:
     model, map_type, vs30_model = config
 
@@ -53,24 +55,31 @@ for config in plot_configs:
     liq_cmd = "python3 /usr/bin/gfail %s %s -d %s -c %s -o %s --set-bounds 'zoom, pgv, 0' --hdf5" % (liq_config, gridfile, model_dir, config_dir, non_realisation_path)
 
     print 'Running liquefaction calculations'
+    h5_before = gf_common.h5_times(out_dir)
     subprocess.call(liq_cmd, shell=True)
 
-    h5path = gf_common.find_h5(out_dir)
-    
     xyz_path = create_xyz_name(out_dir, run_name, model, map_type, vs30_model)
+
+    # Every config's h5 file is kept under its own name until the conversions run
+    h5path = gf_common.keep_new_h5(out_dir, h5_before, os.path.splitext(xyz_path)[0] + '.h5')
     
-    process_cmd = gen_gf_surface_location + " \"%s\" -t \"%s\" -o \"%s\"" % (h5path, run_name, xyz_path)
+    process_args = [h5path, '-t', run_name, '-o', xyz_path]
     if model == 'coastal':
-        process_cmd += " -m1"
+        process_args.append('-m1')
     else:
-        process_cmd += " -m2"
+        process_args.append('-m2')
     if map_type == 'susceptibility':
-        process_cmd += " -s"
+        process_args.append('-s')
     elif map_type == 'probability':
-        process_cmd += '' #' -l0.05'        
+        pass #process_args.append('-l0.05')
+    jobs.append(process_args)
+
+# The h5 files are converted together, so gen_gf_surface only starts once
+gf_common.convert_h5(gen_gf_surface_location, jobs)
 
-    print 'Running conversion'
-    subprocess.call(process_cmd, shell=True)
+for config in plot_configs:
+    model, map_type, vs30_model = config
+    xyz_path = create_xyz_name(out_dir, run_name, model, map_type, vs30_model)
 
     if not os.path.exists(xyz_path):
         print "xyz file not found at %s" % xyz_path
@@ -79,18 +88,14 @@ for config in plot_configs:
     gf_common.plot(out_dir, xyz_path, run_name, vs30_model, map_type, model, 'liq', path, realisation)
 
 
+# Upper bounds of the susceptibility classes normalise maps values to
+SUSCEPTIBILITY_CLASSES = [-3.2, -3.15, -1.95, -1.15]
+
+
 def normalise(val):
-    if val < -3.2:
-        return 0
-    elif val < -3.15:
-        return 1
-    elif val < -1.95:
-        return 2
-    elif val < -1.15:
-        return 3
-    else:
-        return 4
-    
+    """The susceptibility class (0 - 4) of each value, NaN being in the last"""
+    return np.searchsorted(SUSCEPTIBILITY_CLASSES, val, side='right')
+
 
 ## plotting arithmetic distance
 
@@ -104,52 +109,22 @@ for vs30_model in gf_common.vs30_model_list:
 
     if os.path.exists(fname1) and os.path.exists(fname2):
         diff_out_name = create_xyz_name(out_dir, run_name, model, map_type, vs30_model)
-        with open(fname1) as f1, open(fname2) as f2 , open(diff_out_name, 'w') as fout:
-            print "Calculating arithmetic difference"
-            unmatched = 0
-            data = []
-            fout.write(run_name)
-            fout.write("\nGeneral - Coastal (%s, susceptibility)\n" % vs30_model)
-            fout.write("polar:topo-grey1,t-30,fg-80/0/0,bg-0/0/80 1k:nns-4k,g-nearneighbor,landmask\n")
-            fout.write("-1.5 1.5 1 0.5\n1 white\nArithmetic Difference\n")
-            
-            for __ in xrange(6):
-                next(f1)
-                next(f2)
-            for l1, l2 in itertools.izip(f1, f2):
-                lon1, lat1, v1 = l1.split()
-                lon2, lat2, v2 = l2.split()
-                v1 = float(v1)
-                v2 = float(v2)
-                while 0 and lon1 != lon2 or lat1 != lat2:
-                    if lat1 == lat2:
-                        if lon1 > lon2:
-                            f2.next()
-                        else:
-                            f1.next()
-                    else:
-                        if lat1 > lat2:
-                            f2.next()
-                            f1.next()
-                    unmatched += 1
-                if lon1 == lon2 and lat1 == lat2:
-                    v1 = normalise(v1)
-                    v2 = normalise(v2)
-                    val = v1 - v2
-                    # if (v1 < -4.8 or v2 < -4.8) and val > -3.75:
-                        # val = 0
-                    if val > 0:
-                        val = 1
-                    elif val < 0:
-                        val = -1
-                    data.append(val)
-                    fout.write("%s %s %f\n" % (lon1, lat1, val))
-                else:
-                    unmatched += 1
-                            
-            print "Lines without a difference: %d\n" % unmatched
-            print "mean: %f, std: %f, min: %f, max: %f\n" % (np.mean(data), np.std(data, ddof=1), np.min(data), np.max(data))
-            
+        print "Calculating arithmetic difference"
+        _, lon1, lat1, v1 = gf_xyz.read_xyz(fname1)
+        _, lon2, lat2, v2 = gf_xyz.read_xyz(fname2)
+        # Points are paired in file order, and only differenced where both are at the same location
+        n = min(len(v1), len(v2))
+        matched = (lon1[:n] == lon2[:n]) & (lat1[:n] == lat2[:n])
+        unmatched = n - np.count_nonzero(matched)
+        data = np.sign(normalise(v1[:n][matched]) - normalise(v2[:n][matched])).astype(float)
+        header = [run_name, "General - Coastal (%s, susceptibility)" % vs30_model,
+                  "polar:topo-grey1,t-30,fg-80/0/0,bg-0/0/80 1k:nns-4k,g-nearneighbor,landmask",
+                  "-1.5 1.5 1 0.5", "1 white", "Arithmetic Difference"]
+        gf_xyz.write_text_xyz(diff_out_name, header, lon1[:n][matched], lat1[:n][matched], data)
+
+        print "Lines without a difference: %d\n" % unmatched
+        print "mean: %f, std: %f, min: %f, max: %f\n" % (np.mean(data), np.std(data, ddof=1), np.min(data), np.max(data))
+
         print diff_out_name
         gf_common.plot(out_dir, diff_out_name, run_name, vs30_model, map_type, model, 'liq')
 
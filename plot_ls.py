@@ -40,6 +40,7 @@ def __main__():
         gen_gf_surface_location = os.path.join(gf_common.sim_workflow_dir, gf_common.gen_gf_surface_name)
     print "using %s for gen_gf_surface" % (gen_gf_surface_location,)
 
+    jobs = []
     for map_type in gf_common.map_type_list:
         config = 'jessee_2017_%s.ini' % (map_type)
         
@@ -49,20 +50,25 @@ def __main__():
 
         print 'Running landslide calculations'
         print ls_cmd
+        h5_before = gf_common.h5_times(out_dir)
         subprocess.call(ls_cmd, shell=True)
         
-        h5path = gf_common.find_h5(out_dir)
-                
         xyz_path = create_xyz_name(out_dir, run_name, map_type)
+
+        # Every config's h5 file is kept under its own name until the conversions run
+        h5path = gf_common.keep_new_h5(out_dir, h5_before, os.path.splitext(xyz_path)[0] + '.h5')
         
-        process_cmd = gen_gf_surface_location + " %s -t %s -o %s -type ls" % (h5path, run_name, xyz_path)
+        process_args = [h5path, '-t', run_name, '-o', xyz_path, '-type', 'ls']
         
         if map_type == 'susceptibility':
-            process_cmd += " -s" 
+            process_args.append('-s')
+        jobs.append(process_args)
 
-        print 'Running conversion'
-        subprocess.call(process_cmd, shell=True)
-        
+    # The h5 files are converted together, so gen_gf_surface only starts once
+    gf_common.convert_h5(gen_gf_surface_location, jobs)
+
+    for map_type in gf_common.map_type_list:
+        xyz_path = create_xyz_name(out_dir, run_name, map_type)
         gf_common.plot(out_dir, xyz_path, run_name, "", map_type, "", 'landslide', path, realisation)
 
 
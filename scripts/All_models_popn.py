@@ -39,6 +39,9 @@ from matplotlib import gridspec
 import glob
 from matplotlib.font_manager import FontProperties
 
+import gf_path  # puts the repository root on sys.path, for gf_xyz
+import gf_xyz
+
 #Models to look for within the directory. Each one that is present will be plotted
 MODELS = ['_zhu_2016_coastal_probability_nz-specific-vs30.xyz', '_zhu_2016_coastal_probability_topo-based-vs30.xyz','_zhu_2016_general_probability_nz-specific-vs30.xyz', '_zhu_2016_general_probability_topo-based-vs30.xyz']
 
@@ -86,27 +89,6 @@ def getPopOrDwell(x_axis):
   return data_dict
   
   
-def getXyzData(xyz_file):
-  '''
-  Reads the xyz file and returns a list of lat/lng tuples, and a list of prob/lat/lng tuples.
-  Only probabilities above the zero value are included.
-  '''
-  lat_lng = []
-  data_list = []
-  i = 0
-  with open(xyz_file) as xyz:
-    for line in xyz:
-      if i < 6:
-        i += 1
-      else:
-        line = line.strip().split()
-        lng, lat, prob = line[0], line[1], float(line[2])
-        lat_lng.append((lat,lng))
-        if prob >= ZERO_PROB and not math.isnan(prob):
-          data_list.append((prob,lat,lng))
-  return lat_lng, data_list
-  
-  
 def getRegionData():
   '''
   Reads a text file of lat, lng, region data and returns the data as a dictionary.
@@ -282,7 +264,7 @@ def makeAllModelsCCDF():
   first_model = True
   
   for model in model_paths:
-    lat_lng, data_list = getXyzData(model)
+    lat_lng, data_list = gf_xyz.read_points(model, ZERO_PROB)
     data_list.sort(reverse = True)
     
     #Assumes all models have the same cell_area $$$$$
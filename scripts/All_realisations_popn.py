@@ -45,6 +45,9 @@ import numpy as np
 import glob
 import urllib
 
+import gf_path  # puts the repository root on sys.path, for gf_xyz
+import gf_xyz
+
 #Setting zero probability cut-offs and y-axis limits
 LIQ_ZERO = 0.00262
 LIQ_LIM = 0.65
@@ -104,27 +107,6 @@ def getPopOrDwell(x_axis):
   return data_dict
   
   
-def getXyzData(xyz_file, zero_prob):
-  '''
-  Reads the xyz file and returns a list of lat/lng tuples, and a list of prob/lat/lng tuples.
-  Only probabilities above the zero value are included.
-  '''
-  lat_lng = []
-  data_list = []
-  i = 0
-  with open(xyz_file) as xyz:
-    for line in xyz:
-      if i < 6:
-        i += 1
-      else:
-        line = line.strip().split()
-        lng, lat, prob = line[0], line[1], float(line[2])
-        lat_lng.append((lat,lng))
-        if prob >= zero_prob and not math.isnan(prob):
-          data_list.append((prob,lat,lng))
-  return lat_lng, data_list
-  
-  
 def getRegionData():
   '''
   Reads a text file of lat, lng, region data and returns the data as a dictionary.
@@ -384,7 +366,7 @@ def makeAllRealisationsCCDF():
       print 'Cannot find xyz file for the model (' + model + '( in:\n' + args.run_path + path_type + realisation + '/\n'
       quit()
     
-    lat_lng, data_list = getXyzData(xyz_path, zero_prob)
+    lat_lng, data_list = gf_xyz.read_points(xyz_path, zero_prob)
     
     #Assumes cell area doesn't change between realisations so only calculates once
     if first_realisation:
@@ -49,6 +49,9 @@ from matplotlib import gridspec
 import numpy as np
 import math
 
+import gf_path  # puts the repository root on sys.path, for gf_xyz
+import gf_xyz
+
 #Maximum number of runs that can be plotted in colour
 MAX_COLOUR = 15
 
@@ -117,27 +120,6 @@ def getPopOrDwell(x_axis):
   return data_dict
   
   
-def getXyzData(xyz_file, zero_prob):
-  '''
-  Reads the xyz file and returns a list of lat/lng tuples, and a list of prob/lat/lng tuples.
-  Only probabilities above the zero value are included.
-  '''
-  lat_lng = []
-  data_list = []
-  i = 0
-  with open(xyz_file) as xyz:
-    for line in xyz:
-      if i < 6:
-        i += 1
-      else:
-        line = line.strip().split()
-        lng, lat, prob = line[0], line[1], float(line[2])
-        lat_lng.append((lat,lng))
-        if prob >= zero_prob and not math.isnan(prob):
-          data_list.append((prob,lat,lng))
-  return lat_lng, data_list
-  
-  
 def getCellSize(lat_lng):
   '''
   Finds the upper left and upper right corners of a grid cell to get cell width then
@@ -322,7 +304,7 @@ def makeAllRunsCCDF():
     for realisation in realisation_list:
       prob_dict[realisation] = []
       xyz_path = run_path + '/' + run + path_type + realisation + '/' + run + model
-      lat_lng, prob_dict[realisation] = getXyzData(xyz_path, zero_prob)
+      lat_lng, prob_dict[realisation] = gf_xyz.read_points(xyz_path, zero_prob)
     
     cell_area = getCellSize(lat_lng)
     cumulat_x = 0
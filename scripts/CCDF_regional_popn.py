@@ -42,6 +42,9 @@ import urllib
 import matplotlib.pyplot as plt
 from matplotlib import gridspec
 
+import gf_path  # puts the repository root on sys.path, for gf_xyz
+import gf_xyz
+
 #Lower bounds for each bin, zero probability, y-axis limit, and position of the reference line text for each datatype
 LIQ_HIGH = 0.4
 LIQ_MOD = 0.2
@@ -158,27 +161,6 @@ def getTitle(xyz, title, liq, x_axis):
   return ccdf_title
   
 
-def getXyzData(xyz_file, zero_prob):
-  '''
-  Reads the xyz file and returns a list of lat/lng tuples, and a list of prob/lat/lng tuples.
-  Only probabilities above the zero value are included.
-  '''
-  lat_lng = []
-  data_list = []
-  i = 0
-  with open(xyz_file) as xyz:
-    for line in xyz:
-      if i < 6:
-        i += 1
-      else:
-        line = line.strip().split()
-        lng, lat, prob = line[0], line[1], float(line[2])
-        lat_lng.append((lat,lng))
-        if prob >= zero_prob and not math.isnan(prob):
-          data_list.append((prob,lat,lng))
-  return lat_lng, data_list
-  
-
 def getRegionData():
   '''
   Reads a text file of lat, lng, region data and returns the data as a dictionary.
@@ -352,7 +334,7 @@ def makeCCDF():
     plot_type = 'Landslide'
   
   #Filling lists with the xyz data
-  lat_lng, data_list = getXyzData(args.xyz, zero_prob)
+  lat_lng, data_list = gf_xyz.read_points(args.xyz, zero_prob)
   
   cell_area = getCellSize(lat_lng)
   total_cells = len(data_list)
@@ -21,6 +21,11 @@ import os
 import argparse
 import itertools
 
+import numpy as np
+
+import gf_path  # puts the repository root on sys.path, for gf_xyz
+import gf_xyz
+
 parser = argparse.ArgumentParser()
 parser.add_argument('-i', '--inputdir', default=os.getcwd(), help='Directory that contains the probability xyz files')
 parser.add_argument('-o', '--outputfile', default=os.getcwd(), help='The path to the output-file to be created')
@@ -31,7 +36,6 @@ input_filenames = os.path.join(args.inputdir, '*y.txt.xyz')
 
 # Load the relevant files 
 files = glob.glob(input_filenames)
-fs = []
 
 out_f = open(args.outputfile, 'w')
 
@@ -42,51 +46,33 @@ files.sort(reverse=True)
 probabilities = [float(os.path.basename(f).split('_')[1].replace('p', '.')) for f in files] #extracts the probability from the filename as a float
 n_probs = len(probabilities)
 
-fs = [open(f) for f in files]
+points = [gf_xyz.read_xyz(f)[1:] for f in files]
 
-#skips the headers for all of the files
-for f in fs:
-  f.readline()
-  f.readline()
-  f.readline()
-  f.readline()
-  f.readline()
-  f.readline()
-  f.readline()
+# The files have always been read from their seventh line, so the first point after the six header lines is skipped
+n_lines = max(min([len(values) for _, _, values in points] or [1]) - 1, 0)
+lines = slice(1, n_lines + 1)
+prob_sum = np.zeros(n_lines)
+for i, (_, _, values) in enumerate(points):
+  # find indexes of probabilities from file order
+  i1 = min(i, n_probs-2)
+  i2 = min(i+1, n_probs - 1)
+  delta_haz = probabilities[i1] - probabilities[i2]
+  prob_sum += delta_haz * values[lines].astype(float)
 
-n_lines = 0
+# The location changes from one line of one file to the next, once a line if the files agree
 discrepancy_count = 0
-prev_lat = 0
-prev_lon = 0
-
-for lines in itertools.izip(*fs):
-  probs = []
-  prob_sum = 0
-  i = 0
-  n_lines += 1
-  
-  for line in lines:
-    lon, lat, liq_prob = line.split()
-    
-    liq_prob = float(liq_prob)
-    # find indexes of probabilities from file order
-    i1 = min(i, n_probs-2)
-    i2 = min(i+1, n_probs - 1)
-    delta_haz = probabilities[i1] - probabilities[i2]
-    
-    prob_sum += delta_haz * liq_prob 
-    probs.append(liq_prob)
-    #print delta_haz, liq_prob
-    
-    i += 1
-    if prev_lat != lat or prev_lon != lon:
-      discrepancy_count += 1
-    prev_lat = lat
-    prev_lon = lon
-  out_f.write('%s %s %s %s\n' % (lon, lat, prob_sum, ' '.join(map(str, probs))))
+if points and n_lines:
+  lons = np.column_stack([lon[lines] for lon, _, _ in points]).ravel()
+  lats = np.column_stack([lat[lines] for _, lat, _ in points]).ravel()
+  discrepancy_count = 1 + np.count_nonzero((lons[1:] != lons[:-1]) | (lats[1:] != lats[:-1]))
+
+  # Each line has the location of the last file
+  lon, lat, _ = points[-1]
+  probs = np.column_stack([values[lines] for _, _, values in points]).astype(float).tolist()
+  for lon, lat, prob_sum, probs in itertools.izip(gf_xyz.format_coordinates(lon[lines]),
+                                                   gf_xyz.format_coordinates(lat[lines]), prob_sum.tolist(), probs):
+    out_f.write('%s %s %s %s\n' % (lon, lat, prob_sum, ' '.join(map(str, probs))))
   # sys.stderr.write('lines: %d discrepancies: %d\n' % (n_lines, discrepancy_count-n_lines))
     
 if discrepancy_count - n_lines > 0:
     sys.stderr.write("There has been an error in the collation; please check files are of same length")
-
-
@@ -0,0 +1,15 @@
+'''
+Puts the repository root on sys.path, so the scripts in this folder can import its modules (gf_xyz) when run
+directly, e.g. python CCDF_regional_popn.py. Import it before those modules:
+
+  import gf_path
+  import gf_xyz
+
+Running from elsewhere with PYTHONPATH set to the repository root works too.
+'''
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+  sys.path.insert(0, ROOT)
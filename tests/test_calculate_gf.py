@@ -0,0 +1,104 @@
+"""
+calculate_gf.calculate_chunk on synthetic site data in place of the grids, with the site parameters sampled from
+a susceptibility cache and with statistics over the realisations
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import calculate_gf
+import gf_statistics
+from USGS_models import coefficient_uncertainty, precision
+
+POINTS = 1000
+REALISATIONS = 3
+
+
+@pytest.fixture
+def site_data(monkeypatch):
+    """
+    Replaces the grid sampling with one synthetic site data table of every param, and the susceptibility cache with
+    the susceptibility calculated from it. Returns the params sampled from the grids by each call
+    """
+    gfe_type = list(calculate_gf.gfe_types)
+    table = precision.synthetic_site_data(
+        [param.name for param in calculate_gf.get_required_params(gfe_type)], POINTS
+    )
+    sampled = []
+
+    def interpolate_input_grid(
+        model_dirs, lons, lats, required_params, param_stack=None, index=None
+    ):
+        sampled.append(list(required_params))
+        return table[[param.name for param in required_params]].set_index(
+            pd.Index(index)
+        )
+
+    def sample_susceptibility_cache(cache_dir, param_stack, gfe_type, lons, lats):
+        return {
+            calculate_gf.get_susceptibility_column(
+                gfe
+            ): calculate_gf.calculate_susceptibility(gfe, table)
+            for gfe in gfe_type
+        }
+
+    monkeypatch.setattr(calculate_gf, "interpolate_input_grid", interpolate_input_grid)
+    monkeypatch.setattr(
+        calculate_gf, "sample_susceptibility_cache", sample_susceptibility_cache
+    )
+    return sampled
+
+
+@pytest.mark.parametrize(
+    "sampled_models", [["jessee2017"], ["zhu2016"], ["zhu2016", "jessee2017"]]
+)
+def test_susceptibility_cache_with_coefficient_samplers(site_data, sampled_models):
+    gfe_type = [calculate_gf.gfe_types.zhu2016, calculate_gf.gfe_types.jessee2017]
+    coefficient_samplers = {
+        calculate_gf.get_gfe_type(model): coefficient_uncertainty.CoefficientSampler(
+            model, {"intercept": ["normal", 0.1]}, 20
+        )
+        for model in sampled_models
+    }
+    df = precision.synthetic_input(POINTS, REALISATIONS)
+    expected = calculate_gf.calculate_chunk(
+        df.copy(), None, gfe_type, True, coefficient_samplers=coefficient_samplers
+    )
+    actual = calculate_gf.calculate_chunk(
+        df.copy(),
+        None,
+        gfe_type,
+        True,
+        susceptibility_cache="cache",
+        coefficient_samplers=coefficient_samplers,
+    )
+
+    # Only the coverage params and the site terms of the sampled models come from the grids
+    assert set(site_data[-1]) == set(
+        calculate_gf.get_coverage_params(gfe_type)
+    ) | set(calculate_gf.get_required_params(coefficient_samplers))
+    assert list(actual.columns) == list(expected.columns)
+    for column in expected.columns.drop("station"):
+        np.testing.assert_allclose(actual[column], expected[column], rtol=1e-12)
+
+
+@pytest.mark.parametrize("keep_realisations", [False, True])
+def test_statistics_realisation_columns(site_data, keep_realisations):
+    gfe_type = list(calculate_gf.gfe_types)
+    df = precision.synthetic_input(POINTS, REALISATIONS)
+    result = calculate_gf.calculate_chunk(
+        df.copy(),
+        None,
+        gfe_type,
+        statistics=gf_statistics.StatisticsOptions(),
+        keep_realisations=keep_realisations,
+    )
+
+    realisations = list(itertools.chain(*calculate_gf.get_realisations(df.columns)))
+    assert len(realisations) == 3 * REALISATIONS
+    kept = list(df.columns) if keep_realisations else ["station", "lon", "lat"]
+    assert list(result.columns[: len(kept)]) == kept
+    assert not set(realisations) & set(result.columns[len(kept) :])
@@ -0,0 +1,91 @@
+"""
+The numexpr and NumPy paths of the USGS_models.calculations functions give the same values, in float64 and float32,
+with and without precalculated shared terms and out buffers, and with NaN inputs
+"""
+
+import inspect
+import re
+
+import numpy as np
+import pytest
+
+from USGS_models import calculations, precision
+
+POINTS = 10_000
+REALISATIONS = 3
+# Relative and absolute tolerance of each dtype, the absolute one allowing for rounding in sums of terms up to ~30
+TOLERANCES = {np.float64: (1e-12, 1e-12), np.float32: (1e-5, 1e-5)}
+
+pytestmark = pytest.mark.skipif(
+    calculations.numexpr is None, reason="numexpr is not installed"
+)
+
+
+def model_functions(model):
+    """The (susceptibility, coverage, probability) functions of a model with their arguments"""
+    (
+        susceptibility_function,
+        site_inputs,
+        coverage_function,
+        ground_motion,
+        coverage_inputs,
+    ) = precision.MODELS[model]
+    rng = np.random.default_rng(0)
+    inputs = {name: precision.sample_input(rng, name, POINTS) for name in site_inputs}
+    # NaN site parameters, as where the grids have no data
+    for values in inputs.values():
+        values[rng.choice(POINTS, POINTS // 100)] = np.nan
+    ground_motions = precision.sample_input(rng, ground_motion, (POINTS, REALISATIONS))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        susceptibility = susceptibility_function(*inputs.values())
+    return [
+        (susceptibility_function, list(inputs.values())),
+        (
+            coverage_function,
+            [ground_motions]
+            + [inputs[name][:, np.newaxis] for name in coverage_inputs]
+            + [susceptibility[:, np.newaxis]],
+        ),
+        (
+            getattr(calculations, "calculate_{}_probability".format(model)),
+            [ground_motions[:, 0]] + list(inputs.values()),
+        ),
+    ]
+
+
+def shared_terms(function, args):
+    """The precalculated SHARED_TERMS the function takes, from its arguments"""
+    signature = inspect.signature(function)
+    arguments = signature.bind(*args).arguments
+    terms = {}
+    for name, expression in calculations.SHARED_TERMS.items():
+        if name in signature.parameters:
+            operation, argument = re.fullmatch(r"(\w+)\((\w+)\)", expression).groups()
+            terms[name] = getattr(np, operation)(arguments[argument])
+    return terms
+
+
+def evaluate(monkeypatch, use_numexpr, function, args, **kwargs):
+    monkeypatch.setattr(calculations, "_use_numexpr", lambda: use_numexpr)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return function(*args, **kwargs)
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+@pytest.mark.parametrize("precalculated", [False, True], ids=["terms", "shared"])
+@pytest.mark.parametrize("model", list(precision.MODELS))
+def test_numexpr_matches_numpy(monkeypatch, model, precalculated, dtype):
+    rtol, atol = TOLERANCES[dtype]
+    for function, args in model_functions(model):
+        args = [np.asarray(arg, dtype=dtype) for arg in args]
+        kwargs = shared_terms(function, args) if precalculated else {}
+        expected = evaluate(monkeypatch, False, function, args, **kwargs)
+        out = np.empty_like(expected)
+        actual = evaluate(monkeypatch, True, function, args, out=out, **kwargs)
+
+        assert actual is out
+        assert actual.dtype == expected.dtype == dtype
+        assert np.isnan(expected).any()
+        np.testing.assert_allclose(
+            actual, expected, rtol=rtol, atol=atol, err_msg=function.__name__
+        )
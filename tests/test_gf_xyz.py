@@ -0,0 +1,57 @@
+"""
+gf_xyz writes the same text as formatting each point with "%f" (as gen_gf_surface.py always has), and its binary
+coordinates are that text's millionths
+"""
+
+import numpy as np
+import pytest
+
+import gf_xyz
+
+HEADER = ["title", "label", "cpt", "range", "legend", "model label"]
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    x = np.concatenate(
+        [
+            rng.uniform(-180, 180, 10_000),
+            # Halfway between millionths, where "%f" rounds the exact binary value
+            np.round(rng.uniform(-180, 180, 10_000) * 2e6) / 2e6,
+            [-0.0, 0.0, -4e-7, 5e-7],
+        ]
+    )
+    y = rng.uniform(-50, -30, len(x))
+    values = rng.uniform(0, 1, len(x)).astype(np.float32)
+    values[::5] = np.nan
+    values[1] = np.inf
+    values[2] = -12345.5
+    return x, y, values
+
+
+def test_write_text_xyz(tmp_path, points):
+    x, y, values = points
+    fname = str(tmp_path / "points.xyz")
+    gf_xyz.write_text_xyz(fname, HEADER, x, y, values)
+
+    expected = "".join(line + "\n" for line in HEADER) + "".join(
+        "%f %f %f\n" % point for point in zip(x.tolist(), y.tolist(), values.tolist())
+    )
+    with open(fname, "rb") as f:
+        assert f.read() == expected.encode("ascii")
+
+
+def test_write_text_xyz_no_points(tmp_path):
+    fname = str(tmp_path / "empty.xyz")
+    gf_xyz.write_text_xyz(fname, HEADER, np.empty(0), np.empty(0), np.empty(0))
+    assert gf_xyz.read_header(fname) == HEADER
+    assert all(len(column) == 0 for column in gf_xyz.read_xyz(fname)[1:])
+
+
+def test_to_micro(points):
+    x, _, _ = points
+    expected = [int(("%f" % value).replace(".", "")) for value in x.tolist()]
+    np.testing.assert_array_equal(gf_xyz.to_micro(x), expected)
+    with pytest.raises(ValueError):
+        gf_xyz.to_micro([np.nan])
@@ -0,0 +1,115 @@
+"""
+Parameter stacks built by build_param_stack.py with --config, on small synthetic grids, calculate the shipped
+probability configs with calculate_gf --param_stack / --susceptibility_cache and calculate_gf_raster.py
+"""
+
+import glob
+import os
+
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+import build_param_stack
+import calculate_gf
+import gf_grids
+from USGS_models import precision
+
+CONFIGS = sorted(
+    os.path.splitext(os.path.basename(config_file))[0]
+    for config_file in glob.glob(
+        os.path.join(calculate_gf.DEFAULT_CONFIG_DIR, "*_probability_*.ini")
+    )
+)
+X = np.linspace(170, 172, 21)
+Y = np.linspace(-44, -42, 21)
+
+
+def write_grid(grid_file, z):
+    with Dataset(grid_file, "w") as ds:
+        ds.createDimension("x", len(X))
+        ds.createDimension("y", len(Y))
+        ds.createVariable("x", "f8", ("x",))[:] = X
+        ds.createVariable("y", "f8", ("y",))[:] = Y
+        ds.createVariable("z", "f4", ("y", "x"))[:] = z
+
+
+@pytest.fixture
+def models_dir(tmp_path):
+    """Synthetic grids of every param and config layer, and a pgv grid"""
+    configs = [calculate_gf.get_gfe_type(name) for name in CONFIGS]
+    rng = np.random.default_rng(0)
+    for name, grid_file in build_param_stack.get_grid_files(
+        str(tmp_path), configs
+    ).items():
+        write_grid(
+            grid_file,
+            precision.sample_input(
+                rng, precision.SITE_INPUTS[name], (len(Y), len(X))
+            ),
+        )
+    write_grid(
+        os.path.join(str(tmp_path), "pgv.grd"),
+        precision.sample_input(rng, "pgv", (len(Y), len(X))),
+    )
+    return str(tmp_path)
+
+
+def build_stack(models_dir, stack_dir, configs):
+    grid_files = build_param_stack.get_grid_files(
+        models_dir, [calculate_gf.get_gfe_type(name) for name in configs]
+    )
+    gf_grids.build_stack(grid_files, stack_dir, grid_files["VS30"])
+    return stack_dir
+
+
+def test_check_param_stack(models_dir, tmp_path):
+    gfe_type = [calculate_gf.get_gfe_type(name) for name in CONFIGS]
+    stack = build_stack(models_dir, str(tmp_path / "params"), [])
+    with pytest.raises(ValueError, match="build_param_stack.py --config"):
+        calculate_gf.check_param_stack(stack, gfe_type)
+    calculate_gf.check_param_stack(stack, list(calculate_gf.gfe_types))
+
+    stack = build_stack(models_dir, str(tmp_path / "configs"), CONFIGS)
+    calculate_gf.check_param_stack(stack, gfe_type)
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+def test_config_models_from_param_stack(models_dir, tmp_path, config):
+    gfe_type = [calculate_gf.get_gfe_type(config)]
+    stack = build_stack(models_dir, str(tmp_path / "params"), [config])
+    # At the grid nodes, where the cached susceptibility is the susceptibility of the sampled params
+    lons, lats = np.meshgrid(X[1:-1], Y[1:-1])
+    lons, lats = lons.ravel(), lats.ravel()
+
+    expected = calculate_gf.get_site_data(models_dir, lons, lats, gfe_type)
+    expected_susceptibility = calculate_gf.calculate_susceptibility(
+        gfe_type[0], expected
+    )
+    actual = calculate_gf.get_site_data(
+        models_dir,
+        lons,
+        lats,
+        gfe_type,
+        param_stack=stack,
+        susceptibility_cache=str(tmp_path / "cache"),
+    )
+    np.testing.assert_allclose(
+        actual[calculate_gf.get_susceptibility_column(gfe_type[0])],
+        expected_susceptibility,
+        rtol=1e-5,
+    )
+
+    metadata = calculate_gf.build_raster(
+        stack,
+        os.path.join(models_dir, "pgv.grd"),
+        str(tmp_path / "raster"),
+        gfe_type,
+        True,
+    )
+    assert metadata["bands"] == [
+        gfe_type[0].susceptibility_column,
+        gfe_type[0].probability_column.format("pgv"),
+    ]
+    _, raster = gf_grids.load_stack(str(tmp_path / "raster"))
+    assert np.isfinite(raster).all()
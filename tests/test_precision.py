@@ -0,0 +1,104 @@
+"""
+The float32 error against float64 stays within USGS_models.precision.FLOAT32_ERROR_BOUNDS, for the calculations
+functions and through calculate_gf.calculate_chunk (including the config models and tabulated coverage),
+with both the numexpr and NumPy paths
+"""
+
+import numpy as np
+import pytest
+
+import calculate_gf
+from USGS_models import calculations, coverage_tables, precision
+
+# Config models with the model in precision.MODELS whose bounds they are held to
+CONFIG_MODELS = {
+    "zhu_2016_general_probability_nz-specific-vs30": "zhu2016",
+    "zhu_2016_coastal_probability_topo-based-vs30": "zhu2016_coastal",
+    "jessee_2017_probability": "jessee2017",
+}
+POINTS = 100_000
+REALISATIONS = 3
+
+
+@pytest.fixture(params=[True, False], ids=["numexpr", "numpy"])
+def use_numexpr(request, monkeypatch):
+    if request.param and calculations.numexpr is None:
+        pytest.skip("numexpr is not installed")
+    monkeypatch.setattr(calculations, "_use_numexpr", lambda: request.param)
+    return request.param
+
+
+@pytest.fixture
+def stub_site_data(monkeypatch):
+    """Replaces calculate_gf.get_site_data with site parameters sampled from precision.INPUT_RANGES"""
+
+    def get_site_data(models_dir, lons, lats, gfe_type, index=None, **kwargs):
+        return precision.synthetic_site_data(
+            [param.name for param in calculate_gf.get_required_params(gfe_type)],
+            len(lons),
+            index,
+        )
+
+    monkeypatch.setattr(calculate_gf, "get_site_data", get_site_data)
+
+
+def test_float32_errors(use_numexpr):
+    errors = precision.check_float32_errors(n=POINTS)
+    assert set(errors) == set(precision.MODELS)
+
+
+@pytest.mark.parametrize("coverage_table_error", [None, 1e-6], ids=["exact", "table"])
+def test_calculate_chunk_float32_errors(
+    use_numexpr, stub_site_data, coverage_table_error
+):
+    gfe_type = list(calculate_gf.gfe_types) + [
+        calculate_gf.get_gfe_type(name) for name in CONFIG_MODELS
+    ]
+    df = precision.synthetic_input(POINTS, REALISATIONS)
+    expected = calculate_gf.calculate_chunk(
+        df.copy(), None, gfe_type, True, new_columns_only=True
+    )
+    actual = calculate_gf.calculate_chunk(
+        df.copy(),
+        None,
+        gfe_type,
+        True,
+        new_columns_only=True,
+        float32=True,
+        coverage_table_error=coverage_table_error,
+    )
+
+    for gfe, probability_column in calculate_gf.get_probability_columns(gfe_type):
+        model = CONFIG_MODELS.get(gfe.str_value, gfe.str_value)
+        susceptibility_bound, coverage_bound = precision.FLOAT32_ERROR_BOUNDS[model]
+        if (
+            coverage_table_error is not None
+            and gfe.str_value in coverage_tables.TABULATED_MODELS
+        ):
+            coverage_bound += coverage_table_error
+        columns = [(calculate_gf.get_susceptibility_column(gfe), susceptibility_bound)]
+        columns.extend(
+            (probability_column.format(realisation), coverage_bound)
+            for realisation in calculate_gf.get_model_realisations(
+                df.columns, [gfe]
+            )[gfe]
+        )
+        assert len(columns) == 1 + REALISATIONS
+        for column, bound in columns:
+            assert actual[column].dtype == np.float32
+            error = np.nanmax(
+                np.abs(actual[column].to_numpy(np.float64) - expected[column])
+            )
+            assert error <= bound, "{} float32 error {:.3g} is over {:.0e}".format(
+                column, error, bound
+            )
+
+
+def test_calculate_chunk_float32_keeps_input_columns(stub_site_data):
+    df = precision.synthetic_input(1000, REALISATIONS)
+    result = calculate_gf.calculate_chunk(
+        df.copy(), None, list(calculate_gf.gfe_types), True, float32=True
+    )
+    for column in df.columns.drop("station"):
+        assert result[column].dtype == np.float64
+        np.testing.assert_array_equal(result[column], df[column])